@@ -1,10 +1,23 @@
-from ROOT import *
+import ROOT
 
 import OutputFactory
 import PointerFactory
 import Timing
+import Catalog
+import Scheduler
+import Checkpoint
+import Renderer
+import Sampler
+import Statistics
+import HistogramFactory
+import Cutflow
+import Memory
 
 import sys
+import os.path
+import types
+import numpy
+import datetime
 
 ##
 # This is a general class for calculating a variable for an event. 
@@ -20,6 +33,12 @@ import sys
 # are appended to the values as a second entry in the tuple. The first entry is the
 # value.
 #
+# The histogramming analyses use the warray() function instead. It returns the values
+# and the weights as a pair of numpy arrays of the same length, with a single weight
+# broadcast to all of the values. No tuples are created along the way. A single number
+# with a single weight is returned as a pair of floats, without building arrays. Use
+# as_arrays() if arrays are needed in all cases.
+#
 # Each variable is required to have set the following properties:
 # - name: The name of the variable. Taken to be the class name by default
 # - type: The type of the variable. Taken to be float by default.
@@ -72,6 +91,61 @@ class Variable:
 
         return wvalues
 
+    # The value of this variable, along with the weight, as a pair of numpy arrays
+    # (values,weights). A weight of 1 is used if no weight variable is set.
+    #
+    # Returns None if the variable does not have a value.
+    def warray(self):
+        values=self.value()
+        if values==None: return None
+        weights=self.weight.value() if self.weight!=None else 1.
+        return weighted_array(values,weights)
+
+    # Describes this variable inside an expression that can be compiled by the
+    # ExpressionFactory. The variables that have to be evaluated before calling the
+    # compiled expression are collected in the inputs list, and are named x0, x1...
+    # in the order they are added. The backend argument is the name of the compiler
+    # that will be used.
+    #
+    # By default, a variable is an input to the expression. Composite variables
+    # (ie: SumVariable) override this to describe the calculation instead.
+    def expression(self,inputs,backend):
+        if self not in inputs:
+            inputs.append(self)
+        return 'x%d'%inputs.index(self)
+
+# Converts a value and a weight, either of which can be a list or a single number,
+# into a pair of numpy arrays of the same length. Numerical values are converted to
+# doubles, so they can be passed directly to TH1::FillN. Anything else (ie: labels)
+# is kept as is.
+#
+# A single number with a single weight is returned as a pair of floats instead. A
+# ValueError is raised if a list of weights does not match the values.
+def weighted_array(values,weights):
+    if isinstance(values,_numbers) and isinstance(weights,_numbers):
+        return (float(values),float(weights))
+
+    values=numpy.atleast_1d(numpy.asarray(values))
+    if values.dtype.kind in 'biuf':
+        values=values.astype('d')
+
+    weights=numpy.asarray(weights,dtype='d')
+    if weights.ndim==0:
+        weights=numpy.full(len(values),weights,dtype='d')
+    elif len(weights)!=len(values):
+        raise ValueError('%d weights for %d values'%(len(weights),len(values)))
+
+    return (values,weights)
+
+_numbers=(int,long,float) # Types returned as floats by weighted_array (includes bool)
+
+# Returns the (values,weights) pair returned by warray() as numpy arrays, also for a
+# single number.
+def as_arrays(wvalues):
+    values,weights=wvalues
+    if type(values)!=float: return wvalues
+    return (numpy.array((values,)),numpy.array((weights,)))
+
 ##
 ## This is a general class that can be used to implement cuts on events
 ##
@@ -103,12 +177,66 @@ class Cut:
     def cut(self):
         return False
 
+# Returns a string describing the class and configuration of a Variable or a Cut,
+# including all of the variables that it uses. Two objects with the same description
+# calculate the same thing. A CachedVariable is described by the variable it wraps.
+# The current event and cached values are not included.
+#
+# Any other object (ie: histograms, functions) is described by its identity, so only
+# objects sharing the very same one can have the same description. Such objects are
+# appended to the unknown list, if given, since their description is not the same
+# from one run to the next.
+def describe(obj,visited=None,unknown=None):
+    import VariableFactory
+    if visited==None: visited=set()
+
+    if isinstance(obj,numpy.generic):
+        obj=obj.item()
+    if obj is None or isinstance(obj,(int,long,float,basestring)):
+        return repr(obj)
+    if isinstance(obj,numpy.ndarray):
+        obj=obj.tolist()
+    if type(obj) in [list,tuple]:
+        return '[%s]'%','.join([describe(item,visited,unknown) for item in obj])
+    if type(obj) in [set,frozenset]:
+        return '{%s}'%','.join(sorted([describe(item,visited,unknown) for item in obj]))
+    if type(obj)==dict:
+        return '{%s}'%','.join(['%s:%s'%(describe(k,visited,unknown),describe(v,visited,unknown)) for k,v in sorted(obj.items())])
+    if type(obj) in [type,types.ClassType]:
+        return obj.__name__
+    if not isinstance(obj,Variable) and not isinstance(obj,Cut):
+        if unknown!=None: unknown.append(obj)
+        return '<%s at 0x%x>'%(type(obj).__name__,id(obj))
+
+    if isinstance(obj,VariableFactory.CachedVariable):
+        obj=obj.variable
+    if id(obj) in visited:
+        return '<recursive>'
+    visited.add(id(obj))
+
+    attrs=[]
+    for key,value in sorted(obj.__dict__.items()):
+        if key in ['event','eventfile'] or key.startswith('cached_'): continue
+        attrs.append('%s=%s'%(key,describe(value,visited,unknown)))
+    return '%s.%s(%s)'%(obj.__class__.__module__,obj.__class__.__name__,','.join(attrs))
+
 ## This is a class that describes an event file.
 ## The required input parameters are:
 ##  path - The path to the ROOT file
 ##  treeName - The name of the tree to loop over
 ##
-## Any extra keyed arguments are set as attributes.
+## Any extra keyed arguments are set as attributes. The following ones control
+## how the tree is read:
+##  cachesize - Size of the TTreeCache in bytes. The baskets of the branches read
+##              during the first entries are then fetched in large blocks. Set to
+##              None to leave the cache untouched. (30 MB by default)
+##  readahead - Decompress the baskets in the TTreeCache on background threads
+##              (TTreeCacheUnzip), ahead of the entries being processed. The next
+##              entries are then already unpacked when GetEntry is called, while the
+##              Python code runs on the current one. In ROOT 6, the background
+##              threads are only used if the implicit multi-threading of ROOT is
+##              enabled, which the Manager does when any of the event files has the
+##              read-ahead turned on (see Manager.readahead). (False by default)
 ##
 ## There are also some other parameters required by different derivatives
 ## of the Analysis class.
@@ -117,6 +245,9 @@ class Cut:
 ##  eff - efficiency of cuts (available only after running analysis)
 ##  fh - TFile object, when opened
 ##  tree - The TTree being used
+##  records - The Catalog metadata of each input file (available after the
+##            Manager has planned the run)
+##  planned_entries - The number of entries in the input files, from the Catalog
 ##  
 class EventFile:
     def __init__(self,path,treeName,*args,**kwargs):
@@ -132,6 +263,9 @@ class EventFile:
         self.branch_pointers={}
         self.branch_type={}
 
+        self.cachesize=30000000
+        self.readahead=False
+
         for k in kwargs:
             v=kwargs[k]
             setattr(self,k,v)
@@ -141,12 +275,41 @@ class EventFile:
     #
     # Return: True if sucessful, false otherwise.
     def load_tree(self):
-        self.fh=TFile.Open(self.path)
+        self.fh=ROOT.TFile.Open(self.path)
         if self.fh.FindKey(self.treeName)==None:
             return False
         self.tree=self.fh.Get(self.treeName)
+        self.configure_cache()
         return True
 
+    # Set up the TTreeCache and the read-ahead of the tree
+    def configure_cache(self):
+        if self.cachesize==None: return
+        self.tree.SetCacheSize(self.cachesize)
+        if self.readahead:
+            self.tree.SetParallelUnzip(True)
+
+    # Returns a list of the (path,tree) pairs of the input files, used to look
+    # them up in the Catalog.
+    def inputs(self):
+        paths=self.path if type(self.path)==list else [self.path]
+        return [(path,self.treeName) for path in paths]
+
+    # Returns the number of entries that will be looped over
+    def nentries(self):
+        return self.tree.GetEntries()
+
+    # Returns an iterator over the indices of the entries in the tree that will be
+    # looped over. Only entries in the range [first,last) are returned, with last
+    # set to None meaning until the end of the tree.
+    def entries(self,first=0,last=None):
+        if last==None: last=self.tree.GetEntries()
+        return xrange(first,min(last,self.tree.GetEntries()))
+
+    # Returns the number of entries returned by entries(first,last)
+    def count(self,first=0,last=None):
+        return len(self.entries(first,last))
+
     # Load the corresponding event
     def event(self,idx):
         self.tree.GetEntry(idx)
@@ -256,7 +419,7 @@ class Event:
             return float(pointer[0])
         elif type in ['Bool_t']:
             return bool(pointer[0])
-        elif type==std.string:
+        elif type==ROOT.std.string:
             return str(pointer)
         else:
             return pointer
@@ -273,6 +436,14 @@ class Event:
 ##
 ## Everything is run when the run() function is called.
 ##
+## When the work is split over several processes, each process runs its own copy of
+## the analysis on part of the event files. The results are then combined into a
+## single analysis using the following functions, before deinit is called once on
+## the merged state:
+##   - serialize returns the results of the analysis, in a picklable form
+##   - merge adds the results returned by serialize of another copy of the
+##     analysis to this one
+##
 ## It is also possible to add "cuts", using the Cut classes. When these cuts are
 ## added, then only events that pass them are processed by the event function.
 ##
@@ -312,6 +483,28 @@ class Analysis:
     # Called after stuff is done runnning
     def deinit(self):
         pass
+
+    # Called after deinit_eventfile when the Manager frees the memory used by each
+    # event file (see Manager.release). Should release the histograms that are not
+    # filled again before deinit (see HistogramFactory).
+    def release_eventfile(self):
+        pass
+
+    # Returns the list of variables that are filled into histograms, and so need a
+    # binning (nbins/minval/maxval or bins attributes). The Manager picks one for
+    # the variables that do not define it.
+    def binned_variables(self):
+        return []
+
+    # Returns the results of this analysis as a dictionary of picklable objects
+    # (ROOT objects can be pickled).
+    def serialize(self):
+        return {}
+
+    # Add the results of another copy of this analysis, as returned by its
+    # serialize function.
+    def merge(self,state):
+        pass
             
     # Helps to store stuff during the run of the analysis, so the things are
     # not being deleted.
@@ -330,35 +523,144 @@ class Analysis:
 ## The idx is replaced by the number of the cut in the list. The two histograms correspond
 ## to the passed events and all events. The values filled into the histogram are determined by
 ## Cut.variable attribute. This should have attributes minval,maxval and nbins to dictate
-## the binning of the histogram.
+## the binning of the histogram. The cuts are applied and counted by a Cutflow, which
+## books the histograms once using the HistogramFactory and fills them in bulk. The
+## cutflow of all of the event files is printed at the end.
 ##
 ## In addition, the "cuts" attribute of the Analysis instance is also queried to determine if
 ## it should be run on the event.
 ##
 ## Internal parameters that configure this class are:
-##  nevents - Causes the analysis to process only the first nevents events from
-##            each event file. Set to None to go over all of them. (None by 
-##            default)
+##  nevents - Causes the analysis to process only nevents events from each event
+##            file. Set to None to go over all of them. (None by default)
+##  nevents_total - Causes the analysis to process only nevents_total events in
+##                  total, spread over the event files proportionally to their
+##                  number of entries. Set to None to go over all of them. (None by
+##                  default)
+##  sampling - How the events are selected when only some of the events in a file
+##             are processed: 'first', 'stride' or 'random' (see Sampler). ('first'
+##             by default)
+##  seed - The seed for the 'stride' and 'random' sampling. (0 by default)
+##  autobin_entries - Number of entries read before the run to pick the binning of
+##                    the variables used by the analyses or cuts that do not define
+##                    nbins/minval/maxval or bins (see autobin). The entries are
+##                    spread over the event files, and the cuts are applied to them
+##                    before the values are used. Set to None to disable. (10000 by
+##                    default)
 ##  eventfiles - A list of EventFile objects that represent the event files
 ##               to be looped over.
 ##  cuts - A list of Cut objects that represent the cuts that will be
 ##         applied
 ##  analysis - A list of Analysis object to execute.
+##  nthreads - Number of processes used to read the metadata of the event files into
+##             the Catalog. (8 by default)
+##  nworkers - Number of worker processes. If more than one, the event files are
+##             distributed over a pool of processes by the Scheduler. (1 by default)
+##  chunksize - Split event files with more entries than this into several pieces
+##              of work for the worker processes. (None by default, no splitting)
+##              Cannot be used with nevents, nevents_total or analyses normalizing
+##              each event file (norm_mode), since these would be applied to each
+##              piece separately.
+##  readahead - Number of threads decompressing the trees ahead of the event loop
+##              (see EventFile.readahead). If set, the read-ahead is turned on for
+##              all of the event files. The implicit multi-threading of ROOT is
+##              enabled with this many threads in each process (0 for the number of
+##              cores) whenever an event file uses the read-ahead. (None by default)
+##  warmup - Number of entries read from event files without a measured cost to
+##           measure the time per entry before scheduling the work. (100 by default)
+##  scan - Share the cuts of the analyses that are identical (ie: all of the loop
+##         configurations use the same cuts), so each one is evaluated only once
+##         per event. (False by default)
+##  checkpoint - Number of seconds between checkpoints of the run, stored inside the
+##               results directory (see Checkpoint). The time is checked for each
+##               entry and after each event file. Only used when running in a single
+##               process. (None by default, no checkpoints)
+##  resume - Resume the run from the checkpoint inside the results directory.
+##           (False by default)
+##  cutflow_histograms - Fill and write the cutflow histograms. If False, only the
+##                       number of events passing each cut is counted. (True by
+##                       default)
+##  cutflow_timing - Measure the time spent in each cut. (False by default)
+##  memory_report - Print the peak RSS and the number of objects in memory after
+##                  each event file (see Memory). (True by default)
+##  release - List of policies for freeing memory after each event file, so that the
+##            memory used by runs over many event files is bounded:
+##             'histograms' - The analyses release the histograms of the event file
+##                            to the spill file (see Analysis.release_eventfile)
+##             'files' - The cutflow file of the event file is closed
+##             'cache' - The cached values of the variables, and the values of the
+##                       persistent variables (see ColumnCache), are freed
+##            ([] by default)
 class Manager:
     def __init__(self):
         self.nevents=None
+        self.nevents_total=None
+        self.sampling='first'
+        self.seed=0
+        self.autobin_entries=10000
         self.eventfiles=[]
         self.cuts=[]
         self.analysis=[]
+        self.scan=False
+        self.nthreads=8
+        self.nworkers=1
+        self.chunksize=None
+        self.readahead=None
+        self.warmup=100
+        self.checkpoint=None
+        self.resume=False
+        self.cutflow_histograms=True
+        self.cutflow_timing=False
+        self.memory_report=True
+        self.release=[]
+
+        self.resumed=None # The state loaded from the checkpoint, when resuming
+        self.last_checkpoint=None
 
         self.event=None
         self.eventfile=None
 
+        Memory.register('stored objects',lambda: sum([len(analysis.store_list) for analysis in self.analysis]))
+
     # Called before stuff is run
     def init(self):
+        if self.scan: self.share_cuts()
+
+        # The read-ahead only runs in the background with the implicit multi-threading
+        if self.readahead!=None:
+            for eventfile in self.eventfiles:
+                eventfile.readahead=True
+        if any(eventfile.readahead for eventfile in self.eventfiles) and not ROOT.IsImplicitMTEnabled():
+            ROOT.EnableImplicitMT(self.readahead if self.readahead!=None else 0)
+
+        # The cutflow of the current event file and the total of all of them. The
+        # histograms are booked outside of the output files.
+        ROOT.gROOT.cd()
+        self.cutflow=Cutflow.Cutflow(self.cuts,self.cutflow_histograms,self.cutflow_timing)
+        self.total_cutflow=Cutflow.Cutflow(self.cuts,False,self.cutflow_timing)
+
         for analysis in self.analysis:
             analysis.init()
 
+    # Replace identical cuts in all of the analyses by a single instance, so that
+    # it can be evaluated only once per event.
+    def share_cuts(self):
+        shared={}
+        ncuts=0
+        for analysis in self.analysis:
+            for cidx in range(len(analysis.cuts)):
+                cut=analysis.cuts[cidx]
+                key=describe(cut)
+                if key not in shared:
+                    shared[key]=cut
+                analysis.cuts[cidx]=shared[key]
+                ncuts+=1
+
+        self.cut_requests=0
+        self.cut_evaluations=0
+        self.cut_timing=Timing.Timing()
+        print 'Scan mode: %d unique cuts out of %d'%(len(shared),ncuts)
+
     # Called before an event file is looped over
     def init_eventfile(self):
         for analysis in self.analysis:
@@ -367,159 +669,430 @@ class Manager:
 
     # Called for each event that passes the cuts
     def run_event(self):
+        decisions={} # Shared cut decisions for this event, keyed by the cut
         for analysis in self.analysis:
             analysis.event=self.event
             docut=False
             for cut in analysis.cuts:
-                cut.event=self.event
-                if cut.cut()!=cut.invert:
-                    docut=True
-                    break
+                if self.scan:
+                    docut=self.shared_cut(cut,decisions)
+                else:
+                    cut.event=self.event
+                    docut=(cut.cut()!=cut.invert)
+                if docut: break
             if docut: continue
             analysis.run_event()
+
+    # Returns whether the event should be cut, evaluating the cut only if it was not
+    # evaluated yet for this event.
+    def shared_cut(self,cut,decisions):
+        self.cut_requests+=1
+        key=id(cut)
+        if key not in decisions:
+            cut.event=self.event
+            self.cut_timing.start()
+            decisions[key]=(cut.cut()!=cut.invert)
+            self.cut_timing.end()
+            self.cut_evaluations+=1
+        return decisions[key]
     
     # Called after an event file is completly looped over
     def deinit_eventfile(self):
         for analysis in self.analysis:
             analysis.deinit_eventfile()
 
+    # Free the memory used by the event file eventfileidx, following the release
+    # policies
+    def release_eventfile(self,eventfileidx):
+        if 'histograms' in self.release:
+            for analysis in self.analysis:
+                analysis.release_eventfile()
+        if 'files' in self.release and self.cutflow_histograms:
+            OutputFactory.close('cutflow_%d.root'%eventfileidx)
+        if 'cache' in self.release:
+            Memory.release()
+
     # Called after stuff is done runnning
     def deinit(self):
         while len(self.analysis)>0:
             analysis=self.analysis.pop(0)
             analysis.deinit()
 
+    # Returns the results of all of the analyses and the names of the output files
+    def serialize(self):
+        return {'analysis':[analysis.serialize() for analysis in self.analysis],
+                'cutflow':self.total_cutflow,
+                'files':[(name,os.path.join(OutputFactory.results(),name)) for name in OutputFactory.names()]}
+
+    # Add the results of another Manager, as returned by its serialize function
+    def merge(self,state):
+        for analysis,analysis_state in zip(self.analysis,state['analysis']):
+            analysis.merge(analysis_state)
+        self.total_cutflow.merge(state['cutflow'])
+
+    # Merge the output files of other Managers, as listed by their serialize function,
+    # into the results directory. Files that this Manager has written itself are
+    # skipped, their contents are combined by the merge function of the analyses.
+    def merge_files(self,states):
+        written=OutputFactory.names()
+        files={}
+        for state in states:
+            for name,path in state['files']:
+                if name in written or name==HistogramFactory.spillname: continue
+                files.setdefault(name,[]).append(path)
+
+        for name,paths in sorted(files.items()):
+            OutputFactory.mergeFiles(name,paths)
+
+    # Look up the metadata of all of the event files in the Catalog, reading it in
+    # parallel for the files that are not in it yet. Returns the total number of
+    # entries in all of the event files.
+    def plan(self):
+        inputs=[]
+        for eventfile in self.eventfiles:
+            inputs+=eventfile.inputs()
+        records=Catalog.prefetch(inputs,self.nthreads)
+
+        total=0
+        for eventfile in self.eventfiles:
+            eventfile.records=records[:len(eventfile.inputs())]
+            records=records[len(eventfile.records):]
+            eventfile.planned_entries=sum([record['entries'] for record in eventfile.records])
+            total+=eventfile.planned_entries
+
+        # Spread the total number of events to process over the event files
+        shares=[None]*len(self.eventfiles)
+        if self.nevents_total!=None:
+            shares=Sampler.spread(self.nevents_total,[eventfile.planned_entries for eventfile in self.eventfiles])
+        for eventfile,share in zip(self.eventfiles,shares):
+            eventfile.planned_budget=share
+        return total
+
+    # Returns a list of (variable,requirements) for the variables used by the analyses
+    # and cuts that do not define their binning. The requirements are the lists of
+    # cuts that an event has to pass for the variable to be filled, one for each
+    # place where the variable is used.
+    def unbinned_variables(self):
+        used=[]
+        for analysis in self.analysis:
+            used+=[(variable,self.cuts+analysis.cuts) for variable in analysis.binned_variables()]
+        for cutidx in range(len(self.cuts)):
+            variable=getattr(self.cuts[cutidx],'variable',None)
+            if variable!=None: used.append((variable,self.cuts[:cutidx]))
+
+        unbinned=[]
+        requirements=[]
+        for variable,cuts in used:
+            if not isinstance(variable,Variable): continue
+            if hasattr(variable,'bins'): continue
+            if hasattr(variable,'nbins') and hasattr(variable,'minval') and hasattr(variable,'maxval'): continue
+            if variable in unbinned:
+                requirements[unbinned.index(variable)].append(cuts)
+            else:
+                unbinned.append(variable)
+                requirements.append([cuts])
+        return zip(unbinned,requirements)
+
+    # Returns whether the current event passes all of the cuts. Each cut is evaluated
+    # only once per event, with the decisions stored in the decisions dictionary.
+    def passes(self,cuts,event,decisions):
+        for cut in cuts:
+            key=id(cut)
+            if key not in decisions:
+                cut.event=event
+                decisions[key]=(cut.cut()!=cut.invert)
+            if decisions[key]: return False
+        return True
+
+    # Pick the binning of the variables that do not define one. Their values are
+    # summarized for a sample of autobin_entries entries, spread over the event files
+    # and evenly over the entries of each file. A value is only summarized if the
+    # event passes the cuts applied before the variable is filled (the cuts of the
+    # Manager and of the analysis, or the previous cuts for the variable of a cut), so
+    # the binning covers the values that are filled. The nbins, minval and maxval
+    # attributes are then set from the summaries (see Statistics.binning).
+    def autobin(self):
+        used=self.unbinned_variables()
+        if len(used)==0 or self.autobin_entries==None: return
+
+        variables=[variable for variable,requirements in used]
+        summaries=[Statistics.Summary() for variable in variables]
+        shares=Sampler.spread(self.autobin_entries,[eventfile.planned_entries for eventfile in self.eventfiles])
+        for eventfile,share in zip(self.eventfiles,shares):
+            if share==0 or True not in [record['valid'] for record in eventfile.records]: continue
+            if not eventfile.load_tree(): continue
+            eventfile.tree.SetBranchStatus("*",0)
+            Variable.eventfile=eventfile
+
+            seed='%d:%s'%(self.seed,str(eventfile.path))
+            for evt_idx in Sampler.sample(eventfile.entries(),eventfile.count(),share,'stride',seed):
+                event=eventfile.event(evt_idx)
+                event.idx=evt_idx
+                Variable.event=event
+                decisions={}
+                for (variable,requirements),summary in zip(used,summaries):
+                    if not any(self.passes(cuts,event,decisions) for cuts in requirements): continue
+                    wvalues=variable.warray()
+                    if wvalues!=None: summary.add(*wvalues)
+            eventfile.close()
+
+            # The pointers are bound to the closed tree
+            eventfile.branch_pointers={}
+            eventfile.branch_type={}
+            eventfile.eventidx=None
+
+        for variable,summary in zip(variables,summaries):
+            integer=variable.type in [int,bool] or variable.type in [(list,int),(list,bool)]
+            binning=Statistics.binning(summary,integer)
+            if binning==None:
+                print 'WARNING: No values to pick the binning of variable %s'%variable.name
+                binning=(1,0.,1.)
+            variable.nbins,variable.minval,variable.maxval=binning
+            print 'Binning of variable %s: %d bins in [%g,%g]'%(variable.name,variable.nbins,variable.minval,variable.maxval)
+
+    # Returns the number of events to process from an event file, or None to
+    # process all of them.
+    def budget(self,eventfileidx):
+        budgets=[self.nevents,self.eventfiles[eventfileidx].planned_budget]
+        budgets=[budget for budget in budgets if budget!=None]
+        if len(budgets)==0: return None
+        return min(budgets)
+
+    # Make sure that the event files can be split into pieces, if requested. The
+    # number of events to process and the normalization of the analyses are applied
+    # to each piece, not to the whole event file.
+    def check_chunks(self):
+        if self.nworkers<=1 or self.chunksize==None: return
+        if self.nevents!=None or self.nevents_total!=None:
+            raise ValueError('chunksize cannot be used together with nevents or nevents_total')
+        for analysis in self.analysis:
+            if getattr(analysis,'norm_mode','none')!='none':
+                raise ValueError('chunksize cannot be used together with norm_mode \'%s\' of %s'%(analysis.norm_mode,analysis.__class__.__name__))
+
     # This takes care of running everything. After you setup the
     # configuration of your analysis, run this!
     def run(self):
+        self.check_chunks()
         OutputFactory.setOutputName(self.name)
-        self.init()
-
-        timing=Timing.Timing()
+        self.total_entries=self.plan()
+        print 'Total Number of Entries: %d'%self.total_entries
+        self.autobin()
+
+        # The output files are written and closed at the end, even if the run fails
+        with OutputFactory.session():
+            self.start_time=datetime.datetime.now()
+            self.done_entries=0
+            self.timing=Timing.Timing()
+
+            if self.nworkers>1:
+                units=Scheduler.schedule(self)
+                states=Scheduler.run(self,units)
+
+                self.init()
+                for state in states:
+                    self.merge(state)
+                self.finish()
+                self.merge_files(states)
+                return
+
+            position=(0,0)
+            if self.resume:
+                self.resumed=self.load_checkpoint()
+
+            self.init()
+            if self.resumed!=None:
+                position=self.resumed['position']
+                self.merge(self.resumed)
+
+            self.last_checkpoint=datetime.datetime.now()
+            for eventfileidx in range(position[0],len(self.eventfiles)):
+                if eventfileidx==position[0] and position[1]>0:
+                    self.process(eventfileidx,position[1],cutflow=self.resumed['eventfile_cutflow'])
+                else:
+                    self.process(eventfileidx)
+                if self.checkpoint_due():
+                    self.save_checkpoint(eventfileidx+1,0)
+            self.finish()
+
+            # Output files of the checkpoint that were not written again
+            if self.resumed!=None:
+                self.merge_files([self.resumed])
+
+    # Whether the time since the last checkpoint is longer than the interval
+    def checkpoint_due(self):
+        if self.checkpoint==None: return False
+        return Scheduler.seconds(datetime.datetime.now()-self.last_checkpoint)>self.checkpoint
+
+    # Store the state of the run inside the checkpoint file. The run can be resumed
+    # from the entry "entry" of the event file eventfileidx. The Cutflow of that
+    # event file is also stored if given.
+    def save_checkpoint(self,eventfileidx,entry,cutflow=None):
+        OutputFactory.flush()
+
+        state=self.serialize()
+        state['name']=self.name
+        state['inputs']=[(eventfile.path,eventfile.treeName) for eventfile in self.eventfiles]
+        state['position']=(eventfileidx,entry)
+        state['eventfile_cutflow']=cutflow
+        Checkpoint.save(state)
+        self.last_checkpoint=datetime.datetime.now()
+
+    # Load the checkpoint file, if it matches this run, and move its output files
+    # out of the way. Returns the loaded state or None.
+    def load_checkpoint(self):
+        state=Checkpoint.load()
+        if state==None:
+            print 'No checkpoint found inside %s, starting from the beginning'%OutputFactory.results()
+            return None
+
+        inputs=[(eventfile.path,eventfile.treeName) for eventfile in self.eventfiles]
+        if state['name']!=self.name or state['inputs']!=inputs:
+            print 'WARNING: Checkpoint inside %s is for a different run, starting from the beginning'%OutputFactory.results()
+            return None
+
+        eventfileidx,entry=state['position']
+        self.done_entries=sum([eventfile.planned_entries for eventfile in self.eventfiles[:eventfileidx]])+entry
+        print 'Resuming from entry %d of event file %d'%(entry,eventfileidx)
+        return Checkpoint.relocate(state)
+
+    # Called after all of the event files are processed
+    def finish(self):
+        self.deinit()
+        Renderer.render()
+        Catalog.save()
+        print '== End Statistics =='
+        if self.nworkers>1:
+            print 'Peak RSS: %.1f MB (workers: %.1f MB)'%(Memory.peak_rss(),Memory.peak_rss(True))
+        else:
+            print 'Peak RSS: %.1f MB'%Memory.peak_rss()
+        print 'Total Cut Flow:'
+        self.total_cutflow.summary()
+        print 'Average Time Per Event: %s'%str(self.timing.average())
+        if self.scan and self.cut_evaluations>0:
+            saved=(self.cut_requests-self.cut_evaluations)*self.cut_timing.average()
+            print 'Cut Evaluations: %d/%d'%(self.cut_evaluations,self.cut_requests)
+            print 'Cut Evaluation Speedup: %.2fx (%s saved)'%(1.*self.cut_requests/self.cut_evaluations,str(saved))
+
+    # Process the entries in the range [first,last) of an event file. The range is
+    # the full tree by default. The Cutflow stored in a checkpoint can be passed in
+    # cutflow to continue the event file from first.
+    def process(self,eventfileidx,first=0,last=None,cutflow=None):
+        timing=self.timing
+        eventfile=self.eventfiles[eventfileidx]
+        Variable.eventfile=eventfile
+        Variable.event=None
+        
+        self.eventfile=eventfile
 
-        for eventfileidx in range(len(self.eventfiles)):
-            eventfile=self.eventfiles[eventfileidx]
-            Variable.eventfile=eventfile
-            Variable.event=None
-            
-            self.eventfile=eventfile
+        if True not in [record['valid'] for record in eventfile.records]:
+            print "ERROR: Tree not found in %s!"%str(eventfile.path)
+            return
 
-            # Initialzie the cutflow information for this event
+        # Initialzie the cutflow information for this event
+        if self.cutflow_histograms:
             eventfile.cutflow_fh=OutputFactory.getTFile('cutflow_%d.root'%eventfileidx)
-            for cutidx in range(len(self.cuts)):
-                cut=self.cuts[cutidx]
-                # Configure cuts
-                cut.eventfile=eventfile
-                cut.event=None
-
-                # Create necessary histograms
-                minval=cut.variable.minval if cut.variable!=None else 0.
-                maxval=cut.variable.maxval if cut.variable!=None else 1.
-                nbins=cut.variable.nbins if cut.variable!=None else 1
-                title=cut.variable.title if cut.variable!=None and hasattr(cut.variable,'title') else ''
-                xtitle='%s (%s)'%(title,cut.variable.units) if cut.variable!=None and hasattr(cut.variable,'units') else title
-                cut.passed=TH1D('cut%02d_passed'%cutidx,'',
-                                nbins,minval,maxval)
-                cut.all=TH1D('cut%02d_all'%cutidx,'',
-                                nbins,minval,maxval)
-                cut.passed.SetXTitle(xtitle)
-                cut.all.SetXTitle(xtitle)
-                cut.count=0
-
-            # Open the file
-            eventfile.load_tree()
-            if eventfile.tree==None:
-                print "ERROR: Tree not found!"
-                continue
-            if eventfile.tree.GetEntries()==0:
-                print 'Warning: Tree has no entries!'
-
-            eventfile.tree.SetBranchStatus("*",0)
-            
-            gROOT.cd()
+        for cut in self.cuts:
+            # Configure cuts
+            cut.eventfile=eventfile
+            cut.event=None
+
+        # Counters from the checkpoint
+        self.cutflow.reset()
+        if cutflow!=None:
+            self.cutflow.merge(cutflow)
+
+        # Open the file
+        eventfile.load_tree()
+        if eventfile.tree==None:
+            print "ERROR: Tree not found!"
+            return
+        if eventfile.nentries()==0:
+            print 'Warning: Tree has no entries!'
+
+        eventfile.tree.SetBranchStatus("*",0)
+        
+        ROOT.gROOT.cd()
 
-            # Clear the branch pointers in an event
-            Event.branch_pointers={}
-            Event.branch_type={}
+        # Clear the branch pointers in an event. Those of the event file are bound
+        # to the tree of a previous piece of the file, if it was already processed.
+        Event.branch_pointers={}
+        Event.branch_type={}
+        eventfile.branch_pointers={}
+        eventfile.branch_type={}
+        eventfile.eventidx=None
 
-            self.init_eventfile()
+        self.init_eventfile()
 
-            print "********************************************************************************"
-            print "* Event File: %s   Event Tree: %s       "%(eventfile.path,eventfile.treeName)
-            print "* Number of Events: %d                  "%eventfile.tree.GetEntries()
-            print "********************************************************************************"
+        print "********************************************************************************"
+        print "* Event File: %s   Event Tree: %s       "%(eventfile.path,eventfile.treeName)
+        print "* Number of Events: %d                  "%eventfile.nentries()
+        print "********************************************************************************"
 
-            # Loop over every event
-            events_passed=0
-            events_processed=0
-            
-            nEvents=0
-            if(self.nevents!=None):
-                nEvents=self.nevents
-            else:
-                nEvents=eventfile.tree.GetEntries()
-
-            for evt_idx in range(eventfile.tree.GetEntries()):
-                events_processed+=1
-
-                if events_processed>nEvents:
-                    events_processed=nEvents
-                    break
-
-                self.event=eventfile.event(evt_idx)
-                self.event.idx=evt_idx
-                Variable.event=self.event
-
-                print "=============================="
-                print " Event: %d                    "%self.event.idx
-                print "=============================="
-                # Check for cuts..
-                docut=False
-                for cidx in range(len(self.cuts)):
-                    cut=self.cuts[cidx]
-                    cut.event=self.event
-
-                    values=cut.variable.value() if cut.variable!=None else 0.
-                    if(type(values)!=list): values=[values]
-                    for value in values:
-                        if value==None: continue
-                        cut.all.Fill(value)
-                    
-                    if cut.cut()!=cut.invert:
-                        docut=True
-                        break
-                    for value in values:
-                        if value==None: continue
-                        cut.passed.Fill(value)
-                        cut.count+=1
-
-                        
-                if docut:
-                    print "!!!! THIS EVENT HAS BEEN CUT !!!!"
-                    continue
-                else:
-                    events_passed+=1
-                print ""
-
-                ## Run the user code
-                timing.start()
-                self.run_event()
-                timing.end()
-
-            if events_processed>0: eventfile.eff=1.0*events_passed/events_processed
-            else: eventfile.eff=1.
-            self.deinit_eventfile()
-            # Print out a summary
-            print 'Cut Flow:'
-            self.eventfile.cutflow_fh.cd()
-            for cut in self.cuts:
-                cut.passed.Write()
-                cut.all.Write()
-                print '\tPassing cut %s: %d'%(cut.__class__.__name__,cut.count)
-            print "Cut Efficiency: %d/%d = %f"%(events_passed,events_processed,eventfile.eff)
-
-            eventfile.close()
-        self.deinit()
-        print '== End Statistics =='
-        print 'Average Time Per Event: %s'%str(timing.average())
-            
+        # Loop over every event
+        checkpoints=self.checkpoint!=None and self.nworkers<=1
+        
+        # Number of events to process in this range. When only part of the event
+        # file is processed, it gets its share of the budget.
+        nentries=eventfile.count(first,last)
+        nEvents=self.budget(eventfileidx)
+        if nEvents!=None:
+            if cutflow!=None:
+                nEvents=max(nEvents-cutflow.events_processed,0)
+            elif nentries<eventfile.nentries():
+                nEvents=int(round(1.*nEvents*nentries/max(eventfile.nentries(),1)))
+
+        seed='%d:%s'%(self.seed,str(eventfile.path))
+        entries=Sampler.sample(eventfile.entries(first,last),nentries,nEvents,self.sampling,seed)
+
+        start_time=datetime.datetime.now()
+        for evt_idx in entries:
+            if checkpoints and self.checkpoint_due():
+                self.save_checkpoint(eventfileidx,evt_idx,self.cutflow)
+            OutputFactory.update()
+
+            self.event=eventfile.event(evt_idx)
+            self.event.idx=evt_idx
+            Variable.event=self.event
+
+            print "=============================="
+            print " Event: %d                    "%self.event.idx
+            print "=============================="
+            # Check for cuts..
+            if self.cutflow.apply(self.event):
+                print "!!!! THIS EVENT HAS BEEN CUT !!!!"
+                continue
+            print ""
+
+            ## Run the user code
+            timing.start()
+            self.run_event()
+            timing.end()
+
+        events_processed=self.cutflow.events_processed
+        eventfile.eff=self.cutflow.efficiency()
+        self.deinit_eventfile()
+        # Print out a summary
+        print 'Cut Flow:'
+        if self.cutflow_histograms:
+            self.cutflow.write(self.eventfile.cutflow_fh)
+            ROOT.gROOT.cd()
+        self.cutflow.summary()
+        self.total_cutflow.merge(self.cutflow)
+
+        eventfile.close()
+        self.release_eventfile(eventfileidx)
+        if self.memory_report: Memory.report()
+
+        # Measured cost per entry, used by the Scheduler in the next runs
+        elapsed=datetime.datetime.now()-start_time
+        if events_processed>0:
+            Catalog.setCost(eventfile.records,Scheduler.seconds(elapsed)/events_processed)
+
+        # Progress, based on the number of entries in the catalog
+        if last==None: last=eventfile.planned_entries
+        self.done_entries+=min(last,eventfile.planned_entries)-first
+        elapsed=datetime.datetime.now()-self.start_time
+        if self.done_entries>0 and self.total_entries>0:
+            eta=elapsed*(self.total_entries-self.done_entries)/self.done_entries
+            print 'Progress: %d/%d entries (%.1f%%), ETA: %s'%(self.done_entries,self.total_entries,100.*self.done_entries/self.total_entries,str(eta))
+        
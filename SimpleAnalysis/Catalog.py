@@ -0,0 +1,152 @@
+import ROOT
+
+import os,os.path
+import json
+import time
+import urlparse
+import multiprocessing
+
+## This is a simple library that keeps a catalog of the metadata of the input files,
+## so that it does not have to be read again for every run. The Manager uses it to
+## plan the run (total number of entries, progress and scheduling) without opening
+## the files. The metadata of each (path,tree) pair contains:
+##  size,mtime: The size and modification time of a local file, used to check
+##              if the stored metadata is still up to date
+##  time: When the metadata was read. The metadata of remote files, which cannot be
+##        checked, is read again once it is older than remote_ttl seconds.
+##  valid: Whether the file could be opened and the tree found inside it
+##  entries: The number of entries in the tree
+##  clusters: The first entry of each cluster in the tree
+##  branches: A dictionary of the type of each branch in the tree, keyed by name
+##  cost: The measured processing time per entry in seconds, if known
+##
+## The metadata of all of the input files is read in parallel by prefetch(), using a
+## pool of processes (PyROOT holds the GIL while opening a file, so threads would read
+## them one at a time). Only the missing or out of date records are read, so the
+## catalog is updated incrementally. It is stored as a JSON file inside the cache
+## directory.
+
+indexpath=os.path.join(os.getcwd(),'cache','catalog.json') # Path to the index file
+remote_ttl=3600 # Seconds after which the metadata of a remote file is read again
+_records=None # The metadata, keyed by "path:tree". Loaded on first use.
+_version=2 # Version of the records. Older records are read again.
+
+# Set the path to the index file
+def setIndexPath(path):
+    global indexpath,_records
+    indexpath=path
+    _records=None
+
+# Set the number of seconds after which the metadata of a remote file is read again
+def setRemoteTTL(ttl):
+    global remote_ttl
+    remote_ttl=ttl
+
+# Load the index file, if not already loaded
+def load():
+    global _records
+    if _records!=None: return
+
+    _records={}
+    if os.path.exists(indexpath):
+        try:
+            fh=open(indexpath)
+            _records=json.load(fh)
+            fh.close()
+        except ValueError:
+            print 'Warning: Ignoring broken catalog %s'%indexpath
+
+# Save the index file
+def save():
+    if _records==None: return
+
+    dirname=os.path.dirname(indexpath)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmppath='%s.tmp'%indexpath
+    fh=open(tmppath,'w')
+    json.dump(_records,fh)
+    fh.close()
+    os.rename(tmppath,indexpath)
+
+# Returns the size and modification time of a local file, or (None,None) for remote
+# or missing files.
+def stat(path):
+    if urlparse.urlparse(path).scheme!='' or not os.path.exists(path):
+        return (None,None)
+    st=os.stat(path)
+    return (st.st_size,int(st.st_mtime))
+
+# Returns the stored metadata of the tree treeName inside path, or None if it is not
+# stored or out of date.
+def record(path,treeName):
+    load()
+    key='%s:%s'%(path,treeName)
+    if key not in _records: return None
+
+    rec=_records[key]
+    if rec.get('version')!=_version: return None
+    size,mtime=stat(path)
+    if (rec['size'],rec['mtime'])!=(size,mtime): return None
+    if size==None and time.time()-rec.get('time',0)>remote_ttl: return None
+    return rec
+
+# Set the measured processing time per entry (in seconds) for a list of records
+def setCost(records,cost):
+    for rec in records:
+        rec['cost']=cost
+
+# Read the metadata of the tree treeName inside path from the file itself.
+def read(path,treeName):
+    size,mtime=stat(path)
+    rec={'path':path,'tree':treeName,'size':size,'mtime':mtime,'time':int(time.time()),'version':_version,
+         'valid':False,'entries':0,'clusters':[],'branches':{}}
+
+    fh=ROOT.TFile.Open(path)
+    if not fh or fh.IsZombie():
+        return rec
+    tree=fh.Get(treeName)
+    if tree:
+        rec['valid']=True
+        rec['entries']=tree.GetEntries()
+
+        # Cluster boundaries
+        it=tree.GetClusterIterator(0)
+        start=it.Next()
+        while start<rec['entries']:
+            rec['clusters'].append(start)
+            start=it.Next()
+
+        # Branch types
+        for branch in tree.GetListOfBranches():
+            if branch.GetClassName()!='':
+                rec['branches'][branch.GetName()]=branch.GetClassName()
+            else:
+                rec['branches'][branch.GetName()]=','.join([leaf.GetTypeName() for leaf in branch.GetListOfLeaves()])
+    fh.Close()
+    return rec
+
+# Read the metadata of a (path,treeName) pair, inside the processes of prefetch()
+def _read(args):
+    return read(*args)
+
+# Makes sure that the metadata of all of the inputs is stored, reading it in
+# parallel for the inputs that are missing or out of date. The index file is updated
+# afterwards.
+#  inputs - A list of (path,treeName) pairs
+#  nthreads - Number of processes used to read the metadata
+#
+# Returns a list of the metadata of each input, in the same order.
+def prefetch(inputs,nthreads=8):
+    load()
+
+    missing=[(path,treeName) for path,treeName in inputs if record(path,treeName)==None]
+    if len(missing)>0:
+        pool=multiprocessing.Pool(min(nthreads,len(missing)))
+        for rec in pool.imap_unordered(_read,missing):
+            _records['%s:%s'%(rec['path'],rec['tree'])]=rec
+        pool.close()
+        pool.join()
+        save()
+
+    return [_records['%s:%s'%(path,treeName)] for path,treeName in inputs]
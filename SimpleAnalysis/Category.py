@@ -1,3 +1,5 @@
+import numpy
+
 # A definition of a category, used by sorting analyses
 class Category:
     def __init__(self,name,title,*args,**kwargs):
@@ -7,3 +9,12 @@ class Category:
             v=kwargs[k]
             setattr(self,k,v)
 
+# Groups the entries of a value array by the category returned by a category
+# variable. Returns a list of (category name,index) pairs, where the index can be
+# used to select the matching entries out of a numpy array. A single category
+# applies to all of the entries.
+def group(category):
+    if type(category)!=list:
+        return [(category,slice(None))]
+
+    return [(vcat,numpy.array([c==vcat for c in category],dtype=bool)) for vcat in set(category)]
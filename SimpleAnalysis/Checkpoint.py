@@ -0,0 +1,74 @@
+import OutputFactory
+
+import os,os.path
+import cPickle
+import types
+
+## This is a simple library that stores the state of a Manager run inside the
+## results directory, so that a run that died can be resumed from where it stopped
+## instead of starting from the beginning.
+##
+## The checkpoint is a pickle of the state returned by Manager.serialize, together
+## with the position in the run (index of the event file and next entry to process)
+## and the cutflow counters of the event file being processed. It is written
+## atomically, so a crash while writing it keeps the previous checkpoint.
+##
+## The output files are flushed to disk before the checkpoint is written. When the
+## run is resumed, the output files listed in the checkpoint are moved inside a
+## "checkpoint" subdirectory of the results directory, so that they are not
+## overwritten by the resumed run. Their contents are added back by the merge
+## functions of the analyses and by Manager.merge_files.
+
+filename='checkpoint.pkl' # Name of the checkpoint file inside the results directory
+dirname='checkpoint' # Subdirectory where the output files of the checkpoint are moved
+
+# Returns the path to the checkpoint file
+def path():
+    return os.path.join(OutputFactory.results(),filename)
+
+# Write the state to the checkpoint file
+def save(state):
+    tmppath='%s.tmp'%path()
+    fh=open(tmppath,'wb')
+    cPickle.dump(state,fh,cPickle.HIGHEST_PROTOCOL)
+    fh.close()
+    os.rename(tmppath,path())
+
+# Returns the state stored in the checkpoint file, or None if there is no checkpoint
+def load():
+    if not os.path.exists(path()):
+        return None
+
+    fh=open(path(),'rb')
+    state=cPickle.load(fh)
+    fh.close()
+    return state
+
+# Move the output files listed in the state into the checkpoint subdirectory. The
+# paths to them inside the state are updated. Returns the updated state.
+def relocate(state):
+    paths={}
+    for name,filepath in state['files']:
+        newpath=os.path.join(OutputFactory.results(),dirname,name)
+        if not os.path.isdir(os.path.dirname(newpath)):
+            os.makedirs(os.path.dirname(newpath))
+        if os.path.exists(filepath):
+            os.rename(filepath,newpath)
+        paths[filepath]=newpath
+    return replace(state,paths)
+
+# Returns a copy of obj (nested dictionaries, lists and tuples) with all of the
+# strings found in paths replaced by their new values. Objects (ie: released
+# histograms) are updated in place.
+def replace(obj,paths):
+    if type(obj)==str:
+        return paths.get(obj,obj)
+    elif type(obj)==dict:
+        return dict((key,replace(value,paths)) for key,value in obj.items())
+    elif type(obj)==list:
+        return [replace(value,paths) for value in obj]
+    elif type(obj)==tuple:
+        return tuple([replace(value,paths) for value in obj])
+    elif type(obj)==types.InstanceType:
+        obj.__dict__.update(replace(obj.__dict__,paths))
+    return obj
@@ -0,0 +1,214 @@
+from SimpleAnalysis import Analysis
+from SimpleAnalysis import Memory
+
+import os,os.path
+import hashlib
+import fcntl
+import atexit
+import numpy
+
+## This is a simple library for storing the values of expensive variables on disk,
+## so that later runs over the same event files can read them instead of calculating
+## them again.
+##
+## The values of a variable are stored in a columnar side file (numpy .npz) for each
+## event file. Each entry in the tree has a slot in the file, which is filled the
+## first time the entry is processed. The files are stored inside the cache directory
+## and are named after a hash of:
+##  - The fingerprint of the variable, built from its class and its configuration
+##    (all attributes that are numbers, strings or other variables). Setting a
+##    "version" attribute on the variable is an easy way to invalidate the cache
+##    after changing the code of the variable. Variables with attributes that cannot
+##    be described (ie: ROOT objects or functions) are not cached.
+##  - The identity of the event file: the tree name, the path, size and modification
+##    time of each input file, and the number of entries in the tree.
+##
+## Only variables returning numbers or lists of numbers can be stored. Other values
+## are calculated every time.
+##
+## To use, wrap the variable using the get function:
+##  mass=ColumnCache.get(VariableFactory.get(InvariantMassVariable))
+
+cachedir=os.path.join(os.getcwd(),'cache') # Directory where the side files are stored
+_cache=dict() # A dictionary of the persistent variables, keyed by fingerprint
+
+# Write out the values of the current event file and forget them. They are read back
+# from the side file if the event file is used again.
+def release():
+    for variable in _cache.values():
+        variable.flush()
+        variable.current_eventfile=None
+        variable.stored=None
+
+Memory.register('persistent variables',lambda: len(_cache),release)
+
+# Returns a PersistentVariable wrapping variable. The same PersistentVariable is
+# returned for variables with identical fingerprints.
+def get(variable):
+    key=fingerprint(variable)
+    if key==None:
+        print 'Warning: Not caching variable "%s", its configuration cannot be described'%variable.name
+        return variable
+    if key not in _cache:
+        _cache[key]=PersistentVariable(variable,key)
+    return _cache[key]
+
+# Set the directory where the side files are stored
+def setCacheDir(path):
+    global cachedir
+    cachedir=path
+
+# Returns a string hash that describes the configuration of a variable, or None if
+# some of its attributes cannot be described
+def fingerprint(variable):
+    unknown=[]
+    description=Analysis.describe(variable,unknown=unknown)
+    if len(unknown)>0: return None
+    return hashlib.sha1(description).hexdigest()
+
+# Returns a string describing the identity of the input files of an eventfile
+def identity(eventfile):
+    paths=eventfile.path if type(eventfile.path)==list else [eventfile.path]
+
+    parts=[eventfile.treeName,getattr(eventfile,'selection','')]
+    for path in paths:
+        if os.path.exists(path):
+            st=os.stat(path)
+            parts.append('%s:%d:%d'%(os.path.abspath(path),st.st_size,int(st.st_mtime)))
+        else:
+            parts.append(path)
+    parts.append(str(eventfile.tree.GetEntries()))
+    return '|'.join(parts)
+
+##
+# A variable that wraps around another variable and stores its values inside a
+# side file for each event file. Values already present in the side file are read
+# instead of calling the wrapped variable.
+class PersistentVariable(Analysis.Variable):
+    def __init__(self,variable,fingerprint):
+        Analysis.Variable.__init__(self,variable.name,variable.type)
+        self.variable=variable
+        self.fingerprint=fingerprint
+        for attr in ['title','units','nbins','minval','maxval','bins']:
+            if hasattr(variable,attr):
+                setattr(self,attr,getattr(variable,attr))
+
+        self.current_eventfile=None
+        self.path=None
+        self.identity=None
+        self.nentries=0
+
+        self.stored=None # Arrays (valid,isnone,values,offsets) read from the side file
+        self.new_values={} # Values calculated during this run, keyed by entry
+        self.storable=True
+
+    def value(self):
+        if self.eventfile!=self.current_eventfile:
+            self.switch()
+
+        idx=self.eventfile.eventidx
+        if self.stored!=None and idx<self.nentries and self.stored['valid'][idx]:
+            if self.stored['isnone'][idx]: return None
+            values=self.stored['values'][self.stored['offsets'][idx]:self.stored['offsets'][idx+1]]
+            if type(self.type)==tuple and self.type[0]==list:
+                return [self.type[1](value) for value in values.tolist()]
+            return self.type(values[0])
+
+        if idx in self.new_values:
+            return self.new_values[idx]
+
+        value=self.variable.value()
+        if self.storable:
+            try:
+                if value!=None: numpy.asarray(value,dtype='d')
+                self.new_values[idx]=value
+            except (TypeError,ValueError):
+                print 'Warning: Values of variable %s cannot be stored in the cache'%self.name
+                self.storable=False
+        return value
+
+    # Store the values for the previous event file and load the ones for the new
+    # one.
+    def switch(self):
+        self.flush()
+
+        self.current_eventfile=self.eventfile
+        self.identity=identity(self.eventfile)
+        self.nentries=self.eventfile.tree.GetEntries()
+        key=hashlib.sha1('%s|%s'%(self.fingerprint,self.identity)).hexdigest()
+        self.path=os.path.join(cachedir,'%s.npz'%key)
+
+        self.stored=None
+        self.new_values={}
+        self.load()
+
+    # Read the values stored inside the side file, if it exists
+    def load(self):
+        if os.path.exists(self.path):
+            stored=numpy.load(self.path)
+            if str(stored['fingerprint'])==self.fingerprint and str(stored['identity'])==self.identity:
+                self.stored=dict((k,stored[k]) for k in ['valid','isnone','values','offsets'])
+            else:
+                print 'Warning: Ignoring stale cache %s'%self.path
+
+    # Write the values calculated for the current event file, together with the
+    # ones already stored, into the side file. Other processes (ie: working on other
+    # chunks of the event file) can write to the same side file, so it is locked and
+    # read again before merging.
+    def flush(self):
+        if self.path==None or len(self.new_values)==0: return
+
+        if not os.path.isdir(cachedir):
+            try:
+                os.makedirs(cachedir)
+            except OSError: # Created by another process
+                pass
+        lock=open('%s.lock'%self.path[:-4],'w')
+        fcntl.flock(lock,fcntl.LOCK_EX)
+        try:
+            self.load()
+            self.write()
+        finally:
+            fcntl.flock(lock,fcntl.LOCK_UN)
+            lock.close()
+
+    # Merge the new values with the stored ones and write them into the side file
+    def write(self):
+
+        # Collect the values for every entry
+        entries=[None]*self.nentries
+        valid=numpy.zeros(self.nentries,dtype=bool)
+        if self.stored!=None:
+            for idx in numpy.flatnonzero(self.stored['valid']):
+                valid[idx]=True
+                if self.stored['isnone'][idx]: continue
+                entries[idx]=self.stored['values'][self.stored['offsets'][idx]:self.stored['offsets'][idx+1]]
+        for idx,value in self.new_values.items():
+            valid[idx]=True
+            if value!=None:
+                entries[idx]=numpy.atleast_1d(numpy.asarray(value,dtype='d'))
+
+        isnone=numpy.array([entry is None for entry in entries],dtype=bool)
+        lengths=numpy.array([0 if entry is None else len(entry) for entry in entries],dtype='i8')
+        offsets=numpy.concatenate([[0],numpy.cumsum(lengths)])
+        values=numpy.concatenate([entry for entry in entries if entry is not None]+[numpy.zeros(0)])
+
+        # Write to a temporary file first, so that a crash does not leave a broken cache
+        tmppath='%s.%d.tmp.npz'%(self.path[:-4],os.getpid())
+        numpy.savez(tmppath,
+                    valid=valid,isnone=isnone,values=values,offsets=offsets,
+                    fingerprint=numpy.array(self.fingerprint),identity=numpy.array(self.identity))
+        os.rename(tmppath,self.path)
+
+        self.stored=dict(valid=valid,isnone=isnone,values=values,offsets=offsets)
+        self.new_values={}
+
+# Writes out all of the values that have not been stored yet. This is called automatically
+# at exit, and by the worker processes (see Scheduler.worker) which do not run the exit
+# functions. Should never be called manually otherwise!
+def cleanup():
+    for variable in _cache.values():
+        variable.flush()
+
+# Register an exit function that writes the side files
+atexit.register(cleanup)
@@ -1,7 +1,11 @@
 import Analysis
+import FormulaFactory
+import ExpressionFactory
 
-from ROOT import *
-import tempfile, os
+import ROOT
+import glob
+import operator
+import numpy
 from math import *
 
 ### This file contains a few Variable/Cut/EventFile classes that are common to many
@@ -9,50 +13,148 @@ from math import *
 
 ## Event Files ##
 
-## A event file where the tree is first pruned using a generic ROOT selection
-## via CopyTree.
+## A event file where only the entries passing a generic ROOT selection are looped
+## over. The selection is evaluated once when the tree is loaded, building a
+## TEntryList of the passing entries. The tree itself is not copied, so the entry
+## indices are the same as in the full tree. A selection that cannot be compiled
+## raises a ValueError.
 ## Extra attributes:
 ##  selection: The selection that will be used when pruning the tree
-##  fullTree: The complete, unpruned tree
-##  fh_tmp: The temporary ROOT file used to store the pruned tree
+##  nthreads: Number of threads used by ROOT to decompress the tree while
+##            evaluating the selection (None by default, no multi-threading). The
+##            implicit multi-threading of ROOT is only enabled during the selection.
+##  entrylist: The TEntryList with the entries passing the selection
+##  fullTree: The complete, unpruned tree (same as tree)
 class EventFileWithSelection(Analysis.EventFile):
-    def __init__(self,path,treeName,selection):
+    def __init__(self,path,treeName,selection,nthreads=None):
         Analysis.EventFile.__init__(self,path,treeName)
         self.selection=selection
+        self.nthreads=nthreads
+        self.entrylist=None
 
     def load_tree(self):
-        self.fh=TFile.Open(self.path)
+        self.fh=ROOT.TFile.Open(self.path)
         if self.fh.FindKey(self.treeName)==None:
             return False
-        self.fullTree=self.fh.Get(self.treeName)
-
-        # Need temporary storage for large trees
-        self.tmpdir=tempfile.mkdtemp()
-        self.fh_tmp=TFile('%s/tmp.root'%self.tmpdir,'RECREATE')
-        self.tree=self.fullTree.CopyTree(self.selection)
+        self.tree=self.fh.Get(self.treeName)
+        self.fullTree=self.tree
+
+        # Build the list of passing entries
+        implicitmt=self.nthreads!=None and not ROOT.IsImplicitMTEnabled()
+        if implicitmt:
+            ROOT.EnableImplicitMT(self.nthreads)
+        try:
+            name='entrylist_%d'%id(self)
+            self.tree.Draw('>>%s'%name,self.selection,'entrylist goff')
+            self.entrylist=ROOT.gDirectory.Get(name)
+        finally:
+            if implicitmt: ROOT.DisableImplicitMT()
+
+        if self.entrylist==None:
+            raise ValueError('Invalid selection "%s" for %s:%s'%(self.selection,self.path,self.treeName))
+        self.entrylist.SetDirectory(0)
+
+        self.configure_cache()
         return True
 
+    def nentries(self):
+        return self.entrylist.GetN()
+
+    def entries(self,first=0,last=None):
+        for i in xrange(self.entrylist.GetN()):
+            entry=self.entrylist.GetEntry(i)
+            if entry<first: continue
+            if last!=None and entry>=last: break
+            yield entry
+
+    def count(self,first=0,last=None):
+        if first==0 and last==None:
+            return self.entrylist.GetN()
+        return sum(1 for entry in self.entries(first,last))
+
     def close(self):
         self.fh.Close()
-        self.fh_tmp.Close()
-        os.remove('%s/tmp.root'%self.tmpdir)
 
 
 ## A event file that is a TChain of ROOT files
+##
+## The entry indices (eventidx) are the global entry numbers in the chain, so they
+## are unique across all of the files. The branch statuses and addresses are set on
+## the TChain itself, so they are kept when the next file is loaded. A single
+## TTreeCache is shared by all of the files in the chain, with the same read-ahead as
+## for a single file (see EventFile). When running over several processes with a
+## chunksize, the entries of the chain are split into pieces like those of a single
+## file (see Scheduler.split).
+##
+## Extra arguments:
+##  cachesize: Size of the TTreeCache in bytes (30 MB by default)
+##  file_attributes: A dictionary of attributes to set on this event file when a
+##                   file is loaded, keyed by the path of the file as opened by the
+##                   TChain, after expanding the wildcards (ie: per-file weights
+##                   such as {'a.root':{'xsec':1.2}})
+##
+## Any extra keyed arguments are set as attributes.
+##
+## Extra attributes:
+##  treenumber: The index of the currently loaded file in the chain
+##  current_path: The path to the currently loaded file (GetCurrentFile().GetName())
+##  current_file: The TFile of the currently loaded file
+##  localidx: The index of the current entry inside the currently loaded file
 class EventFileChain(Analysis.EventFile):
-    def __init__(self,paths,treeName):
-        Analysis.EventFile.__init__(self,paths,treeName)
+    def __init__(self,paths,treeName,cachesize=30000000,file_attributes=None,**kwargs):
+        Analysis.EventFile.__init__(self,paths,treeName,**kwargs)
+        self.cachesize=cachesize
+        self.file_attributes=file_attributes if file_attributes!=None else {}
+
+        self.treenumber=None
+        self.current_path=None
+        self.current_file=None
+        self.localidx=None
 
     def load_tree(self):
-        self.tree=TChain(self.treeName)
+        self.tree=ROOT.TChain(self.treeName)
         
         for path in self.path:
             self.tree.Add(path)
 
+        self.configure_cache()
+        self.treenumber=None
         return True
 
+    # Load the corresponding event, switching to the next file if necessary
+    def event(self,idx):
+        self.localidx=self.tree.LoadTree(idx)
+        if self.tree.GetTreeNumber()!=self.treenumber:
+            self.change_tree()
+        return Analysis.EventFile.event(self,idx)
+
+    # Called when a new file in the chain is loaded
+    def change_tree(self):
+        self.treenumber=self.tree.GetTreeNumber()
+        self.current_file=self.tree.GetCurrentFile()
+        self.current_path=self.current_file.GetName()
+
+        for k,v in self.file_attributes.get(self.current_path,{}).items():
+            setattr(self,k,v)
+
+    # The status is set on the chain, so that it is applied to all of the files
+    def enable_branch(self,branch):
+        self.tree.SetBranchStatus(branch.GetName(),1)
+        for subbranch in branch.GetListOfBranches():
+            self.enable_branch(subbranch)
+
+    # Wildcards in local paths are expanded, as done by TChain::Add
+    def inputs(self):
+        inputs=[]
+        for path in self.path:
+            paths=glob.glob(path) if '*' in path and '://' not in path else [path]
+            inputs+=[(p,self.treeName) for p in sorted(paths)]
+        return inputs
+
     def close(self):
-        pass
+        self.tree=None
+        self.treenumber=None
+        self.current_file=None
         
         
 ### Cuts ###
@@ -155,6 +257,9 @@ class ConstantVariable(Analysis.Variable):
     def value(self):
         return self.x
 
+    def expression(self,inputs,backend):
+        return repr(self.x)
+
 ## Returns a the absolute value
 class AbsoluteVariable(Analysis.Variable):
     def __init__(self,variable):
@@ -173,6 +278,9 @@ class AbsoluteVariable(Analysis.Variable):
             result=abs(value)
         return result
 
+    def expression(self,inputs,backend):
+        return 'abs(%s)'%self.variable.expression(inputs,backend)
+
 ## Returns an element of a list variable, None if out of range error is encountered
 class ListElementVariable(Analysis.Variable):
     def __init__(self,var,jidx):
@@ -195,6 +303,17 @@ class ListElementVariable(Analysis.Variable):
             result.append(val[jidx])
         return result[0] if len(result)==1 else result
 
+    # The element is NaN if the list is too short, which CompiledVariable turns back
+    # into None
+    def expression(self,inputs,backend):
+        if len(self.jidx)!=1 or backend=='numexpr': # Cannot index inside the expression
+            return Analysis.Variable.expression(self,inputs,backend)
+        var=self.var.expression(inputs,backend)
+        jidx=self.jidx[0]
+        if backend=='cling':
+            return '((%s).size()>%d ? (%s)[%d] : NAN)'%(var,jidx,var,jidx)
+        return '((%s)[%d] if len(%s)>%d else nan)'%(var,jidx,var,jidx)
+
 ## Returns the length of a list froma variable
 class ListLengthVariable(Analysis.Variable):
     def __init__(self,var):
@@ -207,17 +326,46 @@ class ListLengthVariable(Analysis.Variable):
         return len(val)
 
         
+## Combines a list of values, each one either a list or a single number, using an
+## operator. Single numbers are applied to every element of a list and lists are
+## combined element by element, so all lists need to have the same length.
+##
+## Lists are combined using map with the op function, since converting the short
+## lists of an event to numpy arrays and back costs more than the arithmetic. If any
+## of the values is already a numpy array, all of them are combined using the ufunc
+## and an array is returned. None is returned if any of the values is None.
+def combine(op,ufunc,values):
+    if any(value is None for value in values): return None
+
+    types=[type(value) for value in values]
+    if numpy.ndarray in types:
+        return reduce(ufunc,values)
+    if list not in types:
+        return reduce(op,values)
+
+    n=len(values[types.index(list)])
+    values=[value if type(value)==list else [value]*n for value in values]
+    return reduce(lambda value1,value2: map(op,value1,value2),values)
+
 ## Sum of different variables
+# If any type is list, sum is taken element wise
 class SumVariable(Analysis.Variable):
     def __init__(self,variables):
-        Analysis.Variable.__init__(self,'sum_%s'%str(variables),variables[0].type)
+        # Determine type by looking at the first type, then check if it will become a list at some time later
+        t=variables[0].type
+        for variable in variables:
+            if type(variable.type)==tuple:
+                t=variable.type
+
+        Analysis.Variable.__init__(self,'sum_%s'%str(variables),t)
         self.variables=variables
         
     def value(self):
-        value=0
-        for variable in self.variables:
-            value+=variable.value()
-        return value
+        values=[variable.value() for variable in self.variables]
+        return combine(operator.add,numpy.add,values)
+
+    def expression(self,inputs,backend):
+        return '(%s)'%'+'.join([variable.expression(inputs,backend) for variable in self.variables])
 
 ## Product of different variables
 # All must be of the same type
@@ -234,12 +382,14 @@ class ProductVariable(Analysis.Variable):
         self.variables=variables
         
     def value(self):
-        values=[]
-        for variable in self.variables:
-            values.append(variable.value())
-        return reduce(self.multiply,values)
+        values=[variable.value() for variable in self.variables]
+        return combine(operator.mul,numpy.multiply,values)
 
+    def expression(self,inputs,backend):
+        return '(%s)'%'*'.join([variable.expression(inputs,backend) for variable in self.variables])
 
+    # Pure python implementation of the product of two values, kept as a
+    # reference for combine(), used by value().
     def multiply(self,value1,value2):
         if type(value1)!=list and type(value2)!=list:
             return value1*value2
@@ -257,6 +407,76 @@ class ProductVariable(Analysis.Variable):
                 value1[i]*=value2[i]
             return value1
 
+## A variable that evaluates an expression compiled using the ExpressionFactory,
+## instead of calling the value() function of each of the variables it is built
+## from for every event.
+##
+## The expression can be given in two ways:
+##  - A composite variable (ie: ProductVariable([AbsoluteVariable(a),b])). The
+##    expression is built from it, and it is used as the fallback if the compilation
+##    fails.
+##  - A string (ie: 'abs(a)*b'), with the variables passed as keyword arguments named
+##    after the names used inside the expression.
+##
+## The backend argument selects the compiler ('cling', 'numexpr' or 'python'). String
+## expressions that fail to compile are evaluated using the python backend.
+##
+## The kernel is compiled for the declared types of the inputs. If an input returns a
+## list while declared as a single number (or the other way around), a kernel for the
+## actual types is used instead, or the fallback if it cannot be compiled. NaN results
+## (ie: an element past the end of a list) are returned as None.
+class CompiledVariable(Analysis.Variable):
+    def __init__(self,expr,backend='cling',name=None,type=None,**variables):
+        self.fallback=None
+        if isinstance(expr,Analysis.Variable):
+            self.fallback=expr
+            self.inputs=[]
+            self.expr=expr.expression(self.inputs,backend)
+            argnames=['x%d'%i for i in range(len(self.inputs))]
+            if name==None: name=expr.name
+            if type==None: type=expr.type
+        else:
+            argnames=sorted(variables.keys())
+            self.inputs=[variables[argname] for argname in argnames]
+            self.expr=expr
+            if name==None: name=expr
+            if type==None: type=float
+        Analysis.Variable.__init__(self,name,type)
+
+        self.argnames=argnames
+        self.backend=backend
+        self.argtypes=[ExpressionFactory.argtype(variable) for variable in self.inputs]
+        self.kernel=self.compile(self.argtypes)
+
+    # Returns the kernel for inputs of the argtypes types
+    def compile(self,argtypes):
+        kernel=ExpressionFactory.get(self.expr,self.argnames,argtypes,self.backend)
+        if kernel==None and self.fallback==None:
+            kernel=ExpressionFactory.get(self.expr,self.argnames,argtypes,'python')
+        return kernel
+
+    def value(self):
+        if self.kernel==None: return self.fallback.value()
+
+        values=[variable.value() for variable in self.inputs]
+        if any(value is None for value in values): return None
+
+        kernel=self.kernel
+        argtypes=['list' if type(value)==list else 'scalar' for value in values]
+        if argtypes!=self.argtypes:
+            kernel=self.compile(argtypes)
+            if kernel==None: return self.fallback.value()
+        return self.convert(kernel(*values))
+
+    # Cast the result of the kernel, computed as doubles, to the type of the variable.
+    # NaN is returned as None.
+    def convert(self,result):
+        cast=self.type[1] if type(self.type)==tuple else self.type
+        if type(result)==list:
+            return [None if value!=value else cast(value) for value in result]
+        if result!=result: return None
+        return cast(result)
+
 ## Returns a value from a branch
 class RawBranchVariable(Analysis.Variable):
     def __init__(self,branch_name,type=float):
@@ -271,18 +491,30 @@ class RawBranchVariable(Analysis.Variable):
         else:
             return self.event.__getattr__(self.branch_name)
 
-## Returns a result of a TFormula
+## Returns a result of a TTreeFormula. The formulas are evaluated through the
+## FormulaManager shared by all FormulaVariables of the event file, which only
+## enables the branches used by the expression.
+##
+## If the type is a list, then all of the instances of the expression are returned.
+## Otherwise only the first instance is returned.
 class FormulaVariable(Analysis.Variable):
     def __init__(self,expr,type=float):
         Analysis.Variable.__init__(self,expr,type)
         self.expr=expr
-        self.formula=None
-        self.lasttree=None
         
     def value(self):
-        if self.formula==None or self.lasttree!=self.event.raw:
-            self.event.raw.SetBranchStatus('*',1)
-            self.formula=TTreeFormula(self.expr,self.expr,self.event.raw)
-            self.lasttree=self.event.raw
+        values=FormulaFactory.get(self.eventfile).value(self.expr)
+        return self.convert(values)
 
-        return self.formula.EvalInstance()
+    ## Evaluate the formula for the entries in the range [first,last) of the
+    ## current event file. Returns a list of values, one per entry.
+    def batch(self,first,last):
+        manager=FormulaFactory.get(self.eventfile)
+        manager.add(self.expr)
+        return [self.convert(values) for values in manager.evaluate(first,last)[self.expr]]
+
+    def convert(self,values):
+        if type(self.type)==tuple and self.type[0]==list:
+            return [self.type[1](value) for value in values]
+        if len(values)==0: return None
+        return self.type(values[0])
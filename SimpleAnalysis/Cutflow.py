@@ -0,0 +1,163 @@
+import Analysis
+import HistogramFactory
+import Timing
+
+## This is a simple class that applies the cuts of the Manager to the events and
+## keeps track of the cutflow: how many values of the cut variables reached and
+## passed each of the cuts. Cuts without a variable count one value per event.
+##
+## The counters are plain integers. For the cuts with a variable, the values are
+## also filled into histograms of all of the values (cutNN_all) and of the values
+## that passed (cutNN_passed), booked once using the HistogramFactory. The values
+## are buffered in lists and filled in bulk every buffersize events. For the cuts
+## without a variable, one bin histograms are only created from the counters when
+## writing.
+##
+## The following attributes configure it:
+##  histograms - Fill and write the cutflow histograms. If False, only the counters
+##               are kept. (True by default)
+##  timing - Measure the time spent in each cut. (False by default)
+##  buffersize - Number of events buffered before filling the histograms. (1000 by
+##               default)
+##
+## The cutflows of several event files or processes are combined using merge. The
+## cuts themselves are not pickled with a Cutflow, so it can be stored inside the
+## state of a Manager.
+class Cutflow:
+    def __init__(self,cuts,histograms=True,timing=False,buffersize=1000):
+        self.cuts=cuts
+        self.histograms=histograms
+        self.timing=timing
+        self.buffersize=buffersize
+
+        self.names=[cut.__class__.__name__ for cut in cuts]
+        self.all=[0]*len(cuts) # Number of values reaching each cut
+        self.passed=[0]*len(cuts) # Number of values passing each cut
+        self.events_processed=0
+        self.events_passed=0
+        self.timings=[Timing.Timing() for cut in cuts]
+
+        # Histograms and buffered (all,passed) values of the cuts with a variable
+        self.hall=[None]*len(cuts)
+        self.hpassed=[None]*len(cuts)
+        self.buffers=[None]*len(cuts)
+        self.nbuffer=0
+        self.xtitles=['']*len(cuts)
+        for cutidx in range(len(cuts)):
+            variable=cuts[cutidx].variable
+            if variable==None: continue
+
+            title=variable.title if hasattr(variable,'title') else ''
+            self.xtitles[cutidx]='%s (%s)'%(title,variable.units) if hasattr(variable,'units') else title
+            if not histograms: continue
+
+            self.hall[cutidx]=HistogramFactory.book('cut%02d_all'%cutidx,'',HistogramFactory.axis(variable),precision='D')
+            self.hpassed[cutidx]=HistogramFactory.book('cut%02d_passed'%cutidx,'',HistogramFactory.axis(variable),precision='D')
+            self.hall[cutidx].xtitle=self.xtitles[cutidx]
+            self.hpassed[cutidx].xtitle=self.xtitles[cutidx]
+            self.buffers[cutidx]=([],[])
+
+    def __getstate__(self):
+        state=self.__dict__.copy()
+        state['cuts']=None
+        return state
+
+    # Apply the cuts to event, in order. Returns True if the event is cut.
+    def apply(self,event):
+        self.events_processed+=1
+        docut=False
+        for cutidx in range(len(self.cuts)):
+            cut=self.cuts[cutidx]
+            cut.event=event
+            if self.timing: self.timings[cutidx].start()
+
+            if cut.variable==None:
+                self.all[cutidx]+=1
+                docut=(cut.cut()!=cut.invert)
+                if not docut: self.passed[cutidx]+=1
+            else:
+                values=cut.variable.value()
+                if type(values)!=list: values=[values]
+                values=[value for value in values if value!=None]
+                self.all[cutidx]+=len(values)
+                if self.buffers[cutidx]!=None: self.buffers[cutidx][0].extend(values)
+                docut=(cut.cut()!=cut.invert)
+                if not docut:
+                    self.passed[cutidx]+=len(values)
+                    if self.buffers[cutidx]!=None: self.buffers[cutidx][1].extend(values)
+
+            if self.timing: self.timings[cutidx].end()
+            if docut: break
+
+        if not docut: self.events_passed+=1
+
+        self.nbuffer+=1
+        if self.nbuffer>=self.buffersize: self.flush()
+        return docut
+
+    # Fill the buffered values into the histograms
+    def flush(self):
+        self.nbuffer=0
+        for cutidx in range(len(self.buffers)):
+            if self.buffers[cutidx]==None: continue
+            for h,values in zip([self.hall[cutidx],self.hpassed[cutidx]],self.buffers[cutidx]):
+                if len(values)==0: continue
+                h.fill(*Analysis.weighted_array(values,1.))
+                del values[:]
+
+    # Set all of the counters back to zero
+    def reset(self):
+        self.flush()
+        self.all=[0]*len(self.all)
+        self.passed=[0]*len(self.passed)
+        self.events_processed=0
+        self.events_passed=0
+        self.timings=[Timing.Timing() for timing in self.timings]
+        for h in self.hall+self.hpassed:
+            if h!=None: h.reset()
+
+    # Add the counters of another cutflow, for the same cuts
+    def merge(self,other):
+        self.flush()
+        other.flush()
+        self.all=[a+b for a,b in zip(self.all,other.all)]
+        self.passed=[a+b for a,b in zip(self.passed,other.passed)]
+        self.events_processed+=other.events_processed
+        self.events_passed+=other.events_passed
+        for timing,othertiming in zip(self.timings,other.timings):
+            timing.merge(othertiming)
+        for h,otherh in zip(self.hall+self.hpassed,other.hall+other.hpassed):
+            if h!=None and otherh!=None: h.add(otherh)
+
+    # Fraction of the processed events that passed all of the cuts
+    def efficiency(self):
+        if self.events_processed==0: return 1.
+        return 1.0*self.events_passed/self.events_processed
+
+    # Write the histograms into the directory fh
+    def write(self,fh):
+        if not self.histograms: return
+        self.flush()
+        fh.cd()
+        for cutidx in range(len(self.names)):
+            if self.hall[cutidx]!=None:
+                self.hpassed[cutidx].root().Write()
+                self.hall[cutidx].root().Write()
+                continue
+
+            # Cut without a variable, from the counters
+            for name,count in [('passed',self.passed[cutidx]),('all',self.all[cutidx])]:
+                h=HistogramFactory.book('cut%02d_%s'%(cutidx,name),'',(1,0.,1.),precision='D')
+                h.xtitle=self.xtitles[cutidx]
+                h=h.root()
+                h.SetBinContent(1,count)
+                h.SetEntries(count)
+                h.Write()
+
+    # Print the number of values passing each cut
+    def summary(self):
+        for cutidx in range(len(self.names)):
+            print '\tPassing cut %s: %d'%(self.names[cutidx],self.passed[cutidx])
+            if self.timing and self.timings[cutidx].n>0:
+                print '\t\tAverage time: %s'%str(self.timings[cutidx].average())
+        print "Cut Efficiency: %d/%d = %f"%(self.events_passed,self.events_processed,self.efficiency())
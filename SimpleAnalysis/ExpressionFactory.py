@@ -0,0 +1,114 @@
+import ROOT
+import numpy
+
+## This is a simple library that compiles an arithmetic expression into a function
+## (kernel) that can be called with the values of the input variables. The compiled
+## kernels are cached, so each expression is compiled only once.
+##
+## The expression is a string using the names of the inputs (ie: 'abs(x0*x1)+x2[0]').
+## It is either written by hand or built from a tree of variables using their
+## expression() function (see Analysis.Variable).
+##
+## The following backends are supported:
+##  cling - The expression is compiled to native code through the ROOT interpreter.
+##          List inputs are passed as ROOT::VecOps::RVec<double>, so the usual
+##          element-wise and scalar broadcasting rules apply.
+##  numexpr - The expression is compiled using numexpr. Indexing is not supported.
+##  python - The expression is compiled into Python bytecode and evaluated using numpy
+##           arrays.
+##
+## The numexpr and python kernels can also be called with arrays holding the values
+## of scalar inputs for a batch of events, evaluating all of them at once.
+##
+## None is returned if the expression cannot be compiled with the requested backend.
+
+_cache=dict()
+
+# Returns a kernel for the expr expression.
+#  argnames - The names of the inputs used inside the expression
+#  argtypes - Whether each input is a 'list' or a 'scalar'
+#  backend - The backend used to compile the expression
+def get(expr,argnames,argtypes,backend='cling'):
+    key=(expr,tuple(argnames),tuple(argtypes),backend)
+    if key in _cache:
+        return _cache[key]
+
+    kernel=None
+    if backend=='cling':
+        kernel=compile_cling(expr,argnames,argtypes)
+    elif backend=='numexpr':
+        kernel=compile_numexpr(expr,argnames,argtypes)
+    elif backend=='python':
+        kernel=compile_python(expr,argnames,argtypes)
+
+    if kernel==None:
+        print 'Warning: Unable to compile expression "%s" using %s'%(expr,backend)
+    _cache[key]=kernel
+    return kernel
+
+# Returns the argument type ('list' or 'scalar') used for a variable, from its declared
+# type. The values returned by the variable can still be of the other type.
+def argtype(variable):
+    if type(variable.type)==tuple and variable.type[0]==list:
+        return 'list'
+    return 'scalar'
+
+def compile_cling(expr,argnames,argtypes):
+    fname='SimpleAnalysis_expression_%d'%len(_cache)
+
+    args=[]
+    for argname,argtype in zip(argnames,argtypes):
+        if argtype=='list':
+            args.append('const ROOT::VecOps::RVec<double> &%s'%argname)
+        else:
+            args.append('double %s'%argname)
+
+    code ='#include "ROOT/RVec.hxx"\n'
+    code+='#include <cmath>\n'
+    code+='auto %s(%s)\n'%(fname,', '.join(args))
+    code+='{\n'
+    code+='  using namespace ROOT::VecOps;\n'
+    code+='  using std::abs;\n'
+    code+='  return %s;\n'%expr
+    code+='}\n'
+    if not ROOT.gInterpreter.Declare(code):
+        return None
+    function=getattr(ROOT,fname)
+
+    def kernel(*values):
+        # Keep the arrays alive, the RVec's only point to their memory
+        arrays=[numpy.asarray(value,dtype='d') if argtype=='list' else value for value,argtype in zip(values,argtypes)]
+        args=[ROOT.VecOps.AsRVec(array) if argtype=='list' else array for array,argtype in zip(arrays,argtypes)]
+        result=function(*args)
+        if type(result)==float:
+            return result
+        return list(result)
+    return kernel
+
+def compile_numexpr(expr,argnames,argtypes):
+    try:
+        import numexpr
+    except ImportError:
+        return None
+
+    try:
+        numexpr.NumExpr(expr,[(argname,numpy.double) for argname in argnames])
+    except (SyntaxError,KeyError,TypeError,ValueError):
+        return None
+
+    def kernel(*values):
+        local_dict=dict((argname,numpy.asarray(value,dtype='d')) for argname,value in zip(argnames,values))
+        return numexpr.evaluate(expr,local_dict=local_dict).tolist()
+    return kernel
+
+def compile_python(expr,argnames,argtypes):
+    try:
+        code=compile(expr,'<expression>','eval')
+    except SyntaxError:
+        return None
+
+    namespace={'__builtins__':{},'abs':numpy.abs,'len':len,'nan':numpy.nan}
+    def kernel(*values):
+        local_dict=dict((argname,numpy.asarray(value,dtype='d')) for argname,value in zip(argnames,values))
+        return numpy.asarray(eval(code,namespace,local_dict)).tolist()
+    return kernel
@@ -0,0 +1,116 @@
+import ROOT
+
+## This is a simple library that manages the TTreeFormula objects used by the
+## FormulaVariable's reading from an event file. All of the formulas for one event
+## file are shared by a single FormulaManager, which is created on the first call
+## to get().
+##
+## Only the branches that are used by the formulas are enabled, so the lazy branch
+## loading done by the EventFile is kept. All of the formulas are evaluated together
+## the first time one of them is requested for an event, and the results are cached
+## until the next event. All instances of array expressions are returned.
+##
+## An expression that cannot be compiled by TTreeFormula raises a ValueError.
+
+# Returns the FormulaManager for the eventfile, creating it if necessary
+def get(eventfile):
+    manager=getattr(eventfile,'formula_manager',None)
+    if manager==None:
+        manager=FormulaManager(eventfile)
+        eventfile.formula_manager=manager
+    return manager
+
+##
+# Holds the TTreeFormula objects for all of the expressions registered for an
+# event file.
+#
+# The formulas are (re)built whenever the tree of the event file changes. For a
+# TChain, the leaves of the formulas are updated when a new file in the chain is
+# loaded. An expression added afterwards only builds its own formula.
+class FormulaManager:
+    def __init__(self,eventfile):
+        self.eventfile=eventfile
+
+        self.formulas={} # expression -> TTreeFormula
+        self.tree=None
+        self.treenumber=None
+
+        self.cached_eventidx=None
+        self.cached_values={}
+
+    # Register an expression with this manager.
+    def add(self,expr):
+        if expr in self.formulas: return
+        self.formulas[expr]=None # Built by the next update()
+
+    # Returns a list with all of the instances of the expression evaluated for the
+    # current event.
+    def value(self,expr):
+        if expr not in self.formulas:
+            self.add(expr)
+
+        if self.cached_eventidx!=self.eventfile.eventidx or expr not in self.cached_values:
+            self.cached_values=self.evaluate_entry()
+            self.cached_eventidx=self.eventfile.eventidx
+        return self.cached_values[expr]
+
+    # Evaluate all of the formulas for the entries in the range [first,last). The
+    # result is a dictionary with a list of the results for each expression. Each
+    # result is itself a list of all of the instances.
+    def evaluate(self,first,last):
+        tree=self.eventfile.tree
+
+        results=dict((expr,[]) for expr in self.formulas)
+        for entry in xrange(first,last):
+            if tree.LoadTree(entry)<0: break
+            for expr,values in self.evaluate_entry().items():
+                results[expr].append(values)
+
+        # Go back to the current event. The entries read by the formulas overwrote
+        # the buffers of the branches read by the Event.
+        if self.eventfile.eventidx!=None:
+            tree.GetEntry(self.eventfile.eventidx)
+        return results
+
+    # Evaluate all of the formulas for the currently loaded entry.
+    def evaluate_entry(self):
+        self.update()
+
+        values={}
+        for expr,formula in self.formulas.items():
+            values[expr]=[formula.EvalInstance(i) for i in xrange(formula.GetNdata())]
+        return values
+
+    # Make sure that the formulas are built for the current tree
+    def update(self):
+        tree=self.eventfile.tree
+        if self.tree!=tree:
+            for expr in self.formulas:
+                self.formulas[expr]=None
+            self.tree=tree
+            self.treenumber=tree.GetTreeNumber()
+        elif self.treenumber!=tree.GetTreeNumber():
+            for formula in self.formulas.values():
+                if formula==None: continue
+                formula.UpdateFormulaLeaves()
+                self.enable_branches(formula)
+            self.treenumber=tree.GetTreeNumber()
+
+        for expr,formula in self.formulas.items():
+            if formula==None: self.build(expr)
+
+    # Build the formula of an expression for the current tree
+    def build(self,expr):
+        formula=ROOT.TTreeFormula(expr,expr,self.tree)
+        if formula.GetNdim()==0:
+            del self.formulas[expr]
+            raise ValueError('Invalid formula "%s"'%expr)
+        self.formulas[expr]=formula
+        self.enable_branches(formula)
+
+    # Enable only the branches that are read by a formula
+    def enable_branches(self,formula):
+        for i in xrange(formula.GetNcodes()):
+            leaf=formula.GetLeaf(i)
+            if leaf==None: continue
+            self.eventfile.enable_branch(leaf.GetBranch())
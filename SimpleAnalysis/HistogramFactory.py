@@ -0,0 +1,431 @@
+## This is a simple library of helper functions for filling ROOT histograms with
+## the (values,weights) arrays returned by Variable.warray(). Numerical values are
+## filled in bulk using FillN, so there is only one call into ROOT per variable per
+## event. Any other values (ie: bin labels) are filled one by one. A single value,
+## returned by warray() as a pair of floats, is filled directly.
+##
+## The bin contents of a histogram can also be read in bulk as a numpy array, using
+## contents(). The array is built directly from the memory of the histogram (GetArray),
+## instead of calling GetBinContent for each bin.
+##
+## The histograms of the analyses are booked using book(), which returns an object
+## implementing the histogram interface of the backend:
+##  root - A RootHistogram, holding a TH1/TH2 that is filled using the functions
+##         above. (Default)
+##  numpy - A NumpyHistogram, holding the bin contents in numpy arrays. The values
+##          are buffered and filled in bulk using numpy.bincount, without calling
+##          into ROOT. The TH1/TH2 is only created when it is needed for drawing or
+##          writing, by root(), and takes over the contents from the arrays. The sum
+##          of the squares of the weights is only stored once a weight different from
+##          1 is filled. If non-numerical values are filled, the histogram switches to
+##          a TH1/TH2.
+##
+## Both have the same interface: fill, fill2, add, integral, scale, reset, root and
+## read. The drawing attributes are copied from an object (ie: Category or EventFile)
+## using set_style, and are applied to the TH1/TH2 returned by root().
+##
+## A histogram that is not needed for a while can be released, to bound the memory
+## used by long runs. Its contents are written to the spill file inside the results
+## directory (spillname) and freed. They are read back automatically the next time
+## the histogram is used. A copy of the contents can also be read without restoring
+## the histogram, using read().
+
+import ROOT
+import OutputFactory
+
+import Memory
+
+import numpy
+import weakref
+from array import array
+
+# Type of the array holding the bin contents, for each of the histogram classes
+_dtypes=[('TArrayD','d'),('TArrayF','f4'),('TArrayI','i4'),('TArrayS','i2'),('TArrayC','i1')]
+
+backend='root' # The histogram backend used by book()
+buffersize=256 # Number of values buffered by a NumpyHistogram before being binned
+spillname='spill.root' # Name of the file with the released histograms
+
+_spillfiles={} # Spill files of other processes opened for reading, keyed by path
+_nspilled=0 # Number of histograms released, used to name them
+_histograms=weakref.WeakSet() # All of the existing histograms
+
+Memory.register('histograms in memory',lambda: len([h for h in _histograms if h.released==None]))
+
+# Fill a 1D histogram h with the values array, weighted by the weights array.
+def fill(h,values,weights):
+    if type(values)==float:
+        h.Fill(values,weights)
+        return
+    if len(values)==0: return
+    if values.dtype.kind=='d':
+        h.FillN(len(values),values,weights)
+    else:
+        for value,weight in zip(values.tolist(),weights.tolist()):
+            h.Fill(value,weight)
+
+# Fill a 2D histogram h with the xvalues and yvalues arrays, weighted by the
+# weights array.
+def fill2(h,xvalues,yvalues,weights):
+    if type(xvalues)==float:
+        h.Fill(xvalues,yvalues,weights)
+        return
+    if len(xvalues)==0: return
+    if xvalues.dtype.kind=='d' and yvalues.dtype.kind=='d':
+        h.FillN(len(xvalues),xvalues,yvalues,weights)
+    else:
+        for xvalue,yvalue,weight in zip(xvalues.tolist(),yvalues.tolist(),weights.tolist()):
+            h.Fill(xvalue,yvalue,weight)
+
+# Returns a numpy array (of doubles) with the bin contents of the histogram h. For 2D
+# histograms, the array is indexed as [ybin][xbin]. The underflow and overflow bins
+# are included only if flow is True.
+def contents(h,flow=False):
+    ncells=h.GetSize()
+    for cls,dtype in _dtypes:
+        if h.InheritsFrom(cls):
+            buf=h.GetArray()
+            buf.SetSize(ncells)
+            values=numpy.frombuffer(buf,dtype=dtype,count=ncells).astype('d')
+            break
+    else:
+        values=numpy.array([h.GetBinContent(i) for i in xrange(ncells)],dtype='d')
+
+    if h.GetDimension()==2:
+        values=values.reshape(h.GetNbinsY()+2,h.GetNbinsX()+2)
+        return values if flow else values[1:-1,1:-1]
+    return values if flow else values[1:-1]
+
+# Set the histogram backend
+def setBackend(newbackend):
+    global backend
+    backend=newbackend
+
+# Returns the binning of a variable, as a list of bin edges if the bins attribute is
+# defined, or a (nbins,minval,maxval) tuple otherwise.
+def axis(variable):
+    if hasattr(variable,'bins'):
+        return list(variable.bins)
+    return (variable.nbins,variable.minval,variable.maxval)
+
+# Returns a new histogram of the current backend.
+#  name,title - Name and title of the TH1/TH2
+#  xbins - The binning of the x axis, as returned by axis()
+#  ybins - The binning of the y axis for 2D histograms. None for 1D histograms.
+#  precision - 'F' for TH1F/TH2F or 'D' for TH1D/TH2D
+#  sumw2 - Store the sum of the squares of the weights, even when they are all 1
+def book(name,title,xbins,ybins=None,precision='F',sumw2=False):
+    if backend=='numpy':
+        return NumpyHistogram(name,title,xbins,ybins,precision,sumw2)
+    return RootHistogram(name,title,xbins,ybins,precision,sumw2)
+
+# Returns the arguments describing a binning to the TH1/TH2 constructors
+def _axisargs(bins):
+    if type(bins)==tuple:
+        nbins,minval,maxval=bins
+        return [int(nbins),float(minval),float(maxval)]
+    return [len(bins)-1,array('d',bins)]
+
+# Returns the bin (including the underflow and overflow bins) of each of the values,
+# as found by TAxis::FindBin.
+def _findbins(values,bins):
+    if type(bins)==tuple:
+        nbins,minval,maxval=bins
+        with numpy.errstate(invalid='ignore'):
+            idx=numpy.floor(nbins*(values-minval)/(maxval-minval))+1
+        idx[~(values<maxval)]=nbins+1 # Includes NaN
+        idx[values<minval]=0
+        return idx.astype(int)
+    return numpy.searchsorted(bins,values,side='right')
+
+# Returns the TH1/TH2 stored under key in the spill file at path, not attached to
+# any directory
+def _readspilled(path,key):
+    fh=OutputFactory._tfiles.get(path)
+    if fh==None:
+        if path not in _spillfiles:
+            _spillfiles[path]=ROOT.TFile.Open(path)
+        fh=_spillfiles[path]
+    h=fh.Get(key)
+    h.SetDirectory(0)
+    ROOT.SetOwnership(h,True)
+    return h
+
+##
+# Histogram stored as a TH1/TH2
+class RootHistogram:
+    def __init__(self,name,title,xbins,ybins=None,precision='F',sumw2=False):
+        self.name=name
+        self.title=title
+        self.xbins=xbins
+        self.ybins=ybins
+        self.precision=precision
+        self.sumw2=sumw2
+
+        self.opt='HIST' # The drawing option
+        self.style={} # Drawing attributes applied by root()
+        self.xtitle=None
+        self.ytitle=None
+
+        self.released=None # (path to the spill file,key) when released
+
+        self.h=self.create()
+        if self.h!=None and sumw2: self.h.Sumw2()
+        _histograms.add(self)
+
+    # Restore a histogram from a pickle, without attaching it to a directory
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        if self.h!=None: self.h.SetDirectory(0)
+        _histograms.add(self)
+
+    # Create an empty TH1/TH2 with the binning of this histogram
+    def create(self):
+        if self.ybins==None:
+            cls=ROOT.TH1D if self.precision=='D' else ROOT.TH1F
+            return cls(self.name,self.title,*_axisargs(self.xbins))
+        cls=ROOT.TH2D if self.precision=='D' else ROOT.TH2F
+        return cls(self.name,self.title,*(_axisargs(self.xbins)+_axisargs(self.ybins)))
+
+    # Copy the drawing attributes (linecolor, linestyle, fillcolor and options) of obj
+    def set_style(self,obj):
+        for attr in ['linecolor','linestyle','fillcolor']:
+            if hasattr(obj,attr):
+                self.style[attr]=getattr(obj,attr)
+        if hasattr(obj,'options'):
+            self.opt=obj.options
+
+    # Apply the titles and drawing attributes to the TH1/TH2 h
+    def decorate(self,h):
+        if 'linecolor' in self.style: h.SetLineColor(self.style['linecolor'])
+        if 'linestyle' in self.style: h.SetLineStyle(self.style['linestyle'])
+        if 'fillcolor' in self.style: h.SetFillColor(self.style['fillcolor'])
+        if self.xtitle!=None: h.SetXTitle(self.xtitle)
+        if self.ytitle!=None: h.SetYTitle(self.ytitle)
+
+    def fill(self,values,weights):
+        self.restore()
+        fill(self.h,values,weights)
+
+    def fill2(self,xvalues,yvalues,weights):
+        self.restore()
+        fill2(self.h,xvalues,yvalues,weights)
+
+    # Add the contents of another histogram
+    def add(self,other):
+        self.restore()
+        self.h.Add(other.root())
+
+    def integral(self):
+        self.restore()
+        return self.h.Integral()
+
+    def scale(self,factor):
+        self.restore()
+        self.h.Scale(factor)
+
+    # Empty the histogram
+    def reset(self):
+        self.restore()
+        self.h.Reset()
+
+    # Returns the TH1/TH2 with the contents of this histogram
+    def root(self):
+        self.restore()
+        self.decorate(self.h)
+        return self.h
+
+    # Write the contents to the spill file and free them
+    def release(self):
+        global _nspilled
+        if self.released!=None: return
+        h=self.root()
+
+        fh=OutputFactory.getTFile(spillname)
+        key='h%d'%_nspilled
+        _nspilled+=1
+        fh.cd()
+        h.Write(key)
+        ROOT.gROOT.cd()
+
+        self.released=(fh.GetName(),key)
+        self.free()
+
+    # Free the contents, once written to the spill file
+    def free(self):
+        self.h=None
+
+    # Read back the contents of a released histogram. They are stored in a TH1/TH2
+    # from then on.
+    def restore(self):
+        if self.released==None: return
+        path,key=self.released
+        self.released=None
+
+        self.h=_readspilled(path,key)
+
+    # Returns the TH1/TH2 with the contents of this histogram, like root(), but without
+    # restoring it if it is released. The TH1/TH2 is then read from the spill file and
+    # belongs to the caller, so that it can be freed once drawn.
+    def read(self):
+        if self.released==None: return self.root()
+        h=_readspilled(*self.released)
+        self.decorate(h)
+        return h
+
+##
+# Histogram stored as numpy arrays. See the description at the top.
+#
+# The arrays are indexed by the global bin numbers of ROOT, including the underflow
+# and overflow bins. They have the precision of the TH1/TH2 that they replace. The
+# values filled are kept in lists until buffersize of them are pending, and are then
+# binned all at once. Nothing is buffered between two flushes.
+#
+# root() hands the contents over to a TH1/TH2 and frees the arrays, so that only one
+# copy of the contents exists. From then on, the contents are stored in the TH1/TH2
+# (h attribute), like they are once non-numerical values are filled or once the
+# histogram is restored after being released. Resetting a histogram that was only
+# handed over by root() drops the TH1/TH2 and goes back to the arrays.
+class NumpyHistogram(RootHistogram):
+    def __init__(self,name,title,xbins,ybins=None,precision='F',sumw2=False):
+        RootHistogram.__init__(self,name,title,xbins,ybins,precision,sumw2)
+
+        self.xaxis=xbins if type(xbins)==tuple else numpy.array(xbins,dtype='d')
+        self.yaxis=ybins if type(ybins)!=list else numpy.array(ybins,dtype='d')
+        self.nx=(xbins[0] if type(xbins)==tuple else len(xbins)-1)+2
+        self.ny=1 if ybins==None else (ybins[0] if type(ybins)==tuple else len(ybins)-1)+2
+        self.dtype='d' if precision=='D' else 'f4'
+        self.labelled=False # Non-numerical values were filled
+
+        self.sumw=numpy.zeros(self.nx*self.ny,dtype=self.dtype)
+        self.sumw2s=None # Sum of the squares of the weights, when not equal to sumw
+        self.entries=0
+
+        self.scalars=([],[],[]) # Single x values, y values and weights not binned yet
+        self.arrays=[] # (xvalues,yvalues,weights) arrays not binned yet
+        self.nbuffer=0 # Number of values not binned yet
+
+    # The TH1/TH2 is only created by root()
+    def create(self):
+        return None
+
+    def fill(self,values,weights):
+        self.fill2(values,None,weights)
+
+    def fill2(self,xvalues,yvalues,weights):
+        scalar=type(xvalues)==float
+        n=1 if scalar else len(xvalues)
+        if n==0: return
+        self.restore()
+        if self.h==None and not scalar and (xvalues.dtype.kind not in 'biuf' or (yvalues is not None and yvalues.dtype.kind not in 'biuf')):
+            self.convert()
+        if self.h!=None:
+            if yvalues is None: fill(self.h,xvalues,weights)
+            else: fill2(self.h,xvalues,yvalues,weights)
+            return
+
+        if scalar:
+            self.scalars[0].append(xvalues)
+            if yvalues is not None: self.scalars[1].append(yvalues)
+            self.scalars[2].append(weights)
+        else:
+            self.arrays.append((xvalues,yvalues,weights))
+        self.nbuffer+=n
+        if self.nbuffer>=buffersize: self.flush()
+
+    # Bin the buffered values
+    def flush(self):
+        if self.nbuffer==0: return
+        n=self.nbuffer
+        xvalues=numpy.concatenate([numpy.array(self.scalars[0],dtype='d')]+[x for x,y,w in self.arrays])
+        if self.ybins!=None:
+            yvalues=numpy.concatenate([numpy.array(self.scalars[1],dtype='d')]+[y for x,y,w in self.arrays])
+        weights=numpy.concatenate([numpy.array(self.scalars[2],dtype='d')]+[w for x,y,w in self.arrays])
+        self.clear()
+
+        cells=_findbins(xvalues,self.xaxis)
+        if self.ybins!=None:
+            cells+=self.nx*_findbins(yvalues,self.yaxis)
+
+        if self.sumw2s is None and (weights!=1).any():
+            self.sumw2s=self.sumw.copy()
+        self.sumw+=numpy.bincount(cells,weights=weights,minlength=len(self.sumw))
+        if self.sumw2s is not None:
+            self.sumw2s+=numpy.bincount(cells,weights=weights**2,minlength=len(self.sumw))
+        self.entries+=n
+
+    # Drop the buffered values
+    def clear(self):
+        for values in self.scalars: del values[:]
+        del self.arrays[:]
+        self.nbuffer=0
+
+    # Switch to storing the contents in the TH1/TH2, for non-numerical values
+    def convert(self):
+        self.root()
+        self.labelled=True
+
+    def add(self,other):
+        self.restore()
+        other.restore()
+        if self.h==None and isinstance(other,NumpyHistogram) and other.h==None:
+            self.flush()
+            other.flush()
+            if self.sumw2s is not None or other.sumw2s is not None:
+                sumw2s=self.sumw2s if self.sumw2s is not None else self.sumw
+                self.sumw2s=sumw2s+(other.sumw2s if other.sumw2s is not None else other.sumw)
+            self.sumw+=other.sumw
+            self.entries+=other.entries
+        else:
+            if self.h==None: self.convert()
+            RootHistogram.add(self,other)
+
+    def integral(self):
+        self.restore()
+        if self.h!=None: return RootHistogram.integral(self)
+        self.flush()
+        if self.ybins==None: return float(self.sumw[1:-1].sum(dtype='d'))
+        return float(self.sumw.reshape(self.ny,self.nx)[1:-1,1:-1].sum(dtype='d'))
+
+    def scale(self,factor):
+        self.restore()
+        if self.h!=None: return RootHistogram.scale(self,factor)
+        self.flush()
+        if self.sumw2s is None and factor!=1:
+            self.sumw2s=self.sumw.copy()
+        self.sumw*=factor
+        if self.sumw2s is not None: self.sumw2s*=factor**2
+
+    def reset(self):
+        self.restore()
+        if self.labelled: return RootHistogram.reset(self)
+        self.h=None # Dropped once written
+        self.sumw=numpy.zeros(self.nx*self.ny,dtype=self.dtype)
+        self.sumw2s=None
+        self.entries=0
+        self.clear()
+
+    def root(self):
+        self.restore()
+        if self.h!=None: return RootHistogram.root(self)
+        self.flush()
+
+        h=RootHistogram.create(self)
+        h.SetDirectory(0)
+        h.SetContent(numpy.asarray(self.sumw,dtype='d'))
+        h.SetEntries(self.entries)
+        if self.sumw2s is not None or self.sumw2:
+            h.Sumw2()
+            sumw2s=numpy.asarray(self.sumw2s if self.sumw2s is not None else self.sumw,dtype='d')
+            h.GetSumw2().Set(len(sumw2s),sumw2s)
+
+        self.h=h
+        self.sumw=None
+        self.sumw2s=None
+        return RootHistogram.root(self)
+
+    def free(self):
+        RootHistogram.free(self)
+        self.sumw=None
+        self.sumw2s=None
+        self.clear()
@@ -0,0 +1,49 @@
+import ROOT
+import resource
+import sys
+
+## This is a simple library for keeping track of the memory used by a run. After
+## each event file, the Manager prints the peak resident set size (RSS) of the
+## process and the number of objects in several categories, using report().
+##
+## The categories are registered by the modules that hold the objects, with a
+## function returning their current number. A function that frees objects that can
+## be recreated when needed (ie: cached values) can also be given. These are called
+## by release(), when the Manager uses the 'cache' release policy.
+##
+## The number of ROOT objects inside the memory directory is always reported. The
+## Python objects are not counted, as going through all of them after every event
+## file is too slow.
+
+_categories=[] # List of (name,count function,release function)
+
+# Register a category of objects.
+#  name - The name printed in the report
+#  count - A function returning the number of objects
+#  release - A function freeing the objects. None if they cannot be freed.
+def register(name,count,release=None):
+    _categories.append((name,count,release))
+
+# Returns the peak RSS of the process in megabytes. If children is True, returns the
+# peak RSS of the largest of the finished child processes (ie: workers) instead.
+def peak_rss(children=False):
+    usage=resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    if sys.platform=='darwin':
+        return usage.ru_maxrss/1024./1024. # Bytes
+    return usage.ru_maxrss/1024. # Kilobytes
+
+# Returns a list of (name,number of objects) for all of the categories
+def counts():
+    counts=[('ROOT objects',ROOT.gROOT.GetList().GetSize())]
+    for name,count,release in _categories:
+        counts.append((name,count()))
+    return counts
+
+# Free the objects of all of the categories that can be released
+def release():
+    for name,count,release in _categories:
+        if release!=None: release()
+
+# Print the peak RSS and the number of objects in each category
+def report():
+    print 'Memory: peak RSS %.1f MB, %s'%(peak_rss(),', '.join(['%d %s'%(n,name) for name,n in counts()]))
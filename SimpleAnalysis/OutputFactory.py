@@ -1,13 +1,43 @@
-from ROOT import *
+import Memory
+
+import ROOT
 import os,os.path
 import glob
 import datetime
 import atexit
+import contextlib
+
+## The output files are written to disk in several steps, so that the work done so
+## far survives a crash and the objects written do not stay in memory:
+##  - All of the open files are flushed every flush_interval seconds, by update()
+##    which is called by the Manager for each event. The trees are auto-saved, so
+##    that they can be read back from the files.
+##  - Trees registered with track() are also auto-saved by ROOT every autosave
+##    bytes of data.
+##  - Objects that are not modified anymore can be written immediately and removed
+##    from memory, using finish().
+##
+## Several objects with the same name can be written to the same directory (ie: the
+## trees of several event files copied to the same output file). Each of them is
+## stored as a new cycle of the name. A tracked tree is written once as soon as it is
+## registered, so that its later saves only replace its own cycle. When the files of
+## several processes are merged, the cycles of each tree are first combined into a
+## single tree, since only the last cycle of each object is merged by ROOT.
+##  - The files are written and closed at the end of a session(), which wraps the
+##    run of the Manager, even if it fails. The files still open at exit are closed
+##    by cleanup().
 
 default_name='output.root' # Default filename
 _name=None # Name where the results directory will be.
 _resultsdir=None # The path to the results directory, when created.
 _tfiles={} # A dictionary of opened TFiles. The key is the full path to the ROOT file.
+_closed=set() # Full paths to the TFiles closed before the end of the run.
+_resume=False # Use the latest existing results directory instead of creating a new one.
+_tracked=set() # (path of the directory,name) of the tracked trees not finished yet
+
+flush_interval=300 # Seconds between flushes of the open files. None to disable.
+autosave=100000000 # Number of bytes of a tracked tree after which it is auto-saved.
+_last_flush=datetime.datetime.now() # Time of the last flush
 
 # Returns a path to the results directory, and creates it if it does not
 # exist already.
@@ -19,6 +49,13 @@ def results():
     # Create the directory structure
     resultsdir=os.path.join(os.getcwd(), 'results',_name)
 
+    # Pick up the latest results directory, when resuming a run
+    if _resume:
+        existing=sorted(glob.glob(os.path.join(resultsdir,'[0-9]'*8+'-[0-9]*')))
+        if len(existing)>0:
+            _resultsdir=existing[-1]
+            return _resultsdir
+
     now = datetime.datetime.now()
     existing=glob.glob(os.path.join(resultsdir,'%d%02d%02d-[0-9]*'%(now.year,now.month,now.day)))
     idx="%03d"%(len(existing)+1)
@@ -32,6 +69,8 @@ def results():
 
     return _resultsdir
 
+Memory.register('open output files',lambda: len(_tfiles))
+
 # Returns a pointer to a TFile named "name" inside the results directory
 #  name - The name of the output ROOT file. 'output.root' by default.
 def getTFile(name=None):
@@ -43,16 +82,144 @@ def getTFile(name=None):
     if path in _tfiles:
         return _tfiles[path]
 
-    f=TFile(path,'RECREATE')
+    # Files closed by close() are opened again to add to them
+    if path in _closed:
+        f=ROOT.TFile(path,'UPDATE')
+        _closed.remove(path)
+    else:
+        f=ROOT.TFile(path,'RECREATE')
     _tfiles[path]=f
     return f
 
+# Write and close the TFile named "name" inside the results directory, freeing the
+# memory used by it. It is opened again by getTFile.
+def close(name):
+    _close(os.path.join(results(),name))
+
+# Write and close the TFile at path, if it is open
+def _close(path):
+    if path not in _tfiles: return
+
+    f=_tfiles.pop(path)
+    f.Write('',ROOT.TObject.kOverwrite)
+    f.Close()
+    _closed.add(path)
+
+# Returns the names of all of the opened TFiles, relative to the results directory.
+# The files that were closed before the end of the run are included.
+def names():
+    return [os.path.relpath(path,results()) for path in list(_tfiles)+sorted(_closed)]
+
+# Write the contents of all of the opened TFiles to disk, replacing the previous
+# versions of the objects. The trees are written with their baskets, and the file
+# headers are updated, so the files can be read if the process dies. The files are
+# kept open.
+def flush():
+    global _last_flush
+    for path in _tfiles:
+        _tfiles[path].Write('',ROOT.TObject.kOverwrite)
+        _tfiles[path].Flush()
+    _last_flush=datetime.datetime.now()
+
+# Flush the files, if the last flush was more than flush_interval seconds ago
+def update():
+    if flush_interval==None: return
+    delta=datetime.datetime.now()-_last_flush
+    if delta.days*86400+delta.seconds>=flush_interval:
+        flush()
+
+# Set the tree to be auto-saved by ROOT every autosave bytes. The tree is written
+# right away, as a new cycle, so that the auto-saves and flushes replace this cycle
+# instead of a previous object with the same name.
+def track(tree):
+    tree.SetAutoSave(-autosave)
+    directory=tree.GetDirectory()
+    directory.cd()
+    tree.Write()
+    ROOT.gROOT.cd()
+    _tracked.add((directory.GetPath(),tree.GetName()))
+
+# Write an object that will not be modified anymore (ie: a histogram or a tree) to its
+# directory and remove it from the memory of the directory. The object is deleted
+# once it is not used in python anymore. It is written as a new cycle, unless it is
+# a tracked tree, which replaces its own cycle.
+def finish(obj):
+    directory=obj.GetDirectory()
+    if not directory: return
+    directory.cd()
+    key=(directory.GetPath(),obj.GetName())
+    if key in _tracked:
+        _tracked.remove(key)
+        obj.Write('',ROOT.TObject.kOverwrite)
+    else:
+        obj.Write()
+    directory.Remove(obj)
+    ROOT.SetOwnership(obj,True)
+    ROOT.gROOT.cd()
+
+# Context for the lifetime of the output files. All of the files opened inside it are
+# written and closed when it is left, even if it is left because of an exception.
+@contextlib.contextmanager
+def session():
+    global _last_flush
+    _last_flush=datetime.datetime.now()
+    try:
+        yield
+    finally:
+        for path in list(_tfiles):
+            _close(path)
+
+# Merges the ROOT files at paths into the file called "name" inside the results
+# directory. The histograms are added and the trees are concatenated.
+def mergeFiles(name,paths):
+    for path in paths:
+        combineCycles(path)
+
+    merger=ROOT.TFileMerger(False)
+    merger.OutputFile(os.path.join(results(),name),'RECREATE')
+    for path in paths:
+        merger.AddFile(path)
+    if not merger.Merge():
+        print 'ERROR: Unable to merge %s'%name
+
+# Combine the cycles of each tree at the top of the file at path into a single tree,
+# replacing them.
+def combineCycles(path):
+    fh=ROOT.TFile.Open(path,'UPDATE')
+    names=[key.GetName() for key in fh.GetListOfKeys() if key.GetClassName()=='TTree']
+    for treeName in sorted(set(names)):
+        if names.count(treeName)<2: continue
+        cycles=sorted([key.GetCycle() for key in fh.GetListOfKeys() if key.GetName()==treeName])
+        trees=ROOT.TList()
+        for cycle in cycles:
+            trees.Add(fh.Get('%s;%d'%(treeName,cycle)))
+        fh.cd()
+        tree=ROOT.TTree.MergeTrees(trees)
+        if not tree:
+            print 'ERROR: Unable to combine the cycles of tree %s in %s'%(treeName,path)
+            continue
+        for cycle in cycles:
+            fh.Delete('%s;%d'%(treeName,cycle))
+        tree.Write()
+    fh.Close()
+
+# Set the number of seconds between the flushes of the open files. None disables them.
+def setFlushInterval(interval):
+    global flush_interval
+    flush_interval=interval
+
 # Set the output name. Used by results() to determine the name of the
 # results directory. Should never be called manually!
 def setOutputName(name):
     global _name
     _name=name
 
+# Use the latest existing results directory instead of creating a new one, when
+# resuming a run. Should never be called manually!
+def setResume(resume):
+    global _resume
+    _resume=resume
+
 # Set the results directory. It is created if it does not exist. If set to
 # none, it is calculated automatically on the first call to results().
 # Should never be called manually!
@@ -78,3 +245,4 @@ def cleanup():
 
 # Register an exit function that closes all of the necessary files
 atexit.register(cleanup)
+
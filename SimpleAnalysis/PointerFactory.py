@@ -1,4 +1,4 @@
-from ROOT import *
+import ROOT
 from array import array
 
 ## This is a simple library that given a type returns a pointer that can be attached to a TTree branch. It is assumed that
@@ -17,12 +17,12 @@ def get(typename):
     if typename in array_mappings:
         pointer=array(array_mappings[typename],[0])
     elif typename in ['string']:
-        pointer=std.string()
+        pointer=ROOT.std.string()
     elif typename[0:6]=='vector':
-        pointer=std.__getattr__(typename)()
+        pointer=ROOT.std.__getattr__(typename)()
     elif typename=='TVector2':
-        pointer=TVector2()
+        pointer=ROOT.TVector2()
     elif typename[0]=='TClonesArray':
-        pointer=TClonesArray(typename[1])
+        pointer=ROOT.TClonesArray(typename[1])
 
     return pointer
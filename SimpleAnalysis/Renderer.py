@@ -0,0 +1,87 @@
+import OutputFactory
+
+import ROOT
+import os.path
+import multiprocessing
+
+## This is a simple library that saves canvases as images (png, eps...). The
+## analyses call save() instead of TCanvas::SaveAs, and the rendering is done
+## according to the mode:
+##  inline - The image is saved immediately, inside save(). (Default)
+##  deferred - The canvas is written to canvases.root inside the results directory.
+##             The images are produced by render(), called by the Manager at the
+##             end of the run, using a pool of nworkers processes that read the
+##             canvases back from the file.
+##  none - No images are produced. Only the ROOT output of the analyses is stored.
+##
+## The common style of the plots is applied by style(), which the analyses that draw
+## call from their init. Runs that only write trees never touch the graphics part of
+## ROOT.
+
+mode='inline' # The rendering mode
+nworkers=multiprocessing.cpu_count() # Number of processes used by render()
+filename='canvases.root' # Name of the file with the deferred canvases
+
+_tfile=None # The file with the deferred canvases, when opened
+_jobs=[] # The deferred images, as (key of the canvas,path to the image)
+_styled=False # True once style() has been applied
+
+# Set the rendering mode
+def setMode(newmode):
+    global mode
+    mode=newmode
+
+# Apply the common settings that make the plots look pretty. Only done once, before
+# the first histogram is booked.
+def style():
+    global _styled
+    if _styled: return
+    ROOT.gROOT.SetStyle("Plain")
+    ROOT.gStyle.SetOptStat("")
+    ROOT.gStyle.SetPalette(1)
+    #ROOT.TH1.StatOverflows(True)
+    _styled=True
+
+# Save the canvas c as an image at path. The format is determined by the extension.
+def save(c,path):
+    global _tfile
+    if mode=='inline':
+        c.SaveAs(path)
+    elif mode=='deferred':
+        if _tfile==None:
+            _tfile=ROOT.TFile(os.path.join(OutputFactory.results(),filename),'RECREATE')
+        key='canvas%05d'%len(_jobs)
+        _tfile.cd()
+        c.Write(key)
+        ROOT.gROOT.cd()
+        _jobs.append((key,os.path.abspath(path)))
+
+# Produce all of the deferred images in parallel
+def render():
+    global _tfile,_jobs
+    if _tfile==None: return
+
+    path=_tfile.GetName()
+    _tfile.Close()
+    _tfile=None
+
+    jobs=[(path,key,image) for key,image in _jobs]
+    _jobs=[]
+    print 'Rendering %d images using %d processes'%(len(jobs),nworkers)
+    pool=multiprocessing.Pool(nworkers)
+    pool.map(render_chunk,[jobs[i::nworkers] for i in range(nworkers)])
+    pool.close()
+    pool.join()
+
+# Produce the images of a list of (path to the canvas file,key,path to the image)
+def render_chunk(jobs):
+    ROOT.gROOT.SetBatch(True)
+    files={}
+    for path,key,image in jobs:
+        if path not in files:
+            files[path]=ROOT.TFile.Open(path)
+        c=files[path].Get(key)
+        c.SaveAs(image)
+        c.Close()
+    for fh in files.values():
+        fh.Close()
@@ -0,0 +1,62 @@
+import itertools
+import random
+
+## This is a simple library that selects a subset of the entries of an event file,
+## used when only a fixed number of events should be processed from each file (ie:
+## in test runs).
+##
+## The following sampling modes are supported:
+##  first - The first n entries (Default)
+##  stride - Every k-th entry, with k chosen so that n entries are spread evenly over
+##           the whole range. The first entry is a random offset inside the first
+##           stride.
+##  random - n entries chosen at random, processed in increasing order.
+##
+## The random numbers are seeded by the seed and the path of the event file, so the
+## same entries are selected every time for a given seed.
+##
+## The entries are never loaded into a list, they are selected while iterating.
+
+# Returns an iterator over n entries selected out of entries.
+#  entries - An iterable over the entries to select from
+#  nentries - The number of entries in entries
+#  n - The number of entries to select. None means all of them.
+#  mode - The sampling mode
+#  seed - The seed of the random numbers. Either an integer or a string.
+def sample(entries,nentries,n,mode='first',seed=0):
+    if n==None or n>=nentries:
+        return iter(entries)
+    if n<=0:
+        return iter([])
+
+    rng=random.Random(seed)
+    if mode=='stride':
+        stride=nentries/n
+        offset=rng.randint(0,stride-1)
+        return itertools.islice(entries,offset,offset+n*stride,stride)
+    elif mode=='random':
+        return select(entries,sorted(rng.sample(xrange(nentries),n)))
+    return itertools.islice(entries,n)
+
+# Returns an iterator over the elements of entries at the given (sorted) positions
+def select(entries,positions):
+    positions=iter(positions)
+    position=next(positions,None)
+    for idx,entry in enumerate(entries):
+        if position==None: break
+        if idx==position:
+            yield entry
+            position=next(positions,None)
+
+# Spread n entries over several event files, proportionally to their sizes. The
+# shares are integers adding up to n (largest remainder method).
+def spread(n,sizes):
+    total=sum(sizes)
+    if total==0: return [0]*len(sizes)
+
+    quotas=[1.*n*size/total for size in sizes]
+    shares=[int(quota) for quota in quotas]
+    order=sorted(range(len(sizes)),key=lambda i: quotas[i]-shares[i],reverse=True)
+    for i in order[:n-sum(shares)]:
+        shares[i]+=1
+    return shares
@@ -1,5 +1,8 @@
 import Analysis
-from ROOT import *
+import Renderer
+import HistogramFactory
+import ROOT
+import numpy
 
 # This is a general class to run the analysis on a set of simulated events.
 # The variables and cuts to be run are configured in the following section.
@@ -10,69 +13,223 @@ from ROOT import *
 #
 # The EventFile's need to have a "color" attribute that corresponds to
 # the color that will be used to set the drawn colors.
+#
+# The points are buffered in numpy arrays (see PointBuffer) and the graphs are
+# only created at the end. The following attributes limit the memory used for
+# large samples:
+#  maxpoints: Keep at most this many points for each event file, chosen at random
+#             (reservoir sampling). None to keep all of them. (None by default)
+#  binned: Fill the points into a 2D histogram for each event file, using the
+#          nbins,minval,maxval attributes of the variables, and draw them as boxes
+#          instead of a graph. (False by default)
+#  seed: Seed for the reservoir sampling. (0 by default)
+
+##
+# A buffer of (x,y) points, stored inside numpy arrays that grow by doubling their
+# size when full.
+#
+# If maxpoints is set, at most maxpoints are kept. Once the buffer is full, each new
+# point replaces a random one with a probability such that every point added has
+# the same probability to be kept (reservoir sampling).
+#
+# If histogram is set, the points are instead filled into the 2D histogram whenever
+# the buffer is full, and the buffer is emptied.
+class PointBuffer:
+    def __init__(self,maxpoints=None,seed=0,histogram=None,size=1024):
+        self.maxpoints=maxpoints
+        self.histogram=histogram
+        self.random=numpy.random.RandomState(seed)
+
+        if maxpoints!=None: size=min(size,maxpoints)
+        self.x=numpy.zeros(size,dtype='d')
+        self.y=numpy.zeros(size,dtype='d')
+        self.n=0 # Number of points stored
+        self.seen=0 # Number of points added
+
+    def add(self,x,y):
+        self.seen+=1
+        if self.histogram==None and self.maxpoints!=None and self.n>=self.maxpoints:
+            idx=self.random.randint(0,self.seen)
+            if idx<self.maxpoints:
+                self.x[idx]=x
+                self.y[idx]=y
+            return
+
+        if self.n==len(self.x):
+            if self.histogram!=None:
+                self.flush()
+            else:
+                size=max(len(self.x)*2,1024)
+                if self.maxpoints!=None: size=min(size,self.maxpoints)
+                self.x=numpy.resize(self.x,size)
+                self.y=numpy.resize(self.y,size)
+        self.x[self.n]=x
+        self.y[self.n]=y
+        self.n+=1
+
+    # Fill the stored points into the histogram
+    def flush(self):
+        if self.histogram==None: return
+        HistogramFactory.fill2(self.histogram,self.x[:self.n],self.y[:self.n],numpy.ones(self.n))
+        self.n=0
+
+    # Returns the stored points as (x,y) arrays
+    def arrays(self):
+        return self.x[:self.n],self.y[:self.n]
+
+    # Add the points of another buffer. When the number of points is limited, the
+    # number of points kept from each buffer follows the number of points added to
+    # each.
+    def extend(self,other):
+        if self.histogram!=None:
+            other.flush()
+            self.histogram.Add(other.histogram)
+            self.seen+=other.seen
+            return
+
+        x,y=other.arrays()
+        if self.maxpoints!=None and self.n+other.n>self.maxpoints:
+            nother=self.random.hypergeometric(other.seen,self.seen,self.maxpoints)
+            nother=min(nother,other.n)
+            nself=min(self.maxpoints-nother,self.n)
+            keep=self.random.permutation(self.n)[:nself]
+            pick=self.random.permutation(other.n)[:nother]
+            self.x=numpy.concatenate([self.x[keep],x[pick],numpy.zeros(self.maxpoints-nself-nother)])
+            self.y=numpy.concatenate([self.y[keep],y[pick],numpy.zeros(self.maxpoints-nself-nother)])
+            self.n=nself+nother
+        else:
+            self.x=numpy.concatenate([self.x[:self.n],x])
+            self.y=numpy.concatenate([self.y[:self.n],y])
+            self.n+=other.n
+        self.seen+=other.seen
 
 class ScatterPlotterAnalysis(Analysis.Analysis):
     def __init__(self):
         Analysis.Analysis.__init__(self)
 
         self.variables=[]
+        self.maxpoints=None
+        self.binned=False
+        self.seed=0
+
         self.multigraph_store=dict()
-        self.graph_store=dict()
-        self.count=0
-        self.file_count=0
+        self.points=dict() # (path,treeName,title,color,PointBuffer) of each event file, for each pair
+        self.current=dict() # The PointBuffer of the current event file, for each pair
 
     def init(self):
-        # Book multigraphs for all the variable pairs
+        Renderer.style()
+
         for variable in self.variables:
-            name='%s_vs_%s'%(variable[1].title,variable[0].title)
-            title=''
-            mg=TMultiGraph(name,title)
-            self.multigraph_store[variable]=mg
+            self.points[variable]=[]
 
     def init_eventfile(self):
-        self.count=0 # Null the count for the new graph
-        # Prepare the graph for each of the variables for this event
-        # file
+        # Prepare the points for each of the variables for this event file, or
+        # continue with the existing ones
         for variable in self.variables:
-            # Histogram for this file
-            g=TGraph()
-            g.SetMarkerColor(self.eventfile.color)
-            g.SetFillColor(self.eventfile.color)
-            g.SetLineColor(self.eventfile.color)
-            g.SetTitle(self.eventfile.title)
-            self.multigraph_store[variable].Add(g,'p')
-            self.file_count+=1
-            self.graph_store[variable]=g
+            for path,treeName,title,color,points in self.points[variable]:
+                if path==self.eventfile.path and treeName==self.eventfile.treeName:
+                    break
+            else:
+                histogram=None
+                if self.binned:
+                    histogram=ROOT.TH2F('%s_vs_%s_%d'%(variable[1].name,variable[0].name,len(self.points[variable])),
+                                   self.eventfile.title,
+                                   variable[0].nbins,variable[0].minval,variable[0].maxval,
+                                   variable[1].nbins,variable[1].minval,variable[1].maxval)
+                    histogram.SetDirectory(0)
+                points=PointBuffer(self.maxpoints,self.seed+len(self.points[variable]),histogram)
+                self.points[variable].append((self.eventfile.path,self.eventfile.treeName,self.eventfile.title,self.eventfile.color,points))
+            self.current[variable]=points
 
     def run_event(self):
-        self.count+=1
         for variable in self.variables:
-            self.graph_store[variable].SetPoint(self.count,variable[0].value(),variable[1].value())
+            x=variable[0].value()
+            if x==None: continue
+            y=variable[1].value()
+            if y==None: continue
+            self.current[variable].add(x,y)
 
     def deinit_eventfile(self):
         pass
 
+    def binned_variables(self):
+        variables=[]
+        for variable in self.variables:
+            variables+=list(variable)
+        return variables
+
+    def serialize(self):
+        return {'points':[self.points[variable] for variable in self.variables]}
+
+    def merge(self,state):
+        # The points of the same event file are combined
+        for variable,files in zip(self.variables,state['points']):
+            for path,treeName,title,color,points in files:
+                for mypath,mytreeName,mytitle,mycolor,mypoints in self.points[variable]:
+                    if mypath==path and mytreeName==treeName:
+                        mypoints.extend(points)
+                        break
+                else:
+                    self.points[variable].append((path,treeName,title,color,points))
+
     def deinit(self):
         # Draw everything
         for variable in self.variables:
             
             name='c1_%s_vs_%s'%(variable[1].__class__.__name__,variable[0].__class__.__name__)
-            c=TCanvas(name,name)
+            c=ROOT.TCanvas(name,name)
             self.store(c)
 #            c.SetLogy(True)
-            self.multigraph_store[variable].Draw("AP")
-            self.multigraph_store[variable].GetXaxis().SetTitle(variable[0].title)
-            self.multigraph_store[variable].GetXaxis().SetRangeUser(variable[0].minval,variable[0].maxval)
-            self.multigraph_store[variable].GetYaxis().SetTitle(variable[1].title)
-            self.multigraph_store[variable].GetYaxis().SetRangeUser(variable[1].minval,variable[1].maxval)
+            if self.binned:
+                axes=self.draw_histograms(variable)
+            else:
+                axes=self.draw_graphs(variable)
+            if axes==None: continue
+            axes.GetXaxis().SetTitle(variable[0].title)
+            axes.GetXaxis().SetRangeUser(variable[0].minval,variable[0].maxval)
+            axes.GetYaxis().SetTitle(variable[1].title)
+            axes.GetYaxis().SetRangeUser(variable[1].minval,variable[1].maxval)
 
-            if self.file_count>1:
+            if len(self.points[variable])>1:
                 l=c.BuildLegend(.65,.65,.95,.95)
                 self.store(l)
                 l.Draw()
 
             c.Update()
-            c.SaveAs("%s.eps"%name)
+            Renderer.save(c,"%s.eps"%name)
 
-        
+    # Create the graphs of a pair of variables from the buffered points and draw them.
+    # Returns the object holding the axes.
+    def draw_graphs(self,variable):
+        name='%s_vs_%s'%(variable[1].title,variable[0].title)
+        mg=ROOT.TMultiGraph(name,'')
+        self.multigraph_store[variable]=mg
+        for path,treeName,title,color,points in self.points[variable]:
+            if points.n==0: continue
+            x,y=points.arrays()
+            g=ROOT.TGraph(points.n,x,y)
+            g.SetMarkerColor(color)
+            g.SetFillColor(color)
+            g.SetLineColor(color)
+            g.SetTitle(title)
+            mg.Add(g,'p')
+        if mg.GetListOfGraphs()==None: return None
+        mg.Draw("AP")
+        return mg
 
+    # Draw the histograms of a pair of variables as boxes. Returns the first
+    # histogram, which holds the axes.
+    def draw_histograms(self,variable):
+        axes=None
+        for path,treeName,title,color,points in self.points[variable]:
+            points.flush()
+            h=points.histogram
+            h.SetLineColor(color)
+            h.SetFillColor(color)
+            self.store(h)
+            if axes==None:
+                h.Draw('BOX')
+                axes=h
+            else:
+                h.Draw('BOX SAME')
+        return axes
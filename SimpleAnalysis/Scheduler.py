@@ -0,0 +1,195 @@
+import Analysis
+import Catalog
+import OutputFactory
+import ColumnCache
+
+import os.path
+import datetime
+import multiprocessing
+import cPickle
+
+## This is a simple library that distributes the work of a Manager over a pool of
+## worker processes.
+##
+## The work is split into units of (eventfileidx,first,last), one per event file by
+## default. If the chunksize attribute of the Manager is set, the event files with
+## more entries are split into several units, at cluster boundaries when they are
+## known from the Catalog. The files of a chain are split the same way, using the
+## clusters of all of them.
+##
+## The expected cost of each unit is the number of entries multiplied by the time per
+## entry. The time per entry of an event file is taken from the Catalog, where it is
+## stored after processing the file. For the files without a measured cost, it is
+## measured during a warm-up that reads the first entries of the file and applies the
+## cuts of the Manager. The units are then ordered by decreasing cost (longest
+## processing time first).
+##
+## The workers take the units from a shared queue, in that order, whenever they are
+## done with their previous unit. So workers that finish early "steal" the remaining
+## work from the ones that are busy with the big units.
+##
+## Each worker runs the analysis (init, init_eventfile, run_event, deinit_eventfile)
+## on its units and stores its output files inside a workerNN subdirectory of the
+## results directory, together with the serialized results of the analyses (see
+## Analysis.serialize). These are then merged by the Manager, which calls deinit
+## only once.
+
+# Converts a timedelta into seconds
+def seconds(delta):
+    return delta.days*86400.+delta.seconds+delta.microseconds/1e6
+
+# Measure the processing time per entry of an event file, by reading the first warmup
+# entries of the file and applying the cuts of the Manager. No analysis is run.
+def measure(manager,eventfile):
+    if not eventfile.load_tree():
+        return None
+    eventfile.tree.SetBranchStatus("*",0)
+    Analysis.Variable.eventfile=eventfile
+
+    nentries=0
+    start_time=datetime.datetime.now()
+    for evt_idx in eventfile.entries(0,manager.warmup):
+        event=eventfile.event(evt_idx)
+        event.idx=evt_idx
+        Analysis.Variable.event=event
+        for cut in manager.cuts:
+            cut.event=event
+            cut.eventfile=eventfile
+            if cut.cut()!=cut.invert: break
+        nentries+=1
+    elapsed=datetime.datetime.now()-start_time
+    eventfile.close()
+
+    # The pointers are bound to the closed tree
+    eventfile.branch_pointers={}
+    eventfile.branch_type={}
+    eventfile.eventidx=None
+
+    if nentries==0: return None
+    return seconds(elapsed)/nentries
+
+# Returns the processing time per entry of each event file of the Manager, measuring
+# it for the files where it is not known.
+def costs(manager):
+    costs=[]
+    for eventfile in manager.eventfiles:
+        known=[record['cost'] for record in eventfile.records if 'cost' in record]
+        if len(known)>0:
+            costs.append(sum(known)/len(known))
+        elif manager.warmup>0 and True in [record['valid'] for record in eventfile.records]:
+            cost=measure(manager,eventfile)
+            if cost!=None: Catalog.setCost(eventfile.records,cost)
+            costs.append(cost)
+        else:
+            costs.append(None)
+    Catalog.save()
+
+    # Files without a cost get the average
+    known=[cost for cost in costs if cost!=None]
+    average=sum(known)/len(known) if len(known)>0 else 1.
+    return [cost if cost!=None else average for cost in costs]
+
+# Returns the ranges [first,last) that split an event file into pieces of about
+# chunksize entries, aligned to the cluster boundaries when known. For event files
+# made of several inputs (ie: an EventFileChain), the entries of the inputs follow
+# each other, so the clusters of all of the inputs are used.
+def split(eventfile,chunksize):
+    nentries=eventfile.planned_entries
+    if chunksize==None or nentries<=chunksize:
+        return [(0,None)]
+
+    clusters=[]
+    offset=0
+    for record in eventfile.records:
+        starts=record['clusters'] if len(record['clusters'])>0 else range(0,record['entries'],chunksize)
+        clusters+=[offset+start for start in starts]
+        offset+=record['entries']
+    if len(clusters)==0:
+        clusters=range(0,nentries,chunksize)
+
+    boundaries=[0]
+    for start in clusters:
+        if start-boundaries[-1]>=chunksize:
+            boundaries.append(start)
+    boundaries.append(nentries)
+    return [(boundaries[i],boundaries[i+1]) for i in range(len(boundaries)-1)]
+
+# Returns the list of work units (eventfileidx,first,last) for the Manager, ordered
+# by decreasing expected cost.
+def schedule(manager):
+    filecosts=costs(manager)
+
+    units=[]
+    for eventfileidx in range(len(manager.eventfiles)):
+        eventfile=manager.eventfiles[eventfileidx]
+        for first,last in split(eventfile,manager.chunksize):
+            nentries=(last if last!=None else eventfile.planned_entries)-first
+            budget=manager.budget(eventfileidx)
+            if budget!=None and eventfile.planned_entries>0:
+                nentries=min(nentries,1.*budget*nentries/eventfile.planned_entries)
+            units.append((filecosts[eventfileidx]*nentries,(eventfileidx,first,last)))
+    units.sort(reverse=True)
+
+    # Expected load of each worker, with the units handed out in this order
+    loads=[0.]*manager.nworkers
+    for cost,unit in units:
+        loads[loads.index(min(loads))]+=cost
+    print 'Scheduled %d units over %d workers, expected time: %s'%(len(units),manager.nworkers,str(datetime.timedelta(seconds=max(loads))))
+
+    return [unit for cost,unit in units]
+
+# The main function of a worker process. Takes units from the queue until it is
+# empty.
+def worker(manager,queue,workeridx,resultsdir):
+    OutputFactory._tfiles={}
+    OutputFactory._closed=set()
+    OutputFactory.setResults(os.path.join(resultsdir,'worker%02d'%workeridx))
+
+    with OutputFactory.session():
+        manager.init()
+        while True:
+            unit=queue.get()
+            if unit==None: break
+            manager.process(*unit)
+
+        # Store the cached values, the results, then close the output files
+        ColumnCache.cleanup()
+        fh=open(os.path.join(OutputFactory.results(),'state.pkl'),'wb')
+        cPickle.dump(manager.serialize(),fh,cPickle.HIGHEST_PROTOCOL)
+        fh.close()
+    OutputFactory.cleanup()
+
+# Process the units using a pool of worker processes. Returns a list with the
+# serialized results of the Manager in each of the workers. A RuntimeError is raised
+# if any of the workers failed, since the results would be incomplete.
+def run(manager,units):
+    queue=multiprocessing.Queue()
+    for unit in units:
+        queue.put(unit)
+    for i in range(manager.nworkers):
+        queue.put(None) # Tell the worker to stop
+
+    resultsdir=OutputFactory.results()
+    workers=[]
+    for workeridx in range(manager.nworkers):
+        p=multiprocessing.Process(target=worker,args=(manager,queue,workeridx,resultsdir))
+        p.start()
+        workers.append(p)
+
+    states=[]
+    failed=[]
+    for workeridx in range(manager.nworkers):
+        p=workers[workeridx]
+        p.join()
+        if p.exitcode!=0:
+            print 'ERROR: Worker %s failed with exit code %d'%(p.name,p.exitcode)
+            failed.append(p.name)
+            continue
+
+        fh=open(os.path.join(resultsdir,'worker%02d'%workeridx,'state.pkl'),'rb')
+        states.append(cPickle.load(fh))
+        fh.close()
+
+    if len(failed)>0:
+        raise RuntimeError('%d of %d workers failed (%s), the results are incomplete'%(len(failed),manager.nworkers,', '.join(failed)))
+    return states
@@ -0,0 +1,236 @@
+import numpy
+
+## This is a simple library of streaming statistics, used by the histogram analyses
+## to summarize the distribution of each variable independently of the binning of
+## the histograms (including the values outside of the histogram range).
+##
+## A Summary holds the exact weighted count, mean and variance (computed using the
+## Welford/Chan update, so there is no loss of precision for large samples) and the
+## minimum and maximum. Quantiles are estimated using a t-digest, whose size does
+## not depend on the number of values added.
+##
+## Both can be merged, so the summaries of several processes can be combined into
+## the summary of all of the values.
+##
+## Values are added as the (values,weights) arrays returned by Variable.warray(), or
+## as a pair of floats for a single value. They are buffered and summarized in batches
+## of buffersize additions, since updating the moments and the digest for each event
+## costs much more than filling a histogram. The count(), average(), std() and
+## quantile() functions summarize the buffered values first.
+##
+## The binning() function picks the binning of a histogram from a summary. It is used
+## by the Manager to bin the variables that do not define one (see Manager.autobin).
+
+##
+# Weighted mean, variance, extremes and quantiles of a stream of values.
+#
+# The moments (n, sumw, mean, m2, min and max attributes) only include the buffered
+# values after flush().
+class Summary:
+    def __init__(self,compression=100,buffersize=1000):
+        self.n=0 # Number of values
+        self.sumw=0. # Sum of weights
+        self.mean=0.
+        self.m2=0. # Sum of the weighted squared differences from the mean
+        self.min=None
+        self.max=None
+
+        self.digest=TDigest(compression)
+
+        self.buffersize=buffersize
+        self.scalars=([],[]) # Buffered single (values,weights)
+        self.arrays=[] # Buffered (values,weights) arrays
+        self.nbuffer=0 # Number of additions buffered
+
+    # Add a value or an array of values, weighted by weights. Non-numerical values are
+    # ignored.
+    def add(self,values,weights):
+        if type(values)==float:
+            self.scalars[0].append(values)
+            self.scalars[1].append(weights)
+        else:
+            values=numpy.atleast_1d(values)
+            if len(values)==0 or values.dtype.kind not in 'biuf': return
+            self.arrays.append((values,weights))
+
+        self.nbuffer+=1
+        if self.nbuffer>=self.buffersize:
+            self.flush()
+
+    # Summarize the buffered values
+    def flush(self):
+        if self.nbuffer==0: return
+        values=[numpy.array(self.scalars[0],dtype='d')]
+        weights=[numpy.array(self.scalars[1],dtype='d')]
+        for arrayvalues,arrayweights in self.arrays:
+            values.append(arrayvalues)
+            if numpy.ndim(arrayweights)==0:
+                arrayweights=numpy.full(len(arrayvalues),arrayweights,dtype='d')
+            weights.append(arrayweights)
+        self.scalars=([],[])
+        self.arrays=[]
+        self.nbuffer=0
+
+        values=numpy.concatenate(values).astype('d')
+        weights=numpy.concatenate(weights).astype('d')
+        if len(values)==0: return
+
+        sumw=weights.sum()
+        mean=numpy.dot(weights,values)/sumw if sumw!=0 else 0.
+        m2=numpy.dot(weights,(values-mean)**2)
+        self.combine(len(values),sumw,mean,m2,values.min(),values.max())
+
+        self.digest.add(values,weights)
+
+    # Add the values of another summary
+    def merge(self,other):
+        self.flush()
+        other.flush()
+        if other.n==0: return
+        self.combine(other.n,other.sumw,other.mean,other.m2,other.min,other.max)
+        self.digest.merge(other.digest)
+
+    # Combine the moments of another set of values with these (Chan et al.)
+    def combine(self,n,sumw,mean,m2,minval,maxval):
+        total=self.sumw+sumw
+        if total!=0:
+            delta=mean-self.mean
+            self.mean+=delta*sumw/total
+            self.m2+=m2+delta**2*self.sumw*sumw/total
+        self.sumw=total
+        self.n+=n
+        self.min=minval if self.min==None else min(self.min,minval)
+        self.max=maxval if self.max==None else max(self.max,maxval)
+
+    # Number of values
+    def count(self):
+        self.flush()
+        return self.n
+
+    # Weighted mean of the values
+    def average(self):
+        self.flush()
+        return self.mean
+
+    def variance(self):
+        self.flush()
+        if self.sumw<=0: return 0.
+        return max(self.m2/self.sumw,0.)
+
+    def std(self):
+        return self.variance()**0.5
+
+    # Estimated q-quantile (0<=q<=1) of the values, or None if there are none
+    def quantile(self,q):
+        self.flush()
+        return self.digest.quantile(q)
+
+##
+# A t-digest for estimating the quantiles of a stream of weighted values.
+#
+# The values are summarized by a list of centroids (mean,weight). The centroids near
+# the tails hold fewer values than the ones near the median, following the k1 scale
+# function. The number of centroids is about the compression parameter.
+#
+# New values are buffered and merged into the centroids once the buffer is full.
+# Values with a non-positive weight are ignored.
+class TDigest:
+    def __init__(self,compression=100):
+        self.compression=compression
+        self.buffersize=5*compression
+
+        self.means=numpy.zeros(0,dtype='d')
+        self.weights=numpy.zeros(0,dtype='d')
+        self.min=None
+        self.max=None
+
+        self.buffer=[] # List of (values,weights) arrays not merged yet
+        self.nbuffer=0
+
+    def add(self,values,weights):
+        positive=weights>0
+        if not positive.all():
+            values=values[positive]
+            weights=weights[positive]
+        if len(values)==0: return
+
+        self.min=values.min() if self.min==None else min(self.min,values.min())
+        self.max=values.max() if self.max==None else max(self.max,values.max())
+        self.buffer.append((values,weights))
+        self.nbuffer+=len(values)
+        if self.nbuffer>=self.buffersize:
+            self.compress()
+
+    # Add the centroids of another digest
+    def merge(self,other):
+        if other.min==None: return
+        other.compress()
+        self.min=other.min if self.min==None else min(self.min,other.min)
+        self.max=other.max if self.max==None else max(self.max,other.max)
+        self.buffer.append((other.means,other.weights))
+        self.nbuffer+=len(other.means)
+        self.compress()
+
+    # Merge the buffered values into the centroids
+    def compress(self):
+        if self.nbuffer==0: return
+
+        means=numpy.concatenate([self.means]+[values for values,weights in self.buffer])
+        weights=numpy.concatenate([self.weights]+[weights for values,weights in self.buffer])
+        self.buffer=[]
+        self.nbuffer=0
+
+        order=numpy.argsort(means,kind='mergesort')
+        means=means[order]
+        weights=weights[order]
+
+        # Group the points by the integer part of the k1 scale at their quantile
+        cumulative=numpy.cumsum(weights)
+        q=(cumulative-weights/2)/cumulative[-1]
+        k=self.compression/(2*numpy.pi)*numpy.arcsin(2*q-1)
+        groups=numpy.floor(k-k[0]).astype(int)
+
+        self.weights=numpy.bincount(groups,weights=weights)
+        sums=numpy.bincount(groups,weights=weights*means)
+        filled=self.weights>0
+        self.weights=self.weights[filled]
+        self.means=sums[filled]/self.weights
+
+    def quantile(self,q):
+        self.compress()
+        if len(self.means)==0: return None
+
+        # Interpolate between the centers of the centroids, and the extremes
+        cumulative=numpy.cumsum(self.weights)
+        total=cumulative[-1]
+        centers=cumulative-self.weights/2
+        positions=numpy.concatenate([[0.],centers,[total]])
+        values=numpy.concatenate([[self.min],self.means,[self.max]])
+        return float(numpy.interp(q*total,positions,values))
+
+# Returns a binning (nbins,minval,maxval) for the values summarized by summary. The
+# range covers the central 99.8% of the values, and the width of the bins follows
+# the Freedman-Diaconis rule for the number of values in the summary, with between
+# minbins and maxbins bins. For integer values, each bin is centered on an integer.
+def binning(summary,integer=False,minbins=10,maxbins=100):
+    if summary.count()==0: return None
+
+    minval=summary.quantile(0.001)
+    maxval=summary.quantile(0.999)
+    if integer:
+        minval=numpy.floor(minval)-0.5
+        maxval=numpy.ceil(maxval)+0.5
+        nbins=int(maxval-minval)
+        if nbins<=maxbins:
+            return (nbins,float(minval),float(maxval))
+    if maxval<=minval:
+        return (1,minval-0.5,maxval+0.5)
+
+    iqr=summary.quantile(0.75)-summary.quantile(0.25)
+    if iqr>0:
+        width=2*iqr/summary.n**(1./3)
+        nbins=int(numpy.ceil((maxval-minval)/width))
+    else:
+        nbins=maxbins
+    nbins=min(max(nbins,minbins),maxbins)
+    return (nbins,float(minval),float(maxval))
@@ -19,6 +19,15 @@ class Timing:
             self.x+=delta
         self.n+=1
 
+    # Add the time measured by another Timing
+    def merge(self,other):
+        if other.x==None: return
+        if self.x==None:
+            self.x=other.x
+        else:
+            self.x+=other.x
+        self.n+=other.n
+
     def average(self):
         if self.n==0: return 0
         return self.x/self.n
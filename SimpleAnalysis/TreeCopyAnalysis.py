@@ -2,7 +2,7 @@ from SimpleAnalysis import Analysis
 from SimpleAnalysis import OutputFactory
 from SimpleAnalysis import PointerFactory
 
-from ROOT import *
+import ROOT
 
 import os.path
 
@@ -21,6 +21,16 @@ import os.path
 #  1) If it is an empty list, no branches are copied
 #  2) If it is a list with branch names, the listed branches are included
 #  3) If it is set to None, then all branches are copied (Default)
+#
+# The output tree of an event file is written and removed from memory once the event
+# file is processed (see OutputFactory.finish). The trees of event files copied into
+# the same output file are kept as separate cycles of the tree name.
+#
+# When running over several processes, the output files of each process are merged
+# by the Manager (see Manager.merge_files). The cycles of each tree are then combined
+# into a single tree. When resuming from a checkpoint, the
+# entries stored in the checkpoint are copied into the output tree of the event file
+# being continued.
 class TreeCopyAnalysis(Analysis.Analysis):
     def __init__(self):
         Analysis.Analysis.__init__(self)
@@ -35,6 +45,10 @@ class TreeCopyAnalysis(Analysis.Analysis):
         self.branches=None
         self.trees=[]
 
+        self.name=None # Name of the output file of the current tree
+        self.outputs=[] # (name,path,treeName,entries) of the finished output trees
+        self.restored=[] # (name,path,treeName,entries) of trees to copy from a checkpoint
+
     def init(self):
         # Create variable pointers
         for var in self.variables:
@@ -45,15 +59,15 @@ class TreeCopyAnalysis(Analysis.Analysis):
             if type(var.type)==tuple:
                 if var.type[0]==list:
                     if var.type[1]==float:
-                        var.pointer=std.vector('float')()
+                        var.pointer=ROOT.std.vector('float')()
                     elif var.type[1]==int:
-                        var.pointer=std.vector('int')()
+                        var.pointer=ROOT.std.vector('int')()
                     elif var.type[1]==bool:
-                        var.pointer=std.vector('bool')()
+                        var.pointer=ROOT.std.vector('bool')()
                     elif var.type[1]==str:
-                        var.pointer=std.vector('std::string')()
+                        var.pointer=ROOT.std.vector('std::string')()
                     else:
-                        var.pointer=std.vector(var.type[1].__name__)()
+                        var.pointer=ROOT.std.vector(var.type[1].__name__)()
             else:
                 if var.type==float:
                     var.branch_type='%s/D'%var.branchname
@@ -64,20 +78,21 @@ class TreeCopyAnalysis(Analysis.Analysis):
                 elif var.type==bool:
                     var.branch_type='%s/O'%var.branchname
                     var.pointer=PointerFactory.get('Bool_t')
-                elif var.type==TVector3:
-                    var.pointer=TVector3()
-                elif var.type==TVector2:
-                    var.pointer=TVector2()
+                elif var.type==ROOT.TVector3:
+                    var.pointer=ROOT.TVector3()
+                elif var.type==ROOT.TVector2:
+                    var.pointer=ROOT.TVector2()
                 elif var.type==str:
-                    var.pointer=std.string()
+                    var.pointer=ROOT.std.string()
 
     def init_eventfile(self):
         if hasattr(self.eventfile,'output'):
-            self.fh=OutputFactory.getTFile(self.eventfile.output)
+            name=self.eventfile.output
         elif self.output!=None:
-            self.fh=OutputFactory.getTFile(self.output)
+            name=self.output
         else:
-            self.fh=OutputFactory.getTFile(os.path.basename(self.eventfile.path))
+            name=os.path.basename(self.eventfile.path)
+        self.fh=OutputFactory.getTFile(name)
 
         # Copy any additional trees
         for tree in self.trees:
@@ -93,7 +108,7 @@ class TreeCopyAnalysis(Analysis.Analysis):
             tout=tin.CloneTree(0)
             tin.CopyAddresses(tout)
             tout.CopyEntries(tout)
-            tout.Write()
+            OutputFactory.finish(tout)
         self.fh.cd()
 
         # Create the output tree
@@ -106,6 +121,7 @@ class TreeCopyAnalysis(Analysis.Analysis):
         self.eventfile.tree.CopyAddresses(self.tree)
 
         if self.treeName!=None: self.tree.SetName(self.treeName)
+        OutputFactory.track(self.tree)
 
         # Create branches for new variables
         for var in self.variables:
@@ -113,8 +129,40 @@ class TreeCopyAnalysis(Analysis.Analysis):
                 self.tree.Branch(var.branchname,var.pointer,var.branch_type)
             else:
                 self.tree.Branch(var.branchname,var.pointer)
+        self.name=name
+
+        # Copy the entries stored in a checkpoint
+        for restored in self.restored:
+            if restored[0]!=name or restored[2]!=self.tree.GetName(): continue
+            self.restored.remove(restored)
+
+            chain=ROOT.TChain(restored[2])
+            chain.Add(restored[1])
+            self.tree.CopyEntries(chain,restored[3])
+            chain.ResetBranchAddresses()
+
+            # CopyEntries points the branches to the buffers of the chain
+            self.eventfile.tree.CopyAddresses(self.tree)
+            for var in self.variables:
+                self.tree.SetBranchAddress(var.branchname,var.pointer)
+            break
+
+    # Returns the (name,path,treeName,entries) of the current output tree
+    def current_output(self):
+        return (self.name,self.fh.GetName(),self.tree.GetName(),self.tree.GetEntries())
+
+    def deinit_eventfile(self):
+        self.outputs.append(self.current_output())
+        OutputFactory.finish(self.tree)
+        self.tree=None
 
+    def serialize(self):
+        trees=list(self.outputs)
+        if self.tree!=None: trees.append(self.current_output())
+        return {'trees':trees}
 
+    def merge(self,state):
+        self.restored+=state['trees']
 
     def run_event(self):
         # Update variables
@@ -124,14 +172,14 @@ class TreeCopyAnalysis(Analysis.Analysis):
                 var.pointer.clear()
                 for val in value:
                     var.pointer.push_back(val)
-            elif type(value)==TVector3:
+            elif type(value)==ROOT.TVector3:
                 var.pointer.SetX(value.x())
                 var.pointer.SetY(value.y())
                 var.pointer.SetZ(value.z())
-            elif type(value)==TVector2:
+            elif type(value)==ROOT.TVector2:
                 var.pointer.Set(value.X(),value.Y())
             elif var.type==str:
-                var.pointer.replace(0,std.string.npos,value)
+                var.pointer.replace(0,ROOT.std.string.npos,value)
             else:
                 var.pointer[0]=value
 
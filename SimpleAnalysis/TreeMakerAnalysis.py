@@ -1,7 +1,7 @@
 from SimpleAnalysis import Analysis
 from SimpleAnalysis import OutputFactory
 import numpy
-from ROOT import *
+import ROOT
 
 # A simple analysis class that creates a TTree with branches defined by different
 # Variables, and fills it for each event. The TTree is called 'tree' and is saved
@@ -14,6 +14,9 @@ from ROOT import *
 #
 # The name of the branch is taken to the variable name. However this can be overridden
 # by setting the branchname attribute for the variable.
+#
+# When merging the results of several processes, the entries of the trees written
+# by the other processes are appended to this tree.
 class TreeMakerAnalysis(Analysis.Analysis):
     def __init__(self):
         Analysis.Analysis.__init__(self)
@@ -28,7 +31,8 @@ class TreeMakerAnalysis(Analysis.Analysis):
         self.fh=OutputFactory.getTFile()
 
         # Create the tree, branches and variable pointers
-        self.tree=TTree('tree','tree')
+        self.tree=ROOT.TTree('tree','tree')
+        OutputFactory.track(self.tree)
         
         for var in self.variables:
             if not hasattr(var,'branchname'):
@@ -38,15 +42,15 @@ class TreeMakerAnalysis(Analysis.Analysis):
             if type(var.type)==tuple:
                 if var.type[0]==list:
                     if var.type[1]==float:
-                        var.pointer=std.vector('float')()
+                        var.pointer=ROOT.std.vector('float')()
                     elif var.type[1]==int:
-                        var.pointer=std.vector('int')()
+                        var.pointer=ROOT.std.vector('int')()
                     elif var.type[1]==bool:
-                        var.pointer=std.vector('bool')()
+                        var.pointer=ROOT.std.vector('bool')()
                     elif var.type[1]==str:
-                        var.pointer=std.vector('std::string')()
+                        var.pointer=ROOT.std.vector('std::string')()
                     else:
-                        var.pointer=std.vector(var.type[1].__name__)()
+                        var.pointer=ROOT.std.vector(var.type[1].__name__)()
             else:
                 if var.type==float:
                     var.branch_type='%s/D'%var.branchname
@@ -57,12 +61,12 @@ class TreeMakerAnalysis(Analysis.Analysis):
                 elif var.type==bool:
                     var.branch_type='%s/O'%var.branchname
                     var.pointer=numpy.zeros(1,dtype=var.type)
-                elif var.type==TVector3:
-                    var.pointer=TVector3()
-                elif var.type==TVector2:
-                    var.pointer=TVector2()
+                elif var.type==ROOT.TVector3:
+                    var.pointer=ROOT.TVector3()
+                elif var.type==ROOT.TVector2:
+                    var.pointer=ROOT.TVector2()
                 elif var.type==str:
-                    var.pointer=std.string()
+                    var.pointer=ROOT.std.string()
 
         for var in self.variables:
             if var.branch_type!=None:
@@ -77,15 +81,29 @@ class TreeMakerAnalysis(Analysis.Analysis):
                 var.pointer.clear()
                 for val in value:
                     var.pointer.push_back(val)
-            elif type(value)==TVector3:
+            elif type(value)==ROOT.TVector3:
                 var.pointer.SetX(value.x())
                 var.pointer.SetY(value.y())
                 var.pointer.SetZ(value.z())
-            elif type(value)==TVector2:
+            elif type(value)==ROOT.TVector2:
                 var.pointer.Set(value.X(),value.Y())
             elif var.type==str:
-                var.pointer.replace(0,std.string.npos,value)
+                var.pointer.replace(0,ROOT.std.string.npos,value)
             else:
                 var.pointer[0]=value
                     
         self.tree.Fill()
+
+    def serialize(self):
+        return {'path':self.fh.GetName(),'entries':self.tree.GetEntries()}
+
+    def merge(self,state):
+        chain=ROOT.TChain('tree')
+        chain.Add(state['path'])
+        self.fh.cd()
+        self.tree.CopyEntries(chain,state['entries'])
+        chain.ResetBranchAddresses()
+
+        # CopyEntries points the branches to the buffers of the chain
+        for var in self.variables:
+            self.tree.SetBranchAddress(var.branchname,var.pointer)
@@ -1,6 +1,6 @@
 from SimpleAnalysis import Analysis
 from SimpleAnalysis import OutputFactory
-from ROOT import *
+import ROOT
 
 # A simple analysis class that copies the branches from an input TTree and stores
 # the result in an output TTree. The output tree that it stores them inside depends
@@ -8,6 +8,10 @@ from ROOT import *
 #
 # The result is stored in the results directory, inside a file named after the
 # chain of cuts specified.
+#
+# When running over several processes, the output files of each process are merged
+# by the Manager (see Manager.merge_files). When resuming from a checkpoint, the
+# entries stored in the checkpoint are copied into the output trees.
 class Destination:
     def __init__(self,filename):
         self.filename=filename
@@ -15,11 +19,22 @@ class Destination:
 
         self.fh=None
         self.tree=None
+        self.restored=None # (path,treeName,entries) of the tree to copy from a checkpoint
 
     def init_eventfile(self,eventfile):
         if self.fh==None:
             self.fh=OutputFactory.getTFile(self.filename)
             self.tree=eventfile.tree.CloneTree(0)
+            OutputFactory.track(self.tree)
+
+            # Copy the entries stored in a checkpoint
+            if self.restored!=None:
+                path,treeName,entries=self.restored
+                chain=ROOT.TChain(treeName)
+                chain.Add(path)
+                self.tree.CopyEntries(chain,entries)
+                chain.ResetBranchAddresses()
+                self.restored=None
 
         eventfile.tree.CopyAddresses(self.tree)
 
@@ -51,6 +66,17 @@ class TreeSorterAnalysis(Analysis.Analysis):
         for destination in self.destinations:
             destination.fill(self.event.raw)
 
+    def serialize(self):
+        trees={}
+        for destination in self.destinations:
+            if destination.fh==None: continue
+            trees[destination.filename]=(destination.fh.GetName(),destination.tree.GetName(),destination.tree.GetEntries())
+        return {'trees':trees}
+
+    def merge(self,state):
+        for destination in self.destinations:
+            destination.restored=state['trees'].get(destination.filename)
+
     def deinit(self):
         for destination in self.destinations:
             destination.deinit(self.eventfile)
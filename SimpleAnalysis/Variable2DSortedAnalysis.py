@@ -1,10 +1,10 @@
 from SimpleAnalysis import Analysis
 from SimpleAnalysis import OutputFactory
 from SimpleAnalysis import Category
+from SimpleAnalysis import HistogramFactory
+from SimpleAnalysis import Renderer
 
-from ROOT import *
-
-from array import array
+import ROOT
 
 # This is a general class that crates 2D histograms, one per category that is
 # based on some selection. No distinction is made between the different event
@@ -29,7 +29,7 @@ from array import array
 #  bigtitle: The title to put on each graph (default: None)
 #  suffix: Text to append to the end of the saved histograms as varname_suffix (None by default)
 #  prefix: Text to append to the beginning of the saved histograms as prefix_varname (None by default)
-#  output_type: Type of output ('png', 'eps' or 'root')
+#  output_type: Type of output ('png', 'eps' or 'root'). Images are saved by the Renderer.
 #  norm_mode: How to normalize individual histograms ('none' or '1')
 #  logz: Whether to log the z axis
 #
@@ -40,6 +40,7 @@ from array import array
 #  nbins: Number of bins in histogram
 #  minval: Minimum value in histogram
 #  maxval: Maximum value in histogram
+#  (the binning is picked by the Manager if none is defined, see Manager.autobin)
 #  bins: A list specifying the variable binning argument to ROOT histograms. If set,
 #        nbins/minval/maxval are ignored.
 #  onlyaxis: make this only the 'x' or 'y' axis in correlations ('both' by default)
@@ -64,6 +65,8 @@ class Variable2DSortedAnalysis(Analysis.Analysis):
         self.histograms={}
 
     def init(self):
+        Renderer.style()
+
         # Create a default category, if none exist
         if len(self.categories)==0:
             category=Category.Category('default','Default')
@@ -92,25 +95,11 @@ class Variable2DSortedAnalysis(Analysis.Analysis):
         bigtitle=''
         if self.bigtitle!=None: bigtitle=' and %s'%self.bigtitle
 
-        # Determine the binning method for the two variables
-        bins=[]
-        if hasattr(var1,'bins'):
-            bins+=[len(var1.bins)-1,array('d',var1.bins)]
-        else:
-            bins+=[var1.nbins,var1.minval,var1.maxval]
-
-        if hasattr(var2,'bins'):
-            bins+=[len(var2.bins)-1,array('d',var2.bins)]
-        else:
-            bins+=[var2.nbins,var2.minval,var2.maxval]
-
         # Make histogram
-        h=TH2F("%s%s_%svs%s%s"%(prefix,category.name,var1.name,var2.name,suffix),
-               '%s%s'%(category.title,bigtitle),
-               *bins)
-        h.var1=var1
-        h.var2=var2
-        h.category=category.name
+        h=HistogramFactory.book("%s%s_%svs%s%s"%(prefix,category.name,var1.name,var2.name,suffix),
+                                '%s%s'%(category.title,bigtitle),
+                                HistogramFactory.axis(var1),
+                                HistogramFactory.axis(var2))
 
         return h
 
@@ -119,22 +108,12 @@ class Variable2DSortedAnalysis(Analysis.Analysis):
         if category==None: return
 
         # Get values for all of the variables
-        values=[]
-        for variable in self.variables:
-            value=variable.wvalue()
-            if value!=None and type(value)!=list: value=[value]
-            values.append(value)
+        values=[variable.warray() for variable in self.variables]
+        values=[Analysis.as_arrays(wvalues) if wvalues!=None else None for wvalues in values]
 
-        # Get the length of the value lists. We assume that all variables
+        # Group the entries by category. We assume that all variables
         # have the same length.
-        nValues=len(values[0])
-        nValuesRange=range(nValues)
-
-        # Prepare a list of corresponding categories
-        if type(category)!=list:
-            vcategory=[category]*nValues
-        else:
-            vcategory=category
+        groups=Category.group(category)
             
         # Fill the histograms
         for key,histogram in self.histograms.items():
@@ -144,46 +123,62 @@ class Variable2DSortedAnalysis(Analysis.Analysis):
             values2=values[i2]
             if values2==None: continue # Do not fill if no value returned
 
-            for j in nValuesRange:
-                val1=values1[j]
-                val2=values2[j]
-                vcat=vcategory[j]
+            for vcat,idx in groups:
                 if vcat==None: continue
                 if vcat not in self.categoriesDict: continue
                 if vcat not in histogram:
                     histogram[vcat]=self.create_category(self.categoriesDict[vcat],
                                                          self.variables[i1],
                                                          self.variables[i2])
-                histogram[vcat].Fill(val1[0],val2[0],val1[1])
+                histogram[vcat].fill2(values1[0][idx],values2[0][idx],values1[1][idx])
                     
+    def binned_variables(self):
+        return self.variables
+
+    def serialize(self):
+        return {'histograms':self.histograms}
+
+    def merge(self,state):
+        for key,hists in state['histograms'].items():
+            i1,i2=key
+            histogram=self.histograms[key]
+            for vcat,h in hists.items():
+                if vcat not in histogram:
+                    histogram[vcat]=self.create_category(self.categoriesDict[vcat],
+                                                         self.variables[i1],
+                                                         self.variables[i2])
+                histogram[vcat].add(h)
+
     def deinit(self):
         # Draw
-        c=TCanvas('c1','c1')
+        c=ROOT.TCanvas('c1','c1')
         if self.logz:
             c.SetLogz(True)
 
         # Turn the histogram list into a dictionary
         histograms=[]
         for key,hists in self.histograms.items():
+            i1,i2=key
             for cat,h in hists.items():
-                if h.Integral()==0.: continue # Skip empties
-                histograms.append(h)
+                if h.integral()==0.: continue # Skip empties
+                histograms.append((h,self.variables[i1],self.variables[i2]))
 
         # Loop and save
-        for h in histograms:
+        for h,var1,var2 in histograms:
             # Normalize histograms, if requested
             if self.norm_mode=='1':
-                h.Scale(1./h.Integral())
+                h.scale(1./h.integral())
             
-            title1=h.var1.title
-            units1=getattr(h.var1,'units',None)
-            if units1!=None: title1+=' (%s)'%h.var1.units
-            h.SetXTitle(title1)
+            title1=var1.title
+            units1=getattr(var1,'units',None)
+            if units1!=None: title1+=' (%s)'%var1.units
+            h.xtitle=title1
 
-            title2=h.var2.title
-            units2=getattr(h.var2,'units',None)
-            if units2!=None: title2+=' (%s)'%h.var2.units
-            h.SetYTitle(title2)
+            title2=var2.title
+            units2=getattr(var2,'units',None)
+            if units2!=None: title2+=' (%s)'%var2.units
+            h.ytitle=title2
+            h=h.root()
 
             if self.output_type in ['png','eps']: # Draw if saving image
                 c.Clear()
@@ -192,9 +187,9 @@ class Variable2DSortedAnalysis(Analysis.Analysis):
             # Print it out
             outfileName=h.GetName().replace('/','-')
             if self.output_type=='png':
-                c.SaveAs("%s.png"%outfileName)
+                Renderer.save(c,"%s.png"%outfileName)
             elif self.output_type=='eps':
-                c.SaveAs("%s.eps"%outfileName)
+                Renderer.save(c,"%s.eps"%outfileName)
             elif self.output_type=='root':
                 f=OutputFactory.getTFile()
                 f.cd()
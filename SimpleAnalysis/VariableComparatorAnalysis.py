@@ -1,7 +1,10 @@
 import Analysis
 import OutputFactory
+import HistogramFactory
+import Renderer
+import Statistics
 
-from ROOT import *
+import ROOT
 import os.path
 
 # This is a general class to compare variables from a set of events. It loops
@@ -14,7 +17,7 @@ import os.path
 # The following attributes can be set to control the logic of the analysis:
 #  bigtitle: The title to put on the overall graph
 #  norm_mode: The normalization mode ('1' or 'none') for the different histograms.
-#  output_type: Type of output ('png', 'eps' or 'root')
+#  output_type: Type of output ('png', 'eps' or 'root'). Images are saved by the Renderer.
 #  suffix: Text to append to the end of the saved histograms as varname_suffix (None by default)
 #  prefix: Text to append to the beginning of the saved histograms as prefix_varname (None by default)
 #
@@ -33,9 +36,11 @@ import os.path
 #  title: The title to put in the legend for it
 #
 # Other member attributes are:
-#  histograms: List of histograms for each of the variable. The list has the same
+#  histograms: List of histograms (see HistogramFactory) for each of the variable. The list has the same
 #              ordering as the variables list. This is filled in the init phase
 #              of the analysis.
+#  summaries: List of the Statistics.Summary of the values of each variable, in the
+#             same order. Used for the statistics printed at the end.
 class VariableComparatorAnalysis(Analysis.Analysis):
     def __init__(self):
         Analysis.Analysis.__init__(self)
@@ -56,42 +61,45 @@ class VariableComparatorAnalysis(Analysis.Analysis):
         self.maxval=100
 
         self.histograms=[]
+        self.summaries=[]
 
     def init(self):
+        Renderer.style()
+
         suffix='' if self.suffix==None else '_%s'%self.suffix
         prefix='' if self.prefix==None else '%s_'%self.prefix
 
         # Book histograms for all the variables
         for variable in self.variables:
-            h=TH1F("%s%s_%d%s"%(prefix,variable.name,id(variable),suffix),
-                   variable.title,
-                   self.nbins,
-                   self.minval,
-                   self.maxval)
-            if hasattr(variable,'linecolor'):
-                h.SetLineColor(variable.linecolor)
-            if hasattr(variable,'linestyle'):
-                h.SetLineStyle(variable.linestyle)
+            h=HistogramFactory.book("%s%s_%d%s"%(prefix,variable.name,id(variable),suffix),
+                                    variable.title,
+                                    (self.nbins,self.minval,self.maxval))
+            h.set_style(variable)
 
             self.histograms.append(h)
+            self.summaries.append(Statistics.Summary())
 
     def run_event(self):
         for i in range(0,len(self.variables)):
             variable=self.variables[i]
 
             # Get the value to fill the histogram with
-            values=variable.wvalue()
-            if values==None: continue # Do not fill if no value returned
-            if type(values)!=list:
-                values=[values]
+            wvalues=variable.warray()
+            if wvalues==None: continue # Do not fill if no value returned
+            values,weights=wvalues
 
             # Fill the histogram
-            h=self.histograms[i]
-            for value in values:
-                if type(value)==tuple:
-                    h.Fill(value[0],value[1])
-                else:
-                    h.Fill(value)
+            self.histograms[i].fill(values,weights)
+            self.summaries[i].add(values,weights)
+
+    def serialize(self):
+        return {'histograms':self.histograms,'summaries':self.summaries}
+
+    def merge(self,state):
+        for h,other in zip(self.histograms,state['histograms']):
+            h.add(other)
+        for summary,other in zip(self.summaries,state['summaries']):
+            summary.merge(other)
 
     def deinit(self):
         # Name to use to store things
@@ -104,19 +112,19 @@ class VariableComparatorAnalysis(Analysis.Analysis):
             f=OutputFactory.getTFile()
 
         # Prepare stack
-        hs=THStack()
+        hs=ROOT.THStack()
         hs.SetTitle(self.bigtitle)
         hs.SetName(name)
 
         for hist in self.histograms:
-            if hist.Integral()==0: continue
+            if hist.integral()==0: continue
             if self.norm_mode=='1':
-                hist.Scale(1./hist.Integral())
-            hs.Add(hist)
+                hist.scale(1./hist.integral())
+            hs.Add(hist.root())
         if hs.GetHists()==None: return
 
         # Draw
-        c=TCanvas()
+        c=ROOT.TCanvas()
         if self.logy:
             c.SetLogy(True)
 
@@ -136,14 +144,14 @@ class VariableComparatorAnalysis(Analysis.Analysis):
         outfileName="%s"%(name)
         outfileName=outfileName.replace('/','-')
         if self.output_type=='png':
-            c.SaveAs("%s.png"%outfileName)
+            Renderer.save(c,"%s.png"%outfileName)
         elif self.output_type=='eps':
-            c.SaveAs("%s.eps"%outfileName)
+            Renderer.save(c,"%s.eps"%outfileName)
         elif self.output_type=='root':
             hs.Write()
 
         # Dump some stats, while we are there..
         print "Statistics:"
-        for hist in self.histograms:
-            print "\t%s\t%f\t%f"%(hist.GetTitle(),hist.GetMean(),hist.GetRMS())
+        for hist,summary in zip(self.histograms,self.summaries):
+            print "\t%s\t%f\t%f\t%s"%(hist.title,summary.average(),summary.std(),summary.quantile(0.5))
         c.Close()
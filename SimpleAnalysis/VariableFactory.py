@@ -1,8 +1,19 @@
 from SimpleAnalysis import Analysis
+from SimpleAnalysis import Memory
 import traceback
 import sys
+import weakref
 
-_cache=dict()
+_cache=weakref.WeakValueDictionary() # The cached variables, kept only while they are used
+
+# Forget the cached values (and the event files they came from), keeping the variables
+def release():
+    for variable in _cache.values():
+        variable.cached_value=None
+        variable.cached_eventfile=None
+        variable.cached_eventidx=None
+
+Memory.register('cached variables',lambda: len(_cache),release)
 
 def get(variable,*args,**kwargs):
     return CachedVariable(variable,*args,**kwargs)
@@ -19,7 +30,8 @@ def get(variable,*args,**kwargs):
 #
 # To obtain the list of values with their weights, use the wvalue() function. The weights
 # are appended to the values as a second entry in the tuple. The first entry is the
-# value.
+# value. The warray() function, which returns the values and weights as numpy arrays,
+# is inherited from Analysis.Variable and also uses the cached value.
 #
 # The following attributes are optional:
 # - weight: A Variable object that returns the weight for the event.
@@ -46,21 +58,22 @@ class CachedVariable(Analysis.Variable):
         key=str(variable)+str(args)+str(kwargs)
 
         # Make if not exists
-        if key not in _cache:
-            _cache[key]=variable(*args)
+        self.variable=_cache.get(key)
+        if self.variable==None:
+            self.variable=variable(*args)
+            _cache[key]=self.variable
 
             # setup the cache
-            _cache[key].cached_value=None
-            _cache[key].cached_eventfile=None
-            _cache[key].cached_eventidx=None
+            self.variable.cached_value=None
+            self.variable.cached_eventfile=None
+            self.variable.cached_eventidx=None
 
             # Set the extra keyword args
             for k,v in kwargs.items():
                 v=kwargs[k]
-                setattr(_cache[key],k,v)
+                setattr(self.variable,k,v)
                 
         # Setup this class
-        self.variable=_cache[key]
         Analysis.Variable.__init__(self,self.variable.name,self.variable.type)
         for k,v in allargs.items():
             setattr(self,k,v)
@@ -96,3 +109,10 @@ class CachedVariable(Analysis.Variable):
 
         wvalues=zip(values,weights)
         return wvalues[0] if len(wvalues)==1 else wvalues
+
+    # Expression describing the cached variable, if it is a composite variable.
+    # Otherwise the cached variable is used as an input.
+    def expression(self,inputs,backend):
+        if self.variable.__class__.expression==Analysis.Variable.expression:
+            return Analysis.Variable.expression(self,inputs,backend)
+        return self.variable.expression(inputs,backend)
@@ -1,7 +1,11 @@
 import Analysis
 import OutputFactory
-from ROOT import *
+import HistogramFactory
+import Renderer
+import Statistics
+import ROOT
 import inspect
+import numpy
 
 
 # This is a general class to run the analysis on a set of simulated events.
@@ -24,19 +28,20 @@ import inspect
 # If the attribute "logy" is set to True, then the y axis is made log scale.
 #
 # The attribute "output_type" is the type of the output. It can be set to 'png',
-# 'eps' or 'root'.
+# 'eps' or 'root'. Images are saved by the Renderer.
 #
 # The attribute "bigtitle" is used as the title for the histogram.
 #
 # If a variable returns a list of numbers, all of them are added to a histogram
-# invididually. If a value is a touple, then the first entry is taken to be the 
-# value to fill the histogram and the second is the weight.
+# invididually. The weight of each entry is taken from the weight attribute of
+# the variable (see Variable.warray).
 #
 # The following member attributes of a variable are used:
 #  title: The title to put on the x-axis, without units
 #  units: The units to put after the title, in brackets. If not defined, then
 #         no units are added.
-#  nbins,minval,maxval: The binning to be used for the variable.
+#  nbins,minval,maxval: The binning to be used for the variable. If not defined,
+#                      it is picked by the Manager (see Manager.autobin).
 #
 # The EventFile's can have the following optional attributes:
 #  title: The title to put into the legend.
@@ -45,6 +50,18 @@ import inspect
 #  fillcolor: Corresponds to the color that will be used to fill the histogram.
 #  options: Any drawing options that should be used when drawing this histogram
 #  xsec: The cross-section to scale each event by
+#
+# The mean, RMS and median printed at the end are computed from all of the values
+# (see Statistics), not from the binned histograms.
+#
+# The histograms are booked using the HistogramFactory, and the THStack of each
+# variable is only built when drawing. With the 'histograms' release policy of the
+# Manager, the histograms of each event file are released once it is processed. They
+# are then read back and freed one variable at a time when drawing.
+#
+# When merging the results of several processes, the histograms of the same event
+# file are added together. The normalization is applied per event file, so it is
+# only correct if the event files are not split between processes.
 class VariablePlotterAnalysis(Analysis.Analysis):
     def __init__(self):
         Analysis.Analysis.__init__(self)
@@ -56,49 +73,55 @@ class VariablePlotterAnalysis(Analysis.Analysis):
         self.logy=False
         self.output_type='png'
 
+        self.summaries={} # Statistics.Summary for each (variable index,path,treeName)
+
     def init(self):
+        Renderer.style()
+
         # Book histograms for all the variables
         for variable in self.variables:
-            hs=THStack()
+            hs=ROOT.THStack()
             variable.histogram=hs
+            variable.file_histograms=[] # (path,treeName,histogram,options) for each event file
 
     def init_eventfile(self):
         # Prepare the histograms for each of the variables for this event
         # file
         for variable in self.variables:
-            # Histogram for this file
-            h=TH1F("%s-%s-%s"%(variable,self.eventfile.path,self.eventfile.treeName),
-                   self.eventfile.title,
-                   variable.nbins,
-                   variable.minval,
-                   variable.maxval)
-            if hasattr(self.eventfile,'linecolor'):
-                h.SetLineColor(self.eventfile.linecolor)
-            if hasattr(self.eventfile,'linestyle'):
-                h.SetLineStyle(self.eventfile.linestyle)
-            if hasattr(self.eventfile,'fillcolor'):
-                h.SetFillColor(self.eventfile.fillcolor)
-            if hasattr(self.eventfile,'options'):
-                opt=self.eventfile.options
+            # Continue filling the histogram of this file, if it already exists (ie:
+            # when resuming from a checkpoint)
+            for path,treeName,h,opt in variable.file_histograms:
+                if path==self.eventfile.path and treeName==self.eventfile.treeName:
+                    variable.current_histogram=h
+                    break
             else:
-                opt='HIST'
-
-            h.Sumw2()
-            variable.histogram.Add(h,opt)
-            variable.current_histogram=h
+                self.book_eventfile(variable)
+
+        for i in range(len(self.variables)):
+            key=(i,str(self.eventfile.path),self.eventfile.treeName)
+            if key not in self.summaries:
+                self.summaries[key]=Statistics.Summary()
+            self.variables[i].current_summary=self.summaries[key]
+
+    # Book the histogram of a variable for the current event file
+    def book_eventfile(self,variable):
+        # Histogram for this file
+        h=HistogramFactory.book("%s-%s-%s"%(variable,self.eventfile.path,self.eventfile.treeName),
+                                self.eventfile.title,
+                                HistogramFactory.axis(variable),
+                                sumw2=True)
+        h.set_style(self.eventfile)
+
+        variable.current_histogram=h
+        variable.file_histograms.append((self.eventfile.path,self.eventfile.treeName,h,h.opt))
 
     def run_event(self):
         for variable in self.variables:
-            values=variable.wvalue()
-            if values==None: continue
-            if type(values)!=list:
-                values=[values]
-                
-            for value in values:
-                if type(value)==tuple:
-                    variable.current_histogram.Fill(value[0],value[1])
-                else:
-                    variable.current_histogram.Fill(value)
+            wvalues=variable.warray()
+            if wvalues==None: continue
+            values,weights=wvalues
+            variable.current_histogram.fill(values,weights)
+            variable.current_summary.add(values,weights)
 
     def deinit_eventfile(self):
         if self.norm_mode=='none':
@@ -109,15 +132,54 @@ class VariablePlotterAnalysis(Analysis.Analysis):
             scale=self.eventfile.xsec*self.eventfile.eff
 
         for variable in self.variables:
-            if variable.current_histogram.Integral()>0:
-                variable.current_histogram.Scale(scale/variable.current_histogram.Integral())
+            integral=variable.current_histogram.integral()
+            if integral>0:
+                variable.current_histogram.scale(scale/integral)
+
+    # The histograms of the event file are only needed again for drawing
+    def release_eventfile(self):
+        for variable in self.variables:
+            variable.current_histogram.release()
+
+    def binned_variables(self):
+        return self.variables
+
+    def serialize(self):
+        return {'histograms':[variable.file_histograms for variable in self.variables],
+                'summaries':self.summaries}
+
+    def merge(self,state):
+        for variable,file_histograms in zip(self.variables,state['histograms']):
+            for path,treeName,h,opt in file_histograms:
+                for mypath,mytreeName,myh,myopt in variable.file_histograms:
+                    if mypath==path and mytreeName==treeName:
+                        myh.add(h)
+                        break
+                else:
+                    variable.file_histograms.append((path,treeName,h,opt))
+
+        for key,summary in state['summaries'].items():
+            if key in self.summaries:
+                self.summaries[key].merge(summary)
+            else:
+                self.summaries[key]=summary
 
     def deinit(self):
         # Draw everything
-        for variable in self.variables:
-            c=TCanvas(variable.name,variable.name)
+        for i in range(len(self.variables)):
+            variable=self.variables[i]
+            c=ROOT.TCanvas(variable.name,variable.name)
+            nstored=len(self.store_list)
             self.store(c)
 
+            # The histograms of released event files are only read for drawing
+            hists=[]
+            released=False
+            for path,treeName,h,opt in variable.file_histograms:
+                released=released or h.released!=None
+                hists.append(h.read())
+                variable.histogram.Add(hists[-1],opt)
+
             if self.stack:
                 variable.histogram.Draw()
             else:
@@ -142,40 +204,16 @@ class VariablePlotterAnalysis(Analysis.Analysis):
             # Axis type
             if self.logy:
                 # Figure out the best range to all of the events are seen on the log scale
-                hist=variable.histogram.GetHistogram()
-                binn=hist.GetNbinsX()
-                binvals=[]
-                for bin in range(binn):
-                    binvals.append(None)
-                
-                for hist in variable.histogram.GetHists():
-                    for bin in range(binn):
-                        val=hist.GetBinContent(bin+1)
-                        if val==0: continue # Only care about bins with something in it
-
-                        if binvals[bin]==None:
-                            binvals[bin]=val
-                            continue
-
-                        if self.stack:
-                            binvals[bin]+=val
-                        else:
-                            if val<binvals[bin]:
-                                binvals[bin]=val
-
-                minval=None
-                for bin in range(binn):
-                    val=binvals[bin]
-                    if val==None: continue
-                    
-                    if minval==None:
-                        minval=val
-                    else:
-                        if val<minval:
-                            minval=val
-                        
-                if minval!=None:
-                    variable.histogram.SetMinimum(minval)
+                # Only care about bins with something in it
+                binvals=numpy.array([HistogramFactory.contents(hist) for hist in variable.histogram.GetHists()])
+                filled=binvals!=0
+                if self.stack:
+                    binvals=binvals.sum(axis=0)[filled.any(axis=0)]
+                else:
+                    binvals=binvals[filled]
+
+                if len(binvals)>0:
+                    variable.histogram.SetMinimum(binvals.min())
 
                 # Set the log scale
                 c.SetLogy(True)
@@ -186,9 +224,9 @@ class VariablePlotterAnalysis(Analysis.Analysis):
             outfileName="%s-%s"%(self.name,variable.name)
             outfileName=outfileName.replace('/','-')
             if self.output_type=='png':
-                c.SaveAs("%s.png"%outfileName)
+                Renderer.save(c,"%s.png"%outfileName)
             elif self.output_type=='eps':
-                c.SaveAs("%s.eps"%outfileName)
+                Renderer.save(c,"%s.eps"%outfileName)
             elif self.output_type=='root':
                 f=OutputFactory.getTFile()
                 f.cd()
@@ -197,5 +235,14 @@ class VariablePlotterAnalysis(Analysis.Analysis):
 
             # Dump some stats, while we are there..
             print variable.title
-            for hist in variable.histogram.GetHists():
-                print "\t%s\t%f\t%f"%(hist.GetTitle(),hist.GetMean(),hist.GetRMS())
+            for path,treeName,hist,opt in variable.file_histograms:
+                summary=self.summaries[(i,str(path),treeName)]
+                print "\t%s\t%f\t%f\t%s"%(hist.title,summary.average(),summary.std(),summary.quantile(0.5))
+
+            # Free the histograms read for drawing, so that only the ones of a single
+            # variable are in memory at a time
+            if released:
+                variable.histogram.GetHists().Clear()
+                c.GetListOfPrimitives().Clear()
+                del self.store_list[nstored:]
+                del hists[:]
@@ -1,10 +1,11 @@
 from SimpleAnalysis import Analysis
 from SimpleAnalysis import OutputFactory
 from SimpleAnalysis import Category
+from SimpleAnalysis import HistogramFactory
+from SimpleAnalysis import Statistics
+from SimpleAnalysis import Renderer
 
-from ROOT import *
-
-from array import array
+import ROOT
 
 # This is a general class to compare variables for a set of simulated events,
 # but split into different categories based on some selection. No distinction
@@ -22,14 +23,15 @@ from array import array
 #
 # If a variable to be plotted returns a list of numbers, all of them are added to
 # a histogram invididually. The category variable can return a list of the same
-# size to sort each entry into a different category. To add weighting to a variable,
+# size to sort each entry into a different category. The mean, RMS and median of
+# the values in each category are printed at the end (see Statistics). To add weighting to a variable,
 # just add it to the variables list as a tuple (variable,weight).
 #
 # The following attributes can be set to control the logic of the analysis:
 #  bigtitle: The title to put on the overall graph
 #  suffix: Text to append to the end of the saved histograms as varname_suffix (None by default)
 #  prefix: Text to append to the beginning of the saved histograms as prefix_varname (None by default)
-#  output_type: Type of output ('png', 'eps' or 'root')
+#  output_type: Type of output ('png', 'eps' or 'root'). Images are saved by the Renderer.
 #  norm_mode: How to normalize individual histograms ('none' or '1')
 #  logy: Whether to log the y axis
 #  sort_graphs: Sort graphs by integral before adding them to THStack (default: False)
@@ -44,6 +46,7 @@ from array import array
 #        nbins/minval/maxval are ignored.
 #  minval: Minimum value in histogram
 #  maxval: Maximum value in histogram
+#  (the binning is picked by the Manager if none is defined, see Manager.autobin)
 #
 class VariableSortedAnalysis(Analysis.Analysis):
     def __init__(self):
@@ -63,6 +66,8 @@ class VariableSortedAnalysis(Analysis.Analysis):
         self.stack=True
 
     def init(self):
+        Renderer.style()
+
         # Create a default category, if none exist
         if len(self.categories)==0:
             category=Category.Category('default','Default')
@@ -71,6 +76,7 @@ class VariableSortedAnalysis(Analysis.Analysis):
         # Book histograms for all the variables
         for variable in self.variables:
             variable.categories={}
+            variable.summaries={}
             for category in self.categories:
                 self.book_category(variable,category)
 
@@ -78,29 +84,13 @@ class VariableSortedAnalysis(Analysis.Analysis):
         suffix='' if self.suffix==None else '_%s'%self.suffix
         prefix='' if self.prefix==None else '%s_'%self.prefix
 
-        # Determine the binning method for the two variables
-        bins=[]
-        if hasattr(variable,'bins'):
-            bins+=[len(variable.bins)-1,array('d',variable.bins)]
-        else:
-            bins+=[variable.nbins,variable.minval,variable.maxval]
-
-
-        h=TH1F("%s_%s_%s_%s"%(prefix,variable.name,category.name,suffix),
-               category.title,
-               *bins)
-        if hasattr(category,'linecolor'):
-            h.SetLineColor(category.linecolor)
-        if hasattr(category,'linestyle'):
-            h.SetLineStyle(category.linestyle)
-        if hasattr(category,'fillcolor'):
-            h.SetFillColor(category.fillcolor)
-        if hasattr(category,'options'):
-            h.opt=category.options
-        else:
-            h.opt='HIST'
+        h=HistogramFactory.book("%s_%s_%s_%s"%(prefix,variable.name,category.name,suffix),
+                                category.title,
+                                HistogramFactory.axis(variable))
+        h.set_style(category)
 
         variable.categories[category.name]=h
+        variable.summaries[category.name]=Statistics.Summary()
 
     def run_event(self):
         if self.category!=None:
@@ -113,31 +103,48 @@ class VariableSortedAnalysis(Analysis.Analysis):
             variable=self.variables[i]
 
             # Get the value to fill the histogram with
-            values=variable.wvalue()
+            wvalues=variable.warray()
+            if wvalues==None: continue # Do not fill if no value returned
+            values,weights=Analysis.as_arrays(wvalues)
 
-            if values==None: continue # Do not fill if no value returned
-            if type(values)!=list:
-                values=[values]
-
-            # Prepare a list of corresponding categories
-            if type(category)!=list:
-                vcategory=[category]*len(values)
-            else:
-                vcategory=category
-
-            if len(vcategory)!=len(values):
+            # Check the corresponding categories
+            if type(category)==list and len(category)!=len(values):
                 print 'ERROR: variable count != category count'
                 continue
 
             # Fill the histograms
-            for j in range(len(values)):
-                value=values[j]
-                vcat=vcategory[j]
+            for vcat,idx in Category.group(category):
                 if vcat==None or vcat not in variable.categories: # This is an uncategorized thing
                     vcat=None
                     if vcat not in variable.categories: continue # We do not have a "default" category
                 h=variable.categories[vcat]
-                h.Fill(value[0],value[1])
+                h.fill(values[idx],weights[idx])
+                variable.summaries[vcat].add(values[idx],weights[idx])
+
+    def binned_variables(self):
+        return self.variables
+
+    def serialize(self):
+        return {'histograms':[variable.categories for variable in self.variables],
+                'summaries':[variable.summaries for variable in self.variables]}
+
+    def merge(self,state):
+        for variable,categories in zip(self.variables,state['histograms']):
+            for name,h in categories.items():
+                if name in variable.categories:
+                    variable.categories[name].add(h)
+        for variable,summaries in zip(self.variables,state['summaries']):
+            for name,summary in summaries.items():
+                if name in variable.summaries:
+                    variable.summaries[name].merge(summary)
+
+    # Print the statistics of the values of a variable in each category
+    def print_summaries(self,variable):
+        print variable.title
+        for category in self.categories:
+            summary=variable.summaries[category.name]
+            if summary.count()==0: continue
+            print "\t%s\t%f\t%f\t%s"%(category.title,summary.average(),summary.std(),summary.quantile(0.5))
 
     def deinit(self):
         suffix='' if self.suffix==None else '_%s'%self.suffix
@@ -148,7 +155,7 @@ class VariableSortedAnalysis(Analysis.Analysis):
             f.cd()
 
         # Draw
-        c=TCanvas()
+        c=ROOT.TCanvas()
         if self.logy:
             c.SetLogy(True)
 
@@ -156,22 +163,23 @@ class VariableSortedAnalysis(Analysis.Analysis):
             c.Clear()
 
             ## Create a stacked histogram
-            variable.hist=THStack(prefix+variable.name+suffix,self.bigtitle)
+            variable.hist=ROOT.THStack(prefix+variable.name+suffix,self.bigtitle)
 
             # Make a list of histograms
             hists=[]
             for category in self.categories:
                 h=variable.categories[category.name]
-                if h.Integral()==0: continue # ignore empty histograms
+                if h.integral()==0: continue # ignore empty histograms
                 hists.append(h)
             if len(hists)==0: continue
-            if self.sort_graphs: hists=sorted(hists,key=lambda h: h.Integral())
+            if self.sort_graphs: hists=sorted(hists,key=lambda h: h.integral())
 
             # Add histograms
             for h in hists:
-                if self.norm_mode=='1': h.Scale(1./h.Integral())
-                h.Sumw2()
-                variable.hist.Add(h,h.opt)
+                if self.norm_mode=='1': h.scale(1./h.integral())
+                hroot=h.root()
+                hroot.Sumw2()
+                variable.hist.Add(hroot,h.opt)
 
             ## Draw it
             opts=''
@@ -194,9 +202,12 @@ class VariableSortedAnalysis(Analysis.Analysis):
             outfileName="%s-%s"%(self.name,variable.hist.GetName())
             outfileName=outfileName.replace('/','-')
             if self.output_type=='png':
-                c.SaveAs("%s.png"%outfileName)
+                Renderer.save(c,"%s.png"%outfileName)
             elif self.output_type=='eps':
-                c.SaveAs("%s.eps"%outfileName)
+                Renderer.save(c,"%s.eps"%outfileName)
             elif self.output_type=='root':
                 variable.hist.Write()
 
+            # Dump some stats, while we are there..
+            self.print_summaries(variable)
+
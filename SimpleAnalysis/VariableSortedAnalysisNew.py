@@ -1,8 +1,8 @@
 from SimpleAnalysis import Analysis
 from SimpleAnalysis import OutputFactory
 from SimpleAnalysis import Category
-
-from ROOT import *
+from SimpleAnalysis import HistogramFactory
+from SimpleAnalysis import Statistics
 
 # This is a general class to compare variables for a set of simulated events,
 # but split into different categories based on some selection. No distinction
@@ -20,7 +20,8 @@ from ROOT import *
 #
 # If a variable to be plotted returns a list of numbers, all of them are added to
 # a histogram invididually. The category variable can return a list of the same
-# size to sort each entry into a different category.
+# size to sort each entry into a different category. The mean, RMS and median of
+# the values in each category are printed at the end (see Statistics).
 #
 # For Variable objects, the following attributes should be set to configure the
 # x-axis:
@@ -29,6 +30,7 @@ from ROOT import *
 #  nbins: Number of bins in histogram
 #  minval: Minimum value in histogram
 #  maxval: Maximum value in histogram
+#  (the binning is picked by the Manager if none is defined, see Manager.autobin)
 #
 class VariableSortedAnalysis(Analysis.Analysis):
     def __init__(self):
@@ -48,34 +50,24 @@ class VariableSortedAnalysis(Analysis.Analysis):
         # Book histograms for all the variables
         for variable in self.variables:
             variable.categories={}
+            variable.summaries={}
             for category in self.categories:
                 self.book_category(variable,category)
 
     def book_category(self,variable,category):
-        h=TH1F("%s_%s"%(variable.name,category.name),
-               category.title,
-               variable.nbins,
-               variable.minval,
-               variable.maxval)
-        if hasattr(category,'linecolor'):
-            h.SetLineColor(category.linecolor)
-        if hasattr(category,'linestyle'):
-            h.SetLineStyle(category.linestyle)
-        if hasattr(category,'fillcolor'):
-            h.SetFillColor(category.fillcolor)
-        if hasattr(category,'options'):
-            h.SetOption(category.options)
-        else:
-            h.SetOption('HIST')
+        h=HistogramFactory.book("%s_%s"%(variable.name,category.name),
+                                category.title,
+                                HistogramFactory.axis(variable))
+        h.set_style(category)
 
         # Set x-axis title
         title=variable.title
         if hasattr(variable,'units') and variable.units!=None:
             title+=' (%s)'%variable.units
-        h.SetXTitle(title)
-
+        h.xtitle=title
 
         variable.categories[category.name]=h
+        variable.summaries[category.name]=Statistics.Summary()
 
     def run_event(self):
         if self.category!=None:
@@ -88,32 +80,46 @@ class VariableSortedAnalysis(Analysis.Analysis):
             variable=self.variables[i]
 
             # Get the value to fill the histogram with
-            values=variable.wvalue()
-
-            if values==None: continue # Do not fill if no value returned
-            if type(values)!=list:
-                values=[values]
+            wvalues=variable.warray()
+            if wvalues==None: continue # Do not fill if no value returned
+            values,weights=Analysis.as_arrays(wvalues)
 
-            # Prepare a list of corresponding categories
-            if type(category)!=list:
-                vcategory=[category]*len(values)
-            else:
-                vcategory=category
-
-            if len(vcategory)!=len(values):
+            # Check the corresponding categories
+            if type(category)==list and len(category)!=len(values):
                 print 'ERROR: variable count != category count'
                 continue
 
             # Fill the histograms
-            for j in range(len(values)):
-                value=values[j]
-                vcat=vcategory[j]
+            for vcat,idx in Category.group(category):
                 if vcat==None or vcat not in variable.categories: continue
                 h=variable.categories[vcat]
-                if type(value)==tuple:
-                    h.Fill(value[0],value[1])
-                else:
-                    h.Fill(value)
+                h.fill(values[idx],weights[idx])
+                variable.summaries[vcat].add(values[idx],weights[idx])
+
+    def binned_variables(self):
+        return self.variables
+
+    def serialize(self):
+        return {'histograms':[variable.categories for variable in self.variables],
+                'summaries':[variable.summaries for variable in self.variables]}
+
+    def merge(self,state):
+        for variable,categories in zip(self.variables,state['histograms']):
+            for name,h in categories.items():
+                if name in variable.categories:
+                    variable.categories[name].add(h)
+        for variable,summaries in zip(self.variables,state['summaries']):
+            for name,summary in summaries.items():
+                if name in variable.summaries:
+                    variable.summaries[name].merge(summary)
+
+    # Print the statistics of the values of a variable in each category
+    def print_summaries(self,variable):
+        print variable.title
+        for category in self.categories:
+            summary=variable.summaries[category.name]
+            if summary.count()==0: continue
+            print "\t%s\t%f\t%f\t%s"%(category.title,summary.average(),summary.std(),summary.quantile(0.5))
 
     def deinit(self):
         # Get list of histograms to save
@@ -122,12 +128,17 @@ class VariableSortedAnalysis(Analysis.Analysis):
         for variable in self.variables:
             # Make a list of histograms
             for category,h in variable.categories.items():
-                if h.Integral()==0: continue # ignore empty histograms
-                h.Sumw2()
+                if h.integral()==0: continue # ignore empty histograms
+                hroot=h.root()
+                hroot.SetOption(h.opt)
+                hroot.Sumw2()
                 if variable.name in hists:
-                    hists[variable.name].append(h)
+                    hists[variable.name].append(hroot)
                 else:
-                    hists[variable.name]=[h]
+                    hists[variable.name]=[hroot]
+
+            # Dump some stats, while we are there..
+            self.print_summaries(variable)
 
         if len(hists.items())>0:
             f=OutputFactory.getTFile()
@@ -0,0 +1,74 @@
+#!/bin/env python
+
+import sys
+import os.path
+import timeit
+import optparse
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from SimpleAnalysis import Analysis
+from SimpleAnalysis import CommonAnalysis
+
+##
+# Micro-benchmark of ProductVariable and SumVariable, which combine the values using
+# combine(), against the pure python implementation (ProductVariable.multiply) that
+# they replaced.
+#
+# The benchmark is run for the typical use case of an event weight multiplied by
+# a list of per-object scale factors (list x scalar), and for two lists of scale
+# factors (list x list).
+
+# Determine the options
+usage = "usage: %prog [options]"
+options_parser=optparse.OptionParser(usage=usage)
+
+options_parser.add_option("-s", "--size", dest="size", type="int", default=10,
+                          help="Length of the list variables.", metavar="SIZE")
+options_parser.add_option("-n", "--number", dest="number", type="int", default=100000,
+                          help="Number of evaluations per measurement.", metavar="NUMBER")
+
+(options, args) = options_parser.parse_args()
+
+## Returns a new copy of a list for every call, since the pure python
+## implementation modifies its arguments in place.
+class ListVariable(Analysis.Variable):
+    def __init__(self,x):
+        Analysis.Variable.__init__(self,'list',(list,float))
+        self.x=x
+
+    def value(self):
+        return list(self.x)
+
+# Pure python sum, element by element
+def add(value1,value2):
+    if type(value1)!=list and type(value2)!=list:
+        return value1+value2
+    if type(value1)!=list:
+        return [value1+value for value in value2]
+    if type(value2)!=list:
+        return [value+value2 for value in value1]
+    return [value1[i]+value2[i] for i in range(len(value1))]
+
+weight=CommonAnalysis.ConstantVariable(0.5)
+sfs1=ListVariable([1.+0.01*i for i in range(options.size)])
+sfs2=ListVariable([1.-0.01*i for i in range(options.size)])
+
+cases=[('list x scalar',[sfs1,weight]),
+       ('list x list',[sfs1,sfs2]),
+       ('list x list x scalar',[sfs1,sfs2,weight])]
+
+print 'List size: %d, evaluations: %d'%(options.size,options.number)
+print '%-32s %10s %10s %10s'%('Case','Python','Combine','Speedup')
+for name,variables in cases:
+    for Class,op in [(CommonAnalysis.ProductVariable,None),(CommonAnalysis.SumVariable,add)]:
+        variable=Class(variables)
+        if op==None: op=variable.multiply
+
+        def python():
+            return reduce(op,[v.value() for v in variables])
+
+        tpython=min(timeit.repeat(python,number=options.number,repeat=3))
+        tcombine=min(timeit.repeat(variable.value,number=options.number,repeat=3))
+        label='%s (%s)'%(name,'product' if Class==CommonAnalysis.ProductVariable else 'sum')
+        print '%-32s %9.3fs %9.3fs %9.2fx'%(label,tpython,tcombine,tpython/tcombine)
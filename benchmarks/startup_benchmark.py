@@ -0,0 +1,47 @@
+#!/bin/env python
+
+import sys
+import os.path
+import subprocess
+import timeit
+import optparse
+
+##
+# Benchmark of the startup time of run_analysis.py.
+#
+# Each case is run in a fresh python process, so that nothing is cached from the
+# previous ones. The import of all of ROOT and the styling of the plots that were
+# done at the start of every run are compared to importing ROOT and the modules of
+# the framework only.
+
+# Determine the options
+usage = "usage: %prog [options]"
+options_parser=optparse.OptionParser(usage=usage)
+
+options_parser.add_option("-n", "--number", dest="number", type="int", default=5,
+                          help="Number of processes started per measurement.", metavar="NUMBER")
+
+(options, args) = options_parser.parse_args()
+
+basedir=os.path.join(os.path.dirname(os.path.abspath(__file__)),'..')
+
+modules='from SimpleAnalysis import Analysis, CommonAnalysis, OutputFactory, VariableFactory, Catalog, Renderer, HistogramFactory'
+style='gROOT.SetStyle("Plain"); gStyle.SetOptStat(""); gStyle.SetPalette(1)'
+
+cases=[('python',['-c','pass']),
+       ('import ROOT',['-c','import ROOT']),
+       ('from ROOT import *',['-c','from ROOT import *']),
+       ('from ROOT import * + style',['-c','from ROOT import *; %s'%style]),
+       ('SimpleAnalysis modules',['-c',modules]),
+       ('run_analysis.py --help',[os.path.join(basedir,'run_analysis.py'),'--help'])]
+
+devnull=open(os.devnull,'w')
+
+print 'Processes per measurement: %d'%options.number
+print '%-32s %10s'%('Case','Time')
+for name,arguments in cases:
+    def start():
+        subprocess.call([sys.executable]+arguments,cwd=basedir,stdout=devnull,stderr=devnull)
+
+    t=min(timeit.repeat(start,number=options.number,repeat=3))/options.number
+    print '%-32s %9.3fs'%(name,t)
@@ -3,18 +3,25 @@
 import sys
 import os.path
 
-from ROOT import *
+import ROOT
 
 from SimpleAnalysis import Analysis
 from SimpleAnalysis import CommonAnalysis
 from SimpleAnalysis import OutputFactory
 from SimpleAnalysis import VariableFactory
+from SimpleAnalysis import Catalog
+from SimpleAnalysis import Renderer
+from SimpleAnalysis import HistogramFactory
 
 import optparse
 import tempfile
 import urlparse
 import struct
 import itertools
+import symtable
+import imp
+import re
+import __builtin__
 
 ##
 # This is a general script to run the analysis on a set of simulated events.
@@ -23,6 +30,12 @@ import itertools
 # The rest of the code loops over all of the events that pass a cut and
 # calls a function inside the "analysis" variable, which must be defined 
 # as a subclass of the Analysis class inside the configuration file.
+#
+# The ROOT names (ie: TLorentzVector, kRed) used by the configuration file, and by
+# the modules next to it that it imports, are available to them without importing
+# them. Other modules must import the ROOT names they use themselves (ie: "from ROOT
+# import TLorentzVector, kRed"), since "from SimpleAnalysis.Analysis import *" does
+# not provide them.
 
 # Determine the options
 usage = "usage: %prog [options] config-file.py"
@@ -30,6 +43,12 @@ options_parser=optparse.OptionParser(usage=usage)
 
 options_parser.add_option("-n", "--nevents", dest="nevents", type="int",
                           help="Number of events to process per file.", metavar="NEVENTS")
+options_parser.add_option("-N", "--nevents-total", dest="nevents_total", type="int",
+                          help="Total number of events to process, spread over the files.", metavar="NEVENTS_TOTAL")
+options_parser.add_option("", "--sampling", dest="sampling", default="first", choices=["first","stride","random"],
+                          help="How events are selected when only some are processed: first, stride or random.", metavar="SAMPLING")
+options_parser.add_option("", "--seed", dest="seed", type="int", default=0,
+                          help="Seed for the stride and random sampling.", metavar="SEED")
 options_parser.add_option("-o", "--output", dest="output",
                           help="Path to the results directory.", metavar="OUTPUT")
 options_parser.add_option("-i", "--input", dest="input",action="append",
@@ -40,6 +59,34 @@ options_parser.add_option("-D", "", dest="define", action="append",
                           help="Define some extra input parameters that can be parsed by analysis scripts.", metavar="KEY[=VALUE]")
 options_parser.add_option("-l", "--loop", dest="loop",action="append",
                           help="A loop file determing what configuration analyses should be tried.", metavar="LOOP")
+options_parser.add_option("-s", "--scan", dest="scan", action="store_true",
+                          help="Scan mode. Evaluate cuts shared by the loop configurations only once per event.", metavar="SCAN")
+options_parser.add_option("-j", "--threads", dest="threads", type="int", default=8,
+                          help="Number of processes used to read the metadata of the input files.", metavar="THREADS")
+options_parser.add_option("-w", "--workers", dest="workers", type="int", default=1,
+                          help="Number of worker processes to distribute the event files over.", metavar="WORKERS")
+options_parser.add_option("", "--chunksize", dest="chunksize", type="int",
+                          help="Split event files into pieces of this many entries for the worker processes. Not compatible with -n, -N or normalized histograms.", metavar="CHUNKSIZE")
+options_parser.add_option("", "--readahead", dest="readahead", type="int",
+                          help="Decompress the input trees ahead of the event loop using this many threads per process (0 for the number of cores).", metavar="THREADS")
+options_parser.add_option("", "--autobin", dest="autobin", type="int", default=10000,
+                          help="Number of entries read to pick the binning of variables without one. Set to 0 to disable.", metavar="AUTOBIN")
+options_parser.add_option("", "--histograms", dest="histograms", default="root", choices=["root","numpy"],
+                          help="Histogram backend: root or numpy.", metavar="HISTOGRAMS")
+options_parser.add_option("", "--no-cutflow-histograms", dest="cutflow_histograms", action="store_false", default=True,
+                          help="Only count the events passing each cut, without filling the cutflow histograms.")
+options_parser.add_option("", "--cut-timing", dest="cut_timing", action="store_true", default=False,
+                          help="Measure the time spent in each cut.")
+options_parser.add_option("", "--release", dest="release", action="append", default=[], choices=["histograms","files","cache"],
+                          help="Free memory after each event file: histograms, files or cache. Can be repeated.", metavar="RELEASE")
+options_parser.add_option("", "--flush-interval", dest="flush_interval", type="int", default=300,
+                          help="Number of seconds between flushes of the output files. Set to 0 to disable.", metavar="FLUSH_INTERVAL")
+options_parser.add_option("", "--render", dest="render", default="inline", choices=["inline","deferred","none"],
+                          help="How images are produced: inline, deferred (in parallel at the end of the run) or none.", metavar="RENDER")
+options_parser.add_option("-r", "--resume", dest="resume", action="store_true",
+                          help="Resume the run from the checkpoint inside the results directory (the latest one, unless set by --output).", metavar="RESUME")
+options_parser.add_option("", "--checkpoint", dest="checkpoint", type="int", default=0,
+                          help="Number of seconds between checkpoints of the run. Disabled by default (0).", metavar="CHECKPOINT")
 
 (options, args) = options_parser.parse_args()
 
@@ -54,12 +101,6 @@ if not os.path.exists(pyfile):
     print "Error: Requested configuration does not exist!"
     sys.exit(-1)
 
-# Some commond settings to make the plots look pretty
-gROOT.SetStyle("Plain");
-gStyle.SetOptStat("");
-gStyle.SetPalette(1);
-#TH1.StatOverflows(True)
-
 if options.output==None and options.test:
     options.output=tempfile.mkdtemp()
 if options.nevents==None and options.test:
@@ -105,6 +146,10 @@ if len(looplists)==0:
 
 # Set the suffix for the OutputFactory, if required
 OutputFactory.setResults(options.output)
+OutputFactory.setResume(options.resume==True)
+OutputFactory.setFlushInterval(options.flush_interval if options.flush_interval>0 else None)
+Renderer.setMode(options.render)
+HistogramFactory.setBackend(options.histograms)
 
 # Add the script location to path to it can load it's own modules
 pypath=os.path.dirname(os.path.abspath(pyfile))
@@ -113,8 +158,91 @@ sys.path.append(pypath)
 ## Manager
 manager=Analysis.Manager()
 manager.nevents=options.nevents
+manager.nevents_total=options.nevents_total
+manager.sampling=options.sampling
+manager.seed=options.seed
+manager.autobin_entries=options.autobin if options.autobin>0 else None
+manager.scan=options.scan==True
+manager.nthreads=options.threads
+manager.nworkers=options.workers
+manager.chunksize=options.chunksize
+manager.readahead=options.readahead
+manager.checkpoint=options.checkpoint if options.checkpoint>0 else None
+manager.resume=options.resume==True
+manager.cutflow_histograms=options.cutflow_histograms
+manager.cutflow_timing=options.cut_timing
+manager.release=options.release
 manager.name=pyfile[:-3]
 
+# Add the ROOT classes and globals (ie: TLorentzVector, kRed) used by the Python file
+# at path to the namespace it is run with. Only the names that it uses without defining
+# them are looked up, instead of importing all of ROOT.
+def import_root_names(path,namespace):
+    top=symtable.symtable(open(path).read(),path,'exec')
+    defined=set([symbol.get_name() for symbol in top.get_symbols() if symbol.is_assigned() or symbol.is_imported()])
+
+    names=set()
+    tables=[top]
+    while len(tables)>0:
+        table=tables.pop()
+        for symbol in table.get_symbols():
+            if (symbol.is_referenced() if table is top else symbol.is_global()):
+                names.add(symbol.get_name())
+        tables.extend(table.get_children())
+
+    for name in names-defined:
+        if name in namespace or hasattr(__builtin__,name): continue
+        try:
+            namespace[name]=getattr(ROOT,name)
+        except AttributeError:
+            pass
+
+##
+# Import hook loading the modules from the directory of the configuration file, with
+# the ROOT names that they use added to them (see import_root_names). These modules
+# used to get them through "from SimpleAnalysis.Analysis import *".
+class RootNamesImporter:
+    def __init__(self,directory):
+        self.directory=directory
+        self.paths={}
+
+    # Only the modules that are found first in the directory of the configuration
+    # file are handled
+    def find_module(self,fullname,path=None):
+        if path!=None or fullname in sys.builtin_module_names: return None
+        try:
+            fh,pathname,description=imp.find_module(fullname,sys.path)
+        except ImportError:
+            return None
+        if fh!=None: fh.close()
+        if description[2]!=imp.PY_SOURCE or os.path.dirname(os.path.abspath(pathname))!=self.directory: return None
+        self.paths[fullname]=pathname
+        return self
+
+    def load_module(self,fullname):
+        if fullname in sys.modules: return sys.modules[fullname]
+        path=self.paths[fullname]
+        module=imp.new_module(fullname)
+        module.__file__=path
+        module.__loader__=self
+        sys.modules[fullname]=module
+        try:
+            import_root_names(path,module.__dict__)
+            execfile(path,module.__dict__)
+        except:
+            del sys.modules[fullname]
+            raise
+        return module
+
+sys.meta_path.insert(0,RootNamesImporter(pypath))
+
+# Point out a missing ROOT name behind a NameError, with how to import it
+def explain_name_error(error):
+    match=re.search("name '(\\w+)' is not defined",str(error))
+    if match==None or not hasattr(ROOT,match.group(1)): return
+    name=match.group(1)
+    print 'ERROR: %s is a ROOT name, which is not imported by "from SimpleAnalysis.Analysis import *" anymore. Add "from ROOT import %s" to the module using it.'%(name,name)
+
 # Load the analysis script
 for i in range(max(len(looplists),1)):
     # Globals used inside analysis setup script
@@ -124,8 +252,13 @@ for i in range(max(len(looplists),1)):
     cuts=[]
     loader=i==0
     analysis=None
-    
-    execfile(pyfile) # Load the config file
+
+    if i==0: import_root_names(pyfile,globals())
+    try:
+        execfile(pyfile) # Load the config file
+    except NameError,error:
+        explain_name_error(error)
+        raise
 
     # Save the analysis to the manager
     manager.cuts=cuts
@@ -136,6 +269,29 @@ for i in range(max(len(looplists),1)):
 # Autoconfigure event files passed through the command line
 if options.input==None: options.input=[]
 
+# Determine if a file is a filelist or just a root file
+def is_root_file(inpath):
+    o=urlparse.urlparse(inpath)
+    if o.scheme!='': # Filelists can only be local
+        return True
+
+    fh=open(inpath,'rb')
+    identifier=fh.read(4)
+    version=fh.read(4)
+    identifier=''.join(struct.unpack('cccc',identifier))
+    version=struct.unpack('>i',version)[0]
+
+    if version>=1000000: fh.seek(41)
+    else: fh.seek(33)
+            
+    compression=fh.read(4)
+    compression=struct.unpack('>i',compression)[0]
+    fh.close()
+#    print identifier,version,compression
+    return identifier=='root' and compression<1000 # Assume the fVersion is not using any numbers in ASCII range
+
+# Expand all of the inputs into a list of (path,tree) pairs
+inputs=[]
 for input in options.input:
     input_parts=input.split(':')
     if len(input_parts)<2:
@@ -144,37 +300,31 @@ for input in options.input:
     intree=input_parts.pop()
     inpath=':'.join(input_parts)
 
-    # Determine if a file is a filelist or just a root file
-    o=urlparse.urlparse(inpath)
-    isROOT=True
-    if o.scheme=='': # Filelists can only be local
-        fh=open(inpath,'rb')
-        identifier=fh.read(4)
-        version=fh.read(4)
-        identifier=''.join(struct.unpack('cccc',identifier))
-        version=struct.unpack('>i',version)[0]
-
-        if version>=1000000: fh.seek(41)
-        else: fh.seek(33)
-            
-        compression=fh.read(4)
-        compression=struct.unpack('>i',compression)[0]
-        fh.close()
-#        print identifier,version,compression
-        if identifier=='root' and compression<1000: # Assume the fVersion is not using any numbers in ASCII range
-            isROOT=True
-        else:
-            isROOT=False
-
-    if isROOT:
-        evset=Analysis.EventFile(inpath,intree)
-        manager.eventfiles.append(evset)
+    if is_root_file(inpath):
+        inputs.append((inpath,intree))
     else:
         fh=open(inpath)
         for inpath in fh:
             inpath=inpath.strip()
-            if inpath.startswith('#'): continue
-            evset=Analysis.EventFile(inpath,intree)
-            manager.eventfiles.append(evset)
+            if inpath=='' or inpath.startswith('#'): continue
+            inputs.append((inpath,intree))
+        fh.close()
+
+# Read the metadata of all of the inputs in parallel, skipping the broken and
+# empty ones
+records=Catalog.prefetch(inputs,options.threads)
+for (inpath,intree),record in zip(inputs,records):
+    if not record['valid']:
+        print 'WARNING: Skipping input \'%s:%s\', tree not found'%(inpath,intree)
+        continue
+    if record['entries']==0:
+        print 'WARNING: Skipping input \'%s:%s\', no entries'%(inpath,intree)
+        continue
+    evset=Analysis.EventFile(inpath,intree)
+    manager.eventfiles.append(evset)
 
-manager.run()
+try:
+    manager.run()
+except NameError,error:
+    explain_name_error(error)
+    raise
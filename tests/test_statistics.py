@@ -0,0 +1,158 @@
+import sys
+import os.path
+import unittest
+import numpy
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+from SimpleAnalysis import Statistics
+
+##
+# Tests of the streaming statistics (Summary and TDigest) against numpy, computed
+# on all of the values at once.
+
+class TestSummary(unittest.TestCase):
+    def setUp(self):
+        rng=numpy.random.RandomState(1)
+        self.values=rng.normal(5.,2.,size=20000)
+        self.weights=rng.uniform(0.5,1.5,size=20000)
+
+    # Weighted mean and variance of all of the values
+    def moments(self,values,weights):
+        mean=numpy.average(values,weights=weights)
+        return mean,numpy.average((values-mean)**2,weights=weights)
+
+    def test_moments(self):
+        summary=Statistics.Summary()
+        for start in range(0,len(self.values),100):
+            summary.add(self.values[start:start+100],self.weights[start:start+100])
+
+        mean,variance=self.moments(self.values,self.weights)
+        self.assertEqual(summary.count(),len(self.values))
+        self.assertAlmostEqual(summary.average(),mean,places=10)
+        self.assertAlmostEqual(summary.variance(),variance,places=8)
+        self.assertEqual(summary.min,self.values.min())
+        self.assertEqual(summary.max,self.values.max())
+
+    def test_scalars(self):
+        summary=Statistics.Summary(buffersize=64)
+        for value,weight in zip(self.values[:1000].tolist(),self.weights[:1000].tolist()):
+            summary.add(value,weight)
+
+        mean,variance=self.moments(self.values[:1000],self.weights[:1000])
+        self.assertEqual(summary.count(),1000)
+        self.assertAlmostEqual(summary.average(),mean,places=10)
+        self.assertAlmostEqual(summary.variance(),variance,places=8)
+
+    def test_scalar_weight(self):
+        summary=Statistics.Summary()
+        summary.add(numpy.array([1.,2.,3.]),2.)
+        self.assertEqual(summary.count(),3)
+        self.assertAlmostEqual(summary.average(),2.)
+        self.assertAlmostEqual(summary.sumw,6.)
+
+    def test_labels_ignored(self):
+        summary=Statistics.Summary()
+        summary.add(numpy.array(['a','b']),numpy.ones(2))
+        summary.add(numpy.zeros(0),numpy.zeros(0))
+        self.assertEqual(summary.count(),0)
+        self.assertEqual(summary.quantile(0.5),None)
+        self.assertEqual(Statistics.binning(summary),None)
+
+    def test_merge(self):
+        summaries=[Statistics.Summary() for i in range(4)]
+        for i in range(len(self.values)):
+            summaries[i%4].add(float(self.values[i]),float(self.weights[i]))
+        total=summaries[0]
+        for summary in summaries[1:]:
+            total.merge(summary)
+
+        mean,variance=self.moments(self.values,self.weights)
+        self.assertEqual(total.count(),len(self.values))
+        self.assertAlmostEqual(total.average(),mean,places=10)
+        self.assertAlmostEqual(total.variance(),variance,places=8)
+        self.assertAlmostEqual(total.quantile(0.5),numpy.median(self.values),delta=0.05)
+
+    def test_merge_empty(self):
+        summary=Statistics.Summary()
+        summary.add(self.values,self.weights)
+        summary.merge(Statistics.Summary())
+        self.assertEqual(summary.count(),len(self.values))
+
+        empty=Statistics.Summary()
+        empty.merge(summary)
+        self.assertEqual(empty.count(),len(self.values))
+        self.assertAlmostEqual(empty.average(),summary.average())
+
+class TestTDigest(unittest.TestCase):
+    def setUp(self):
+        rng=numpy.random.RandomState(2)
+        self.values=rng.exponential(1.,size=50000)
+
+    def check_quantiles(self,digest,values):
+        for q in [0.01,0.1,0.25,0.5,0.75,0.9,0.99]:
+            expected=numpy.percentile(values,100*q)
+            self.assertAlmostEqual(digest.quantile(q),expected,delta=0.02*max(expected,1.))
+        self.assertEqual(digest.quantile(0.),values.min())
+        self.assertEqual(digest.quantile(1.),values.max())
+
+    def test_quantiles(self):
+        digest=Statistics.TDigest()
+        for start in range(0,len(self.values),1000):
+            values=self.values[start:start+1000]
+            digest.add(values,numpy.ones(len(values)))
+        self.check_quantiles(digest,self.values)
+
+    def test_size(self):
+        digest=Statistics.TDigest(compression=100)
+        digest.add(self.values,numpy.ones(len(self.values)))
+        digest.compress()
+        self.assertTrue(len(digest.means)<=2*digest.compression)
+        self.assertAlmostEqual(digest.weights.sum(),len(self.values))
+
+    def test_weights(self):
+        # A weight of 2 is the same as adding the value twice
+        values=self.values[:5000]
+        digest=Statistics.TDigest()
+        digest.add(values,numpy.full(len(values),2.))
+        digest.add(values[:10],numpy.zeros(10)) # Ignored
+        self.check_quantiles(digest,numpy.concatenate([values,values]))
+
+    def test_merge(self):
+        digests=[Statistics.TDigest() for i in range(5)]
+        for i in range(len(digests)):
+            values=self.values[i::len(digests)]
+            digests[i].add(values,numpy.ones(len(values)))
+
+        total=Statistics.TDigest()
+        for digest in digests:
+            total.merge(digest)
+        self.check_quantiles(total,self.values)
+        self.assertAlmostEqual(total.weights.sum(),len(self.values))
+
+    def test_empty(self):
+        digest=Statistics.TDigest()
+        self.assertEqual(digest.quantile(0.5),None)
+        digest.merge(Statistics.TDigest())
+        self.assertEqual(digest.quantile(0.5),None)
+
+class TestBinning(unittest.TestCase):
+    def test_range(self):
+        rng=numpy.random.RandomState(3)
+        values=rng.uniform(0.,10.,size=10000)
+        summary=Statistics.Summary()
+        summary.add(values,numpy.ones(len(values)))
+
+        nbins,minval,maxval=Statistics.binning(summary)
+        self.assertTrue(10<=nbins<=100)
+        self.assertAlmostEqual(minval,0.,delta=0.1)
+        self.assertAlmostEqual(maxval,10.,delta=0.1)
+
+    def test_integer(self):
+        summary=Statistics.Summary()
+        summary.add(numpy.array([0,1,2,3,4,5]*100),1.)
+
+        self.assertEqual(Statistics.binning(summary,integer=True),(6,-0.5,5.5))
+
+if __name__=='__main__':
+    unittest.main()